@@ -7,10 +7,35 @@ For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
 
+import atexit
 import os
 
+from asgiref.sync import sync_to_async
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'HQ_system_for_training.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from HQapp.progress import shutdown_progress_buffer  # noqa: E402
+
+# Записываем накопленный в буфере прогресс просмотра при завершении процесса,
+# даже если сервер не поддерживает протокол lifespan.
+atexit.register(shutdown_progress_buffer)
+
+
+async def application(scope, receive, send):
+    """
+    Приложение ASGI, записывающее накопленный прогресс просмотра при событии lifespan.shutdown.
+    """
+    if scope['type'] != 'lifespan':
+        return await django_application(scope, receive, send)
+
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await sync_to_async(shutdown_progress_buffer)()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
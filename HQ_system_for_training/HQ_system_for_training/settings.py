@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'HQapp.middleware.MetricsMiddleware',
+    'HQapp.middleware.RequestInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,12 +79,43 @@ WSGI_APPLICATION = 'HQ_system_for_training.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Параметры подключения задаются переменными окружения DB_*; по умолчанию — SQLite в db.sqlite3.
+# DB_CONN_MAX_AGE — время жизни постоянного соединения в секундах (0 — соединение на каждый запрос),
+# DB_CONN_HEALTH_CHECKS — проверка постоянного соединения перед повторным использованием.
+# DB_REPLICAS — реплики только для чтения через запятую: хосты для серверных СУБД или файлы для SQLite.
+# В тестах реплики являются зеркалами основной базы.
+DB_ENGINE = os.environ.get('DB_ENGINE', 'django.db.backends.sqlite3')
+
+
+def database_settings(**overrides):
+    return {
+        'ENGINE': DB_ENGINE,
+        'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+        'USER': os.environ.get('DB_USER', ''),
+        'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+        'HOST': os.environ.get('DB_HOST', ''),
+        'PORT': os.environ.get('DB_PORT', ''),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS', '1') == '1',
+        **overrides,
     }
+
+
+DATABASES = {
+    'default': database_settings(),
 }
+for index, replica in enumerate(filter(None, os.environ.get('DB_REPLICAS', '').split(',')), start=1):
+    location = {'NAME': replica} if DB_ENGINE.endswith('sqlite3') else {'HOST': replica}
+    DATABASES[f'replica{index}'] = database_settings(**location, TEST={'MIRROR': 'default'})
+
+DATABASE_ROUTERS = ['HQapp.routers.PrimaryReplicaRouter']
+
+# Псевдонимы реплик, с которых читают представления только для чтения.
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+
+# Время в секундах после изменения данных пользователя или каталога, в течение которого чтения
+# остаются в основной базе; должно быть не меньше задержки репликации.
+REPLICA_PIN_SECONDS = float(os.environ.get('DB_REPLICA_PIN_SECONDS', 5))
 
 
 # Password validation
@@ -125,5 +159,140 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Кэш задается переменными окружения CACHE_BACKEND и CACHE_LOCATION; по умолчанию он хранится в памяти процесса.
+# В кэше хранятся версии закэшированных ответов и отметки чтения из основной базы, которые должны быть общими
+# для всех процессов, поэтому при нескольких процессах или серверах нужен общий бэкенд, например
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache CACHE_LOCATION=redis://127.0.0.1:6379
+# (проверка manage.py check --deploy предупреждает о кэше в памяти процесса: HQapp.W001).
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'hqapp'),
+    }
+}
+
+# Время жизни закэшированных ответов API, в секундах. Устаревшие ответы не читаются
+# благодаря версиям в ключе, поэтому время жизни лишь ограничивает размер кэша.
+RESPONSE_CACHE_TIMEOUT = 300
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'HQapp.tokens.SignedTokenAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'HQapp.pagination.IdCursorPagination',
+    'PAGE_SIZE': 100,
+}
+
+# Аутентификация подписанными токенами (HQapp.tokens): токен действует MAX_AGE секунд. Пользователи кэшируются
+# в памяти процесса (не больше USER_CACHE_SIZE, каждый на USER_CACHE_TTL секунд), поэтому отзыв токенов
+# и блокировка пользователя в других процессах вступают в силу не позже чем через USER_CACHE_TTL секунд.
+TOKEN_AUTH = {
+    'MAX_AGE': 7 * 24 * 60 * 60,
+    'USER_CACHE_SIZE': 10000,
+    'USER_CACHE_TTL': 30,
+}
+
+# Количество объектов, читаемых из базы данных за раз в потоковом режиме списков (?stream=1).
+STREAMING_CHUNK_SIZE = 500
+
+# Время жизни закэшированных доступов пользователей к продуктам, в секундах.
+ACCESS_CACHE_TIMEOUT = 60
+
+# Максимальное количество сигналов прогресса в одном пакете POST /api/progress/batch/.
+PROGRESS_BATCH_MAX_SIZE = 1000
+
+# Массовая выдача доступов /api/products/<id>/access/bulk/: размер порции вставки или удаления строк
+# и максимальное количество пользователей в одном запросе.
+ACCESS_BULK_CHUNK_SIZE = 1000
+ACCESS_BULK_MAX_USERS = 100000
+
+# Свертка журнала событий просмотра (compact_view_events) обрабатывает только события старше этого
+# количества секунд, чтобы не пропустить события еще не зафиксированных транзакций.
+VIEW_EVENT_SETTLE_SECONDS = 5
+
+# Статическая схема OpenAPI (HQapp.schema): файл PATH генерируется командой generate_openapi_schema
+# при развертывании; схема и страницы /swagger/ и /redoc/ кэшируются клиентами MAX_AGE секунд.
+OPENAPI_SCHEMA = {
+    'PATH': os.environ.get('OPENAPI_SCHEMA_PATH', BASE_DIR / 'openapi.json'),
+    'MAX_AGE': 24 * 60 * 60,
+}
+
+# Отложенная запись прогресса просмотра: сигналы накапливаются в памяти процесса
+# и записываются фоновым потоком пакетами по FLUSH_SIZE пар или раз в FLUSH_INTERVAL секунд.
+# MAX_SIZE ограничивает количество пар в буфере, BLOCK_TIMEOUT — ожидание места при переполнении.
+PROGRESS_WRITE_BEHIND = {
+    'ENABLED': False,
+    'MAX_SIZE': 10000,
+    'FLUSH_SIZE': 1000,
+    'FLUSH_INTERVAL': 1.0,
+    'BLOCK_TIMEOUT': 0.5,
+}
+
+# Режим производительности SQLite (HQapp.sqlite): журнал WAL, synchronous=NORMAL, кэш страниц
+# CACHE_SIZE_KB килобайт, отображение в память MMAP_SIZE байт и ожидание блокировки BUSY_TIMEOUT_MS
+# миллисекунд для каждого соединения. При SERIALIZE_WRITES записи прогресса из всех потоков процесса
+# выполняются по очереди одним потоком-писателем. Включается переменной окружения SQLITE_PERFORMANCE=1.
+SQLITE_PERFORMANCE = {
+    'ENABLED': os.environ.get('SQLITE_PERFORMANCE') == '1',
+    'CACHE_SIZE_KB': 64 * 1024,
+    'MMAP_SIZE': 256 * 1024 * 1024,
+    'BUSY_TIMEOUT_MS': 5000,
+    'SERIALIZE_WRITES': True,
+}
+
+# Инструментирование запросов (HQapp.middleware.RequestInstrumentationMiddleware).
+# SAMPLE_RATE — доля запросов, для которых считаются SQL-запросы; SERVER_TIMING — отдавать ли
+# заголовок Server-Timing. Запрос записывается в журнал медленных запросов, если он длился
+# не меньше SLOW_REQUEST_MS миллисекунд или выполнил не меньше SLOW_QUERY_COUNT SQL-запросов.
+# Повторяющимися считаются запросы, выполненные с разными параметрами не меньше DUPLICATE_QUERY_THRESHOLD раз.
+REQUEST_INSTRUMENTATION = {
+    'ENABLED': True,
+    'SAMPLE_RATE': float(os.environ.get('REQUEST_SAMPLE_RATE', 1.0)),
+    'SERVER_TIMING': True,
+    'SLOW_REQUEST_MS': 500,
+    'SLOW_QUERY_COUNT': 50,
+    'DUPLICATE_QUERY_THRESHOLD': 3,
+}
+
+# Метрики Prometheus (GET /metrics). При нескольких процессах (например, воркерах gunicorn)
+# переменная окружения METRICS_MULTIPROC_DIR задает общий каталог, в который каждый процесс
+# сохраняет свои значения раз в FLUSH_INTERVAL секунд; каталог очищается перед запуском сервера.
+METRICS = {
+    'MULTIPROCESS_DIR': os.environ.get('METRICS_MULTIPROC_DIR'),
+    'FLUSH_INTERVAL': 1.0,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+        'slow_requests': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': os.environ.get('SLOW_REQUEST_LOG', BASE_DIR / 'slow_requests.log'),
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'delay': True,
+        },
+    },
+    'loggers': {
+        # Строка с метриками каждого запроса; уровень INFO включает журнал всех запросов
+        'HQapp.requests': {
+            'handlers': ['console'],
+            'level': os.environ.get('REQUEST_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+        'HQapp.slow_requests': {
+            'handlers': ['slow_requests'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
 LOGIN_REDIRECT_URL = "home"
 LOGOUT_REDIRECT_URL = "home"
\ No newline at end of file
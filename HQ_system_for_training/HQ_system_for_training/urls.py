@@ -1,32 +1,18 @@
 from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import TemplateView
-from drf_yasg import openapi
-from drf_yasg.views import get_schema_view
-from rest_framework import permissions
 
-from HQapp.views import AccessibleProductsListView
+from HQapp.views import AccessibleProductsListView, OpenAPIDocsView, metrics_view, openapi_schema_view
 
 
-schema_view = get_schema_view(
-   openapi.Info(
-      title="API",
-      default_version='v1',
-      description="API documentation",
-      terms_of_service="https://www.yourapp.com/terms/",
-      contact=openapi.Contact(email="bar.norilsk@gmail.com"),
-      license=openapi.License(name="alpha"),
-   ),
-   public=True,
-   permission_classes=(permissions.AllowAny,),
-)
-
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('api/', include('HQapp.urls')),
     path("accounts/", include("django.contrib.auth.urls")),
     path('', TemplateView.as_view(template_name='home.html'), name='home'),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    # Схема генерируется командой generate_openapi_schema, см. HQapp.schema
+    path('swagger.json', openapi_schema_view, name='schema-json'),
+    path('swagger/', OpenAPIDocsView.as_view(template_name='swagger.html'), name='schema-swagger-ui'),
+    path('redoc/', OpenAPIDocsView.as_view(template_name='redoc.html'), name='schema-redoc'),
 ]
-
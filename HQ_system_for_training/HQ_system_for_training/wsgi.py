@@ -7,6 +7,7 @@ For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/wsgi/
 """
 
+import atexit
 import os
 
 from django.core.wsgi import get_wsgi_application
@@ -14,3 +15,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'HQ_system_for_training.settings')
 
 application = get_wsgi_application()
+
+from HQapp.progress import shutdown_progress_buffer  # noqa: E402
+
+# Записываем накопленный в буфере прогресс просмотра при завершении процесса.
+atexit.register(shutdown_progress_buffer)
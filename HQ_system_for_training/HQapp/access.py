@@ -0,0 +1,242 @@
+"""
+Проверка доступа пользователей к продуктам.
+
+Доступ проверяется запросом EXISTS к промежуточной таблице Product.users_with_access
+без загрузки всех пользователей продукта. Множество идентификаторов доступных продуктов
+пользователя кэшируется в кэше Django с коротким временем жизни (ACCESS_CACHE_TIMEOUT).
+Кэш сбрасывается при изменении доступов вместе с версиями закэшированных ответов пользователей.
+
+Массовая выдача и отзыв доступов (bulk_change_access) изменяют промежуточную таблицу порциями
+без сигналов m2m_changed, а кэш, статистику и прогресс обновляют один раз для всего пакета.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, pre_delete
+from django.dispatch import receiver
+
+from .models import Product
+from .response_cache import bump_versions, user_scope
+from .stats import apply_access_progress, apply_product_deltas
+
+ProductAccess = Product.users_with_access.through
+
+
+def access_cache_key(user_id):
+    return f'hqapp:access:{user_id}'
+
+
+def get_accessible_product_ids(user):
+    """
+        Возвращает множество идентификаторов продуктов, к которым у пользователя есть доступ.
+
+        Args:
+        user (User): Пользователь.
+
+        Returns:
+        frozenset: Идентификаторы доступных продуктов.
+    """
+    if not user.is_authenticated:
+        return frozenset()
+
+    product_ids = cache.get(access_cache_key(user.pk))
+    if product_ids is None:
+        product_ids = frozenset(ProductAccess.objects.filter(user_id=user.pk).values_list('product_id', flat=True))
+        cache.set(access_cache_key(user.pk), product_ids, settings.ACCESS_CACHE_TIMEOUT)
+    return product_ids
+
+
+async def aget_accessible_product_ids(user):
+    """
+        Асинхронная версия get_accessible_product_ids для асинхронных представлений.
+    """
+    if not user.is_authenticated:
+        return frozenset()
+
+    product_ids = await cache.aget(access_cache_key(user.pk))
+    if product_ids is None:
+        product_ids = frozenset([
+            product_id async for product_id in
+            ProductAccess.objects.filter(user_id=user.pk).values_list('product_id', flat=True)
+        ])
+        await cache.aset(access_cache_key(user.pk), product_ids, settings.ACCESS_CACHE_TIMEOUT)
+    return product_ids
+
+
+def has_product_access(user, product_id):
+    """
+        Проверяет, есть ли у пользователя доступ к продукту.
+
+        Использует закэшированное множество доступных продуктов, а при его отсутствии
+        выполняет запрос EXISTS по индексу промежуточной таблицы.
+
+        Args:
+        user (User): Пользователь.
+        product_id (int): Идентификатор продукта.
+
+        Returns:
+        bool: True, если доступ есть.
+    """
+    if not user.is_authenticated:
+        return False
+
+    product_ids = cache.get(access_cache_key(user.pk))
+    if product_ids is not None:
+        return int(product_id) in product_ids
+    return ProductAccess.objects.filter(user_id=user.pk, product_id=product_id).exists()
+
+
+async def ahas_product_access(user, product_id):
+    """
+        Асинхронная версия has_product_access для асинхронных представлений.
+    """
+    if not user.is_authenticated:
+        return False
+
+    product_ids = await cache.aget(access_cache_key(user.pk))
+    if product_ids is not None:
+        return int(product_id) in product_ids
+    return await ProductAccess.objects.filter(user_id=user.pk, product_id=product_id).aexists()
+
+
+def filter_accessible_progress(progress):
+    """
+        Оставляет прогресс только для уроков, входящих в продукты, к которым у пользователя есть доступ.
+        Доступы всех пар пакета проверяются одним запросом.
+
+        Args:
+        progress (dict): Словарь {(user_id, lesson_id): viewed_duration}.
+
+        Returns:
+        dict: Прогресс пар с доступом.
+    """
+    if not progress:
+        return {}
+    accessible = set(
+        ProductAccess.objects.filter(
+            user_id__in={user_id for user_id, _ in progress},
+            product__lessons__in={lesson_id for _, lesson_id in progress},
+        ).values_list('user_id', 'product__lessons').distinct()
+    )
+    return {key: value for key, value in progress.items() if key in accessible}
+
+
+def invalidate_access(user_ids):
+    """
+        Сбрасывает закэшированные доступы пользователей и делает недействительными их закэшированные ответы.
+
+        Args:
+        user_ids (iterable): Идентификаторы пользователей.
+    """
+    user_ids = list(user_ids)
+    cache.delete_many([access_cache_key(user_id) for user_id in user_ids])
+    bump_versions(map(user_scope, user_ids))
+
+
+def _unique_chunks(user_ids, size):
+    """
+        Разбивает идентификаторы пользователей на порции размера size, пропуская повторы.
+    """
+    seen = set()
+    chunk = []
+    for user_id in user_ids:
+        if user_id in seen:
+            continue
+        seen.add(user_id)
+        chunk.append(user_id)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def bulk_change_access(product_id, user_ids, revoke=False):
+    """
+        Выдает или отзывает доступ к продукту множеству пользователей.
+
+        Идентификаторы читаются по мере обработки, поэтому могут поступать из потока (например, загружаемого CSV).
+        Строки промежуточной таблицы вставляются с ignore_conflicts или удаляются порциями по
+        ACCESS_BULK_CHUNK_SIZE в одной транзакции. Строка продукта блокируется до чтения существующих доступов,
+        поэтому параллельные изменения доступов к тому же продукту выполняются по очереди и каждый доступ
+        учитывается в количестве студентов и прогрессе один раз. Сигналы m2m_changed не отправляются:
+        количество студентов продукта обновляется одним запросом, а кэш доступов и версии ответов
+        пользователей сбрасываются одним обращением к кэшу после фиксации транзакции.
+
+        Args:
+        product_id (int): Идентификатор продукта.
+        user_ids (iterable): Идентификаторы пользователей; повторы пропускаются.
+        revoke (bool): Отозвать доступ вместо выдачи.
+
+        Returns:
+        dict: Количество уникальных идентификаторов (requested), выданных или отозванных доступов (changed),
+        пользователей, у которых доступ уже был или которых не было (unchanged), и несуществующих пользователей (unknown).
+    """
+    counts = dict.fromkeys(('requested', 'changed', 'unchanged', 'unknown'), 0)
+    changed = []
+    with transaction.atomic():
+        list(Product.objects.select_for_update().filter(pk=product_id).values_list('pk', flat=True))
+        for chunk in _unique_chunks(user_ids, settings.ACCESS_BULK_CHUNK_SIZE):
+            known = set(User.objects.filter(pk__in=chunk).values_list('pk', flat=True))
+            # Отзываются только заблокированные строки: удаленные параллельно не попадут в выборку
+            with_access = set(
+                ProductAccess.objects.select_for_update().filter(product_id=product_id, user_id__in=known)
+                .values_list('user_id', flat=True)
+            )
+            if revoke:
+                targets = with_access
+                ProductAccess.objects.filter(product_id=product_id, user_id__in=targets).delete()
+            else:
+                targets = known - with_access
+                ProductAccess.objects.bulk_create(
+                    [ProductAccess(product_id=product_id, user_id=user_id) for user_id in targets],
+                    ignore_conflicts=True,
+                )
+            apply_access_progress([(product_id, user_id) for user_id in targets], -1 if revoke else 1)
+
+            changed.extend(targets)
+            counts['requested'] += len(chunk)
+            counts['unknown'] += len(chunk) - len(known)
+            counts['unchanged'] += len(known) - len(targets)
+
+        counts['changed'] = len(changed)
+        apply_product_deltas({product_id: {'students_count': -len(changed) if revoke else len(changed)}})
+    invalidate_access(changed)
+    return counts
+
+
+@receiver(m2m_changed, sender=ProductAccess)
+def invalidate_access_on_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+        Сбрасывает кэш доступов пользователей, чьи доступы к продуктам изменились.
+    """
+    if reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_access([instance.pk])
+    elif action == 'pre_clear':
+        instance._access_cleared_users = list(
+            ProductAccess.objects.filter(product_id=instance.pk).values_list('user_id', flat=True)
+        )
+    elif action == 'post_clear':
+        invalidate_access(instance.__dict__.pop('_access_cleared_users', []))
+    elif action in ('post_add', 'post_remove') and pk_set:
+        invalidate_access(pk_set)
+
+
+@receiver(pre_delete, sender=Product)
+def remember_users_before_product_delete(sender, instance, **kwargs):
+    """
+        Запоминает пользователей удаляемого продукта, доступы которых удаляются каскадно.
+    """
+    instance._access_users = list(
+        ProductAccess.objects.filter(product_id=instance.pk).values_list('user_id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_access_on_product_delete(sender, instance, **kwargs):
+    """
+        Сбрасывает кэш доступов пользователей удаленного продукта.
+    """
+    invalidate_access(instance.__dict__.pop('_access_users', []))
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class HqappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'HQapp'
+
+    def ready(self):
+        # Подключаем обработчики сигналов, поддерживающие статистику продуктов, кэш доступов, кэш ответов
+        # и кэш пользователей токенов, настройку соединений в режиме производительности SQLite
+        # и проверку порядка промежуточных слоев.
+        from . import access, middleware, response_cache, sqlite, stats, tokens  # noqa: F401
@@ -0,0 +1,157 @@
+"""
+Асинхронные версии эндпоинтов чтения для запуска под ASGI.
+
+Представления используют асинхронный ORM Django (aget, acount, async for) и не занимают
+поток на время ожидания базы данных и кэша, поэтому один процесс обслуживает
+больше одновременных соединений (например, долгих опросов видеоплеера).
+DRF не поддерживает асинхронные представления, поэтому ответы формируются JsonResponse
+тем же кодировщиком и с теми же данными, что и у синхронных версий. Аутентификация (в том числе
+подписанными токенами) и пагинация выполняются теми же классами DRF, что и в синхронных версиях,
+в потоке sync_to_async, поэтому оба варианта принимают одни и те же учетные данные и параметры страниц.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.http import Http404, HttpResponseNotAllowed, JsonResponse
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.views import exception_handler
+
+from .access import aget_accessible_product_ids, ahas_product_access
+from .models import Product, Lesson, UserLessonView
+from .pagination import IdCursorPagination
+from .routers import async_replica_reads
+from .serializers import LessonSerializer, ProductListSerializer
+from .views import accessible_lessons_queryset, accessible_products_queryset, lessons_with_progress, \
+    product_statistics
+
+
+def json_response(data, status=200):
+    # Те же параметры кодирования, что у JSONRenderer DRF
+    return JsonResponse(data, status=status, safe=False, encoder=JSONEncoder,
+                        json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
+
+
+def error_response(request, exc):
+    """
+    Формирует ответ на исключение DRF так же, как APIView.handle_exception: ошибки аутентификации
+    возвращают 401 с заголовком WWW-Authenticate первого класса аутентификации или 403.
+    """
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        auth_header = request.authenticators[0].authenticate_header(request) if request.authenticators else None
+        if auth_header:
+            exc.auth_header = auth_header
+        else:
+            exc.status_code = 403
+    response = exception_handler(exc, {'request': request})
+    error = json_response(response.data, status=response.status_code)
+    for header in ('WWW-Authenticate', 'Retry-After'):
+        if header in response:
+            error[header] = response[header]
+    return error
+
+
+def async_login_required(view):
+    """
+    Декоратор асинхронного представления чтения: аутентифицирует запрос классами
+    DEFAULT_AUTHENTICATION_CLASSES без блокировки цикла событий и возвращает ошибки DRF
+    (неаутентифицированный запрос, недействительные параметры) с теми же статусами и телом, что и DRF.
+    Декораторы django.views.decorators.http в Django 4.2 не поддерживают асинхронные представления,
+    поэтому метод запроса проверяется здесь же.
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        api_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+        try:
+            # Чтение user выполняет аутентификацию и записывает пользователя в исходный запрос
+            user = await sync_to_async(lambda: api_request.user)()
+            if not user.is_authenticated:
+                raise exceptions.NotAuthenticated()
+            return await view(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            return error_response(api_request, exc)
+
+    return wrapper
+
+
+async def paginate(request, queryset, serialize):
+    """
+    Возвращает страницу объектов в формате IdCursorPagination ({"next", "previous", "results"}).
+
+    Args:
+    request (HttpRequest): Запрос с параметрами cursor и page_size.
+    queryset (QuerySet): Объекты страницы.
+    serialize (callable): Функция, возвращающая сериализованные объекты страницы.
+
+    Returns:
+    dict: Ссылки на соседние страницы и объекты страницы.
+    """
+    paginator = IdCursorPagination()
+    page = await sync_to_async(paginator.paginate_queryset)(queryset, Request(request))
+    return paginator.get_paginated_response(serialize(page)).data
+
+
+@async_login_required
+@async_replica_reads
+async def accessible_lessons(request):
+    """
+    Асинхронная версия AccessibleLessonsListView.
+    """
+    product_ids = await aget_accessible_product_ids(request.user)
+    return json_response(await paginate(
+        request, accessible_lessons_queryset(request.user, product_ids),
+        lambda lessons: LessonSerializer(lessons, many=True).data,
+    ))
+
+
+@async_login_required
+@async_replica_reads
+async def accessible_products(request):
+    """
+    Асинхронная версия AccessibleProductsListView.
+    """
+    expand = {
+        name for name in request.GET.get('expand', '').split(',') if name in ProductListSerializer.expandable_fields
+    }
+    product_ids = await aget_accessible_product_ids(request.user)
+    return json_response(await paginate(
+        request, accessible_products_queryset(product_ids, expand),
+        lambda products: ProductListSerializer(products, many=True, context={'expand': expand}).data,
+    ))
+
+
+@async_login_required
+async def lessons_by_product(request, product_id):
+    """
+    Асинхронная версия LessonsByProductView.
+    """
+    user = request.user
+    if not await ahas_product_access(user, product_id):
+        raise Http404
+    try:
+        product = await Product.objects.aget(pk=product_id)
+    except Product.DoesNotExist:
+        raise Http404
+
+    lessons = [lesson async for lesson in Lesson.objects.filter(included_in_products=product).order_by('pk')]
+    user_lesson_views = {
+        user_lesson_view.lesson_id: user_lesson_view
+        async for user_lesson_view in UserLessonView.objects.filter(user=user, lesson__included_in_products=product)
+    }
+    return json_response(lessons_with_progress(product, lessons, user_lesson_views))
+
+
+@async_login_required
+@async_replica_reads
+async def product_statistic(request):
+    """
+    Асинхронная версия ProductStatisticView.
+    """
+    products = [product async for product in Product.objects.select_related('stats').order_by('pk')]
+    total_users = await User.objects.acount()
+    return json_response(product_statistics(products, total_users))
@@ -0,0 +1,166 @@
+"""
+Измерение производительности эндпоинтов /api/.
+
+Каждый эндпоинт запрашивается через тестовый клиент Django заданное количество раз;
+для него фиксируются задержка (p50 и p95), количество SQL-запросов, суммарное время
+SQL-запросов и размер ответа. Результаты сравниваются с сохраненными базовыми значениями.
+"""
+import statistics
+import time
+from contextlib import contextmanager
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, \
+    teardown_test_environment
+from django.urls import reverse
+
+from .models import Product
+
+# Метрики, сравниваемые с базовыми значениями с учетом допуска, и минимальное абсолютное
+# превышение, которое считается регрессией (чтобы шум на малых значениях не давал ложных срабатываний).
+TOLERATED_METRICS = {
+    'p50_ms': 2.0,
+    'p95_ms': 5.0,
+    'sql_ms': 2.0,
+    'bytes': 256,
+}
+
+
+@contextmanager
+def seeded_database(test_name=None, **dataset):
+    """
+    Создает тестовую базу данных, заполняет ее командой create_test_data с параметрами dataset
+    и возвращает пользователя, у которого есть доступ к продуктам, и доступный ему продукт.
+    База данных удаляется при выходе, рабочие данные не затрагиваются.
+
+    Args:
+    test_name (str, optional): Имя тестовой базы данных, например файл вместо базы SQLite в памяти.
+    """
+    if test_name is not None:
+        connections['default'].settings_dict['TEST']['NAME'] = test_name
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        call_command('create_test_data', stdout=StringIO(), **dataset)
+
+        # Измерения выполняются от имени первого пользователя, у которого есть доступ к продуктам
+        user = User.objects.filter(accessible_products__isnull=False).order_by('pk').first()
+        if user is None:
+            raise CommandError('The dataset gives nobody access to a product, increase --access-ratio')
+        yield user, Product.objects.filter(users_with_access=user).order_by('pk').first()
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+
+def benchmark_endpoints(product, prefix=''):
+    """
+    Возвращает эндпоинты для измерения: словарь {имя: адрес}.
+
+    Args:
+    product (Product): Продукт, доступный пользователю, от имени которого выполняются запросы.
+    prefix (str): Префикс имен маршрутов, 'async-' для асинхронных версий эндпоинтов.
+    """
+    return {
+        'accessible_lessons': reverse(f'{prefix}accessible-lessons-list'),
+        'accessible_products': reverse(f'{prefix}accessible-products-list'),
+        'lessons_by_product': reverse(f'{prefix}lessons-by-product', args=[product.pk]),
+        'product_statistics': reverse(f'{prefix}product-statistics'),
+    }
+
+
+class QueryTimer:
+    """
+    Обертка выполнения SQL-запросов, считающая их количество и суммарное время.
+    В отличие от connection.queries, время не округляется до миллисекунд.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+
+
+def measure_endpoint(client, url, requests, warm=False):
+    """
+    Измеряет эндпоинт.
+
+    Args:
+    client (Client): Аутентифицированный тестовый клиент.
+    url (str): Адрес эндпоинта.
+    requests (int): Количество запросов.
+    warm (bool): Не очищать кэш между запросами.
+
+    Returns:
+    dict: Метрики p50_ms, p95_ms, queries, sql_ms и bytes.
+    """
+    latencies, query_counts, sql_times, sizes = [], [], [], []
+    for _ in range(requests):
+        if not warm:
+            cache.clear()
+        timer = QueryTimer()
+        with connection.execute_wrapper(timer):
+            started = time.perf_counter()
+            response = client.get(url)
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+            latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f'{url} returned {response.status_code}')
+        query_counts.append(timer.count)
+        sql_times.append(timer.seconds * 1000)
+        sizes.append(len(content))
+
+    return {
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'queries': max(query_counts),
+        'sql_ms': round(statistics.median(sql_times), 3),
+        'bytes': max(sizes),
+    }
+
+
+def percentile(values, percent):
+    """
+    Возвращает процентиль методом ближайшего ранга.
+    """
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Сравнивает результаты с базовыми значениями.
+
+    Количество запросов не должно превышать базовое. Остальные метрики не должны превышать
+    базовое значение больше чем в (1 + tolerance) раз и больше чем на минимальный абсолютный порог.
+
+    Returns:
+    list: Описания регрессий.
+    """
+    regressions = []
+    for endpoint, metrics in results.items():
+        expected = baseline.get(endpoint)
+        if expected is None:
+            continue
+        if metrics['queries'] > expected['queries']:
+            regressions.append(f"{endpoint}: queries {metrics['queries']} > baseline {expected['queries']}")
+        for metric, min_excess in TOLERATED_METRICS.items():
+            limit = expected[metric] * (1 + tolerance)
+            if metrics[metric] > limit and metrics[metric] - expected[metric] > min_excess:
+                regressions.append(
+                    f'{endpoint}: {metric} {metrics[metric]} > baseline {expected[metric]} (+{tolerance:.0%})'
+                )
+    return regressions
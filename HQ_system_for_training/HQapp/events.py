@@ -0,0 +1,127 @@
+"""
+Журнал событий просмотра уроков (LessonViewEvent) и его свертка в агрегаты (LessonViewRollup).
+
+События записываются при каждом увеличении прогресса просмотра вместе с обновлением статистики
+и только дополняют журнал. Функция compact_view_events() сворачивает новые события в почасовые
+и посуточные агрегаты по продуктам и урокам, начиная с отметки последнего обработанного события
+(EventWatermark), поэтому каждое событие учитывается один раз, а отчеты читают только агрегаты.
+Урок относится к продуктам, в которые он входит на момент свертки.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Min, Q, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from .models import EventWatermark, LessonViewEvent, LessonViewRollup
+
+ROLLUP_WATERMARK = 'lesson_view_rollups'
+
+BUCKET_FUNCTIONS = {
+    LessonViewRollup.HOUR: TruncHour,
+    LessonViewRollup.DAY: TruncDay,
+}
+ROLLUP_FIELDS = ('watched_seconds', 'events', 'completed')
+
+
+def log_view_events(view_deltas):
+    """
+        Записывает события просмотра одной пакетной вставкой.
+
+        Args:
+        view_deltas (dict): Словарь {(user_id, lesson_id): (приращение времени просмотра, приращение просмотренных)}.
+                            Записываются только приращения, увеличившие прогресс.
+    """
+    now = timezone.now()
+    events = [
+        LessonViewEvent(
+            user_id=user_id, lesson_id=lesson_id, watched_seconds=max(viewed_time, 0), completed=watched > 0,
+            created_at=now,
+        )
+        for (user_id, lesson_id), (viewed_time, watched) in view_deltas.items()
+        if viewed_time > 0 or watched > 0
+    ]
+    if events:
+        LessonViewEvent.objects.bulk_create(events)
+
+
+def _rollup(events, bucket):
+    """
+        Прибавляет события к агрегатам интервала bucket одной пакетной вставкой с обновлением.
+    """
+    truncate = BUCKET_FUNCTIONS[bucket]
+    rows = events.annotate(
+        bucket_start=truncate('created_at', tzinfo=datetime.timezone.utc),
+        product_id=F('lesson__included_in_products'),
+    ).filter(product_id__isnull=False).values('bucket_start', 'product_id', 'lesson_id').annotate(
+        watched_seconds=Sum('watched_seconds'), events=Count('pk'), completed=Count('pk', filter=Q(completed=True)),
+    ).order_by()
+    totals = {(row['bucket_start'], row['product_id'], row['lesson_id']): row for row in rows}
+    if not totals:
+        return
+
+    existing = LessonViewRollup.objects.filter(
+        bucket=bucket,
+        bucket_start__in={key[0] for key in totals},
+        product_id__in={key[1] for key in totals},
+        lesson_id__in={key[2] for key in totals},
+    ).values('bucket_start', 'product_id', 'lesson_id', *ROLLUP_FIELDS)
+    for row in existing:
+        total = totals.get((row['bucket_start'], row['product_id'], row['lesson_id']))
+        if total is not None:
+            for field in ROLLUP_FIELDS:
+                total[field] += row[field]
+
+    LessonViewRollup.objects.bulk_create(
+        [LessonViewRollup(bucket=bucket, **row) for row in totals.values()],
+        update_conflicts=True,
+        unique_fields=['bucket', 'product', 'bucket_start', 'lesson'],
+        update_fields=list(ROLLUP_FIELDS),
+    )
+
+
+def compact_view_events(batch_size=10000, settle_seconds=None):
+    """
+        Сворачивает следующую порцию новых событий в почасовые и посуточные агрегаты.
+
+        Обрабатываются события после отметки EventWatermark, созданные не позже чем settle_seconds назад:
+        идентификаторы выделяются до фиксации транзакций, поэтому более новые события могут еще
+        появиться с меньшими идентификаторами. Отметка сдвигается условным UPDATE в той же транзакции,
+        поэтому одновременные свертки не учитывают события дважды.
+
+        Args:
+        batch_size (int): Максимальное количество событий в порции.
+        settle_seconds (float, optional): По умолчанию — настройка VIEW_EVENT_SETTLE_SECONDS.
+
+        Returns:
+        int: Количество свернутых событий; 0, если новых событий нет.
+    """
+    if settle_seconds is None:
+        settle_seconds = settings.VIEW_EVENT_SETTLE_SECONDS
+    cutoff = timezone.now() - datetime.timedelta(seconds=settle_seconds)
+
+    with transaction.atomic():
+        watermark, _ = EventWatermark.objects.get_or_create(name=ROLLUP_WATERMARK)
+        pending = LessonViewEvent.objects.filter(pk__gt=watermark.last_event_id)
+        batch = list(pending.filter(created_at__lte=cutoff).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return 0
+        upper = batch[-1]
+        unsettled = pending.filter(created_at__gt=cutoff).aggregate(first=Min('pk'))['first']
+        if unsettled is not None:
+            upper = min(upper, unsettled - 1)
+        if upper <= watermark.last_event_id:
+            return 0
+
+        claimed = EventWatermark.objects.filter(
+            pk=watermark.pk, last_event_id=watermark.last_event_id,
+        ).update(last_event_id=upper)
+        if not claimed:
+            return 0  # Порцию уже обработала другая свертка
+
+        events = LessonViewEvent.objects.filter(pk__gt=watermark.last_event_id, pk__lte=upper)
+        for bucket in BUCKET_FUNCTIONS:
+            _rollup(events, bucket)
+        return events.count()
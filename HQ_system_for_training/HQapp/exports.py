@@ -0,0 +1,89 @@
+"""
+Выгрузка статистики продуктов и прогресса пользователей в CSV.
+
+Строки читаются из базы данных итератором пачками по STREAMING_CHUNK_SIZE и сразу записываются,
+поэтому потребление памяти не зависит от объема выгрузки. Одни и те же генераторы строк используются
+потоковыми ответами API и командой export_csv.
+"""
+import csv
+
+from django.conf import settings
+from django.contrib.auth.models import User
+
+from .models import Product, UserLessonView
+from .stats import product_statistic
+
+STATISTICS_COLUMNS = ('product', 'watched_lessons_count', 'total_viewed_time', 'students_count', 'acquisition_percentage')
+PROGRESS_COLUMNS = ('user_id', 'username', 'lesson_id', 'lesson', 'viewed_duration', 'is_viewed', 'last_viewed_date')
+
+
+class Echo:
+    """
+    Псевдобуфер для csv.writer: возвращает записанную строку вместо ее сохранения.
+    """
+
+    def write(self, value):
+        return value
+
+
+def statistics_queryset(owner_id=None):
+    """
+        Продукты для выгрузки статистики, при owner_id — только продукты этого владельца.
+    """
+    products = Product.objects.select_related('stats').order_by('pk')
+    if owner_id is not None:
+        products = products.filter(owner_id=owner_id)
+    return products
+
+
+def progress_queryset(product_id):
+    """
+        Строки прогресса пользователей по урокам продукта в порядке PROGRESS_COLUMNS.
+    """
+    return UserLessonView.objects.filter(lesson__included_in_products=product_id).order_by('user_id', 'lesson_id') \
+        .values_list('user_id', 'user__username', 'lesson_id', 'lesson__title', *PROGRESS_COLUMNS[4:])
+
+
+def statistics_rows(products):
+    """
+        Генерирует заголовок и строки статистики продуктов в том же виде, что ProductStatisticView.
+
+        Args:
+        products (QuerySet): Продукты с select_related('stats').
+    """
+    total_users = User.objects.using(products.db).count()
+    yield STATISTICS_COLUMNS
+    for product in products.iterator(chunk_size=settings.STREAMING_CHUNK_SIZE):
+        statistic = product_statistic(product, total_users)
+        yield [statistic[column] for column in STATISTICS_COLUMNS]
+
+
+def progress_rows(rows):
+    """
+        Генерирует заголовок и строки прогресса из progress_queryset().
+    """
+    yield PROGRESS_COLUMNS
+    yield from rows.iterator(chunk_size=settings.STREAMING_CHUNK_SIZE)
+
+
+def stream_csv(rows):
+    """
+        Генерирует строки CSV для StreamingHttpResponse.
+    """
+    writer = csv.writer(Echo())
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def write_csv(rows, file):
+    """
+        Записывает строки в файл CSV.
+
+        Returns:
+        int: Количество записанных строк без заголовка.
+    """
+    writer = csv.writer(file)
+    count = -1
+    for count, row in enumerate(rows):
+        writer.writerow(row)
+    return max(count, 0)
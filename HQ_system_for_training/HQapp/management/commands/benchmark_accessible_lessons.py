@@ -0,0 +1,90 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from HQapp.access import get_accessible_product_ids, invalidate_access
+from HQapp.models import Product, Lesson
+from HQapp.serializers import LessonSerializer
+from HQapp.views import accessible_lessons_queryset
+
+
+def legacy_accessible_lessons_queryset(user):
+    """
+    Прежний запрос списка доступных уроков: соединение через M2M с DISTINCT и неиспользуемой предвыборкой.
+    """
+    accessible_products = user.accessible_products.prefetch_related('lessons').all()
+    return Lesson.objects.filter(included_in_products__in=accessible_products).distinct()
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the legacy DISTINCT join with the EXISTS semi-join for the accessible lessons list. '
+        'Benchmark data is created inside a transaction that is rolled back. '
+        'Cold runs clear the cached accessible product IDs before every iteration, warm runs reuse them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000], help='Lesson counts')
+        parser.add_argument('--products', type=int, default=10, help='Products the lessons are spread across')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement, the best one is reported')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'lessons':>8} {'variant':>8} {'cache':>6} {'queries':>8} {'best ms':>10}")
+        for size in options['sizes']:
+            with transaction.atomic():
+                user = self.seed(size, options['products'])
+                for name, build_queryset in (
+                    ('legacy', legacy_accessible_lessons_queryset),
+                    ('exists', accessible_lessons_queryset),
+                ):
+                    for cold in (True, False):
+                        queries, best = self.measure(build_queryset, user, options['repeat'], cold)
+                        self.stdout.write(
+                            f"{size:>8} {name:>8} {'cold' if cold else 'warm':>6} {queries:>8} {best * 1000:>10.1f}"
+                        )
+                transaction.set_rollback(True)
+            # Откат транзакции не затрагивает кэш, поэтому доступы удаленного пользователя сбрасываются явно
+            invalidate_access([user.pk])
+
+    def seed(self, size, product_count):
+        owner = User.objects.create(username='benchmark-owner')
+        user = User.objects.create(username='benchmark-student')
+        products = [Product.objects.create(title=f'Benchmark {i}', owner=owner) for i in range(product_count)]
+        lessons = Lesson.objects.bulk_create([
+            Lesson(title=f'Lesson {i}', video_link='https://example.com', duration=600) for i in range(size)
+        ])
+        links = Product.lessons.through.objects.bulk_create([
+            Product.lessons.through(product_id=products[i % product_count].pk, lesson_id=lesson.pk)
+            for i, lesson in enumerate(lessons)
+        ])
+        # Каждый второй продукт доступен пользователю, часть уроков входит в несколько продуктов
+        Product.lessons.through.objects.bulk_create([
+            Product.lessons.through(product_id=products[(i + 1) % product_count].pk, lesson_id=link.lesson_id)
+            for i, link in enumerate(links[::3])
+        ], ignore_conflicts=True)
+        Product.users_with_access.through.objects.bulk_create([
+            Product.users_with_access.through(product_id=product.pk, user_id=user.pk) for product in products[::2]
+        ])
+        return user
+
+    def measure(self, build_queryset, user, repeat, cold):
+        """
+        Измеряет лучший из repeat запусков. Для холодных запусков перед каждым запуском сбрасывается
+        закэшированное множество доступных продуктов, поэтому измеряется и его запрос; для теплых
+        оно заполняется заранее, и измеряется только выборка уроков.
+        """
+        best = None
+        if not cold:
+            get_accessible_product_ids(user)
+        for _ in range(repeat):
+            if cold:
+                invalidate_access([user.pk])
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                LessonSerializer(build_queryset(user), many=True).data
+                elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return len(context.captured_queries), best
@@ -0,0 +1,94 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from HQapp.benchmarks import benchmark_endpoints, compare_with_baseline, measure_endpoint, seeded_database
+
+DEFAULT_BASELINE = Path(__file__).resolve().parents[2] / 'benchmark_baseline.json'
+DATASET_OPTIONS = ('users', 'products', 'lessons_per_product', 'access_ratio', 'view_ratio', 'seed')
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the /api/ endpoints on a seeded test database and compare latency, query count, '
+        'SQL time and response size with the committed baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=500, help='Number of users to create')
+        parser.add_argument('--products', type=int, default=20, help='Number of products to create')
+        parser.add_argument('--lessons-per-product', type=int, default=20, help='Lessons in each product')
+        parser.add_argument('--access-ratio', type=float, default=0.3,
+                            help='Share of products each user has access to')
+        parser.add_argument('--view-ratio', type=float, default=0.5,
+                            help='Share of accessible lessons each user has progress for')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed of the dataset')
+        parser.add_argument('--requests', type=int, default=30, help='Requests per endpoint')
+        parser.add_argument('--warm', action='store_true', help='Keep the response cache between requests')
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE), help='Baseline JSON file')
+        parser.add_argument('--tolerance', type=float, default=1.0,
+                            help='Allowed relative excess of latency, SQL time and size over the baseline')
+        parser.add_argument('--update-baseline', action='store_true', help='Write the results as the new baseline')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('--requests must be positive')
+        dataset = {name: options[name] for name in DATASET_OPTIONS}
+        dataset['warm'] = options['warm']
+        baseline_path = Path(options['baseline'])
+
+        baseline = None
+        if not options['update_baseline']:
+            if not baseline_path.exists():
+                raise CommandError(f'Baseline {baseline_path} does not exist, run with --update-baseline')
+            baseline = json.loads(baseline_path.read_text())
+            if baseline['dataset'] != dataset:
+                raise CommandError(
+                    f"Dataset {dataset} differs from the baseline dataset {baseline['dataset']}, "
+                    'run with the same options or with --update-baseline'
+                )
+
+        results = self.run(dataset, options['requests'])
+        self.report(results, baseline['endpoints'] if baseline else {})
+
+        if options['update_baseline']:
+            baseline_path.write_text(json.dumps({'dataset': dataset, 'endpoints': results}, indent=2) + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Baseline written to {baseline_path}'))
+            return
+
+        regressions = compare_with_baseline(results, baseline['endpoints'], options['tolerance'])
+        if regressions:
+            raise CommandError('Performance regressions:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
+
+    def run(self, dataset, requests):
+        """
+        Создает тестовую базу данных, заполняет ее и измеряет эндпоинты.
+        База данных удаляется после измерения, рабочие данные не затрагиваются.
+        """
+        options = {name: value for name, value in dataset.items() if name in DATASET_OPTIONS}
+        with seeded_database(**options) as (user, product):
+            client = Client()
+            client.force_login(user)
+            return {
+                name: measure_endpoint(client, url, requests, warm=dataset['warm'])
+                for name, url in benchmark_endpoints(product).items()
+            }
+
+    def report(self, results, baseline):
+        self.stdout.write(
+            f"{'endpoint':<22} {'p50 ms':>8} {'p95 ms':>8} {'queries':>8} {'sql ms':>8} {'bytes':>9}"
+        )
+        for endpoint, metrics in results.items():
+            self.stdout.write(
+                f"{endpoint:<22} {metrics['p50_ms']:>8.2f} {metrics['p95_ms']:>8.2f} {metrics['queries']:>8} "
+                f"{metrics['sql_ms']:>8.2f} {metrics['bytes']:>9}"
+            )
+            expected = baseline.get(endpoint)
+            if expected:
+                self.stdout.write(
+                    f"{'  baseline':<22} {expected['p50_ms']:>8.2f} {expected['p95_ms']:>8.2f} "
+                    f"{expected['queries']:>8} {expected['sql_ms']:>8.2f} {expected['bytes']:>9}"
+                )
@@ -0,0 +1,125 @@
+import asyncio
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+
+from HQapp.benchmarks import benchmark_endpoints, percentile, seeded_database
+
+DUMMY_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare throughput of the synchronous read endpoints served by a WSGI thread pool with the '
+        'async endpoints served by a single ASGI event loop, at several levels of client concurrency.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='Number of users to create')
+        parser.add_argument('--products', type=int, default=10, help='Number of products to create')
+        parser.add_argument('--lessons-per-product', type=int, default=20, help='Lessons in each product')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed of the dataset')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32],
+                            help='Numbers of concurrent clients')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint and concurrency level')
+        parser.add_argument('--wsgi-threads', type=int, default=4, help='Request threads of the WSGI server')
+        parser.add_argument('--endpoints', nargs='+', default=None,
+                            help='Endpoints to measure, by default all of them')
+        parser.add_argument('--cache', action='store_true',
+                            help='Keep the configured cache; by default caching is disabled because only '
+                                 'the synchronous endpoints cache responses')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['wsgi_threads'] < 1 or min(options['concurrency']) < 1:
+            raise CommandError('--requests, --wsgi-threads and --concurrency must be positive')
+        dataset = {
+            'users': options['users'], 'products': options['products'],
+            'lessons_per_product': options['lessons_per_product'], 'seed': options['seed'],
+        }
+
+        with seeded_database(**dataset) as (user, product), \
+                override_settings(**({} if options['cache'] else {'CACHES': DUMMY_CACHES})):
+            # Все клиенты используют одну сессию, чтобы во время измерения не было записей в базу данных
+            login = Client()
+            login.force_login(user)
+            sync_endpoints = benchmark_endpoints(product)
+            async_endpoints = benchmark_endpoints(product, prefix='async-')
+            names = options['endpoints'] or list(sync_endpoints)
+            unknown = set(names) - set(sync_endpoints)
+            if unknown:
+                raise CommandError(f'Unknown endpoints: {", ".join(sorted(unknown))}')
+
+            self.stdout.write(f"{'endpoint':<22} {'server':>6} {'clients':>8} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8}")
+            for name in names:
+                for concurrency in options['concurrency']:
+                    for server, run in (('wsgi', self.run_wsgi), ('asgi', self.run_asgi)):
+                        url = (sync_endpoints if server == 'wsgi' else async_endpoints)[name]
+                        elapsed, latencies = run(login.cookies, url, concurrency, options)
+                        self.stdout.write(
+                            f'{name:<22} {server:>6} {concurrency:>8} {len(latencies) / elapsed:>9.1f} '
+                            f'{statistics.median(latencies):>8.2f} {percentile(latencies, 95):>8.2f}'
+                        )
+
+    def run_wsgi(self, cookies, url, concurrency, options):
+        """
+        Выполняет запросы синхронным клиентом из concurrency потоков; одновременно обрабатывается
+        не больше --wsgi-threads запросов, как в WSGI-сервере с пулом потоков. Задержка включает ожидание потока.
+        """
+        server_threads = threading.Semaphore(options['wsgi_threads'])
+        counts = self.split(options['requests'], concurrency)
+
+        def client_loop(count):
+            client = Client()
+            client.cookies.update(cookies)
+            latencies = []
+            for _ in range(count):
+                started = time.perf_counter()
+                with server_threads:
+                    response = client.get(url)
+                latencies.append((time.perf_counter() - started) * 1000)
+                self.check_response(url, response)
+            return latencies
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(client_loop, counts))
+        return time.perf_counter() - started, [latency for result in results for latency in result]
+
+    def run_asgi(self, cookies, url, concurrency, options):
+        """
+        Выполняет запросы асинхронным клиентом из concurrency сопрограмм в одном цикле событий.
+        """
+        counts = self.split(options['requests'], concurrency)
+
+        async def client_loop(client, count):
+            latencies = []
+            for _ in range(count):
+                started = time.perf_counter()
+                response = await client.get(url)
+                latencies.append((time.perf_counter() - started) * 1000)
+                self.check_response(url, response)
+            return latencies
+
+        clients = [AsyncClient() for _ in counts]
+        for client in clients:
+            client.cookies.update(cookies)
+
+        async def run():
+            started = time.perf_counter()
+            results = await asyncio.gather(*(client_loop(client, count) for client, count in zip(clients, counts)))
+            return time.perf_counter() - started, [latency for result in results for latency in result]
+
+        return asyncio.run(run())
+
+    @staticmethod
+    def split(requests, concurrency):
+        return [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+
+    @staticmethod
+    def check_response(url, response):
+        if response.status_code != 200:
+            raise CommandError(f'{url} returned {response.status_code}')
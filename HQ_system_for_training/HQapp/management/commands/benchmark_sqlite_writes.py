@@ -0,0 +1,122 @@
+import random
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.test import Client, override_settings
+
+from HQapp.benchmarks import benchmark_endpoints, percentile, seeded_database
+from HQapp.models import Product
+from HQapp.progress import shutdown_progress_buffer, write_progress
+
+DUMMY_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure progress write throughput and read latency on a file-backed SQLite database with '
+        'concurrent writer and reader threads, with and without the SQLite performance mode.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='Number of users to create')
+        parser.add_argument('--products', type=int, default=10, help='Number of products to create')
+        parser.add_argument('--lessons-per-product', type=int, default=20, help='Lessons in each product')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed of the dataset')
+        parser.add_argument('--writers', type=int, default=8, help='Threads writing progress batches')
+        parser.add_argument('--readers', type=int, default=4, help='Threads reading lessons of a product')
+        parser.add_argument('--batch-size', type=int, default=20, help='Heartbeats per progress batch')
+        parser.add_argument('--duration', type=float, default=5.0, help='Seconds each mode is measured')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('This benchmark requires the SQLite backend')
+        dataset = {
+            'users': options['users'], 'products': options['products'],
+            'lessons_per_product': options['lessons_per_product'], 'access_ratio': 0.3, 'view_ratio': 0.0,
+            'seed': options['seed'],
+        }
+
+        self.stdout.write(
+            f"{'mode':<12} {'batches/s':>10} {'rows/s':>9} {'locked':>7} {'reads/s':>8} "
+            f"{'read p50':>9} {'read p95':>9}"
+        )
+        for mode, enabled in (('default', False), ('performance', True)):
+            performance = {
+                'ENABLED': enabled, 'CACHE_SIZE_KB': 64 * 1024, 'MMAP_SIZE': 256 * 1024 * 1024,
+                'BUSY_TIMEOUT_MS': 5000, 'SERIALIZE_WRITES': True,
+            }
+            connections.close_all()
+            with tempfile.TemporaryDirectory() as directory, \
+                    override_settings(SQLITE_PERFORMANCE=performance, CACHES=DUMMY_CACHES), \
+                    seeded_database(test_name=str(Path(directory) / 'benchmark.sqlite3'), **dataset) as (user, product):
+                result = self.measure(user, product, options)
+                shutdown_progress_buffer()
+            self.stdout.write(
+                f"{mode:<12} {result['batches'] / options['duration']:>10.1f} "
+                f"{result['rows'] / options['duration']:>9.0f} {result['locked']:>7} "
+                f"{len(result['reads']) / options['duration']:>8.1f} "
+                f"{statistics.median(result['reads'] or [0]):>9.2f} {percentile(result['reads'] or [0], 95):>9.2f}"
+            )
+
+    def measure(self, user, product, options):
+        """
+        Запускает потоки записи прогресса и чтения уроков продукта на время --duration.
+        """
+        pairs = list(
+            Product.users_with_access.through.objects.values_list('user_id', 'product_id')
+        )
+        lessons = {}
+        for product_id, lesson_id in Product.lessons.through.objects.values_list('product_id', 'lesson_id'):
+            lessons.setdefault(product_id, []).append(lesson_id)
+        heartbeats = [(user_id, lesson_id) for user_id, product_id in pairs for lesson_id in lessons[product_id]]
+
+        login = Client()
+        login.force_login(user)
+        url = benchmark_endpoints(product)['lessons_by_product']
+        deadline = time.monotonic() + options['duration']
+        result = {'batches': 0, 'rows': 0, 'locked': 0, 'reads': []}
+        lock = threading.Lock()
+
+        def write(seed):
+            rng = random.Random(seed)
+            try:
+                while time.monotonic() < deadline:
+                    batch = {key: rng.randint(0, 3600) for key in rng.sample(heartbeats, options['batch_size'])}
+                    try:
+                        written = write_progress(batch)['written']
+                    except OperationalError:
+                        with lock:
+                            result['locked'] += 1
+                        continue
+                    with lock:
+                        result['batches'] += 1
+                        result['rows'] += written
+            finally:
+                connection.close()
+
+        def read():
+            client = Client()
+            client.cookies.update(login.cookies)
+            try:
+                while time.monotonic() < deadline:
+                    started = time.perf_counter()
+                    response = client.get(url)
+                    elapsed = (time.perf_counter() - started) * 1000
+                    if response.status_code == 200:
+                        with lock:
+                            result['reads'].append(elapsed)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=write, args=[seed]) for seed in range(options['writers'])]
+        threads += [threading.Thread(target=read) for _ in range(options['readers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return result
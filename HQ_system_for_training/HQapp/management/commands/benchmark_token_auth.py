@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from HQapp.benchmarks import benchmark_endpoints, measure_endpoint, seeded_database
+from HQapp.tokens import create_token
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare requests per second and queries per request of the read endpoints authenticated '
+        'with a session and with a signed token, on a seeded test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='Number of users to create')
+        parser.add_argument('--products', type=int, default=10, help='Number of products to create')
+        parser.add_argument('--lessons-per-product', type=int, default=20, help='Lessons in each product')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed of the dataset')
+        parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint and authentication')
+        parser.add_argument('--endpoints', nargs='+', default=['accessible_products'],
+                            help='Endpoints to measure (default: accessible_products)')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('--requests must be positive')
+        dataset = {
+            'users': options['users'], 'products': options['products'],
+            'lessons_per_product': options['lessons_per_product'], 'seed': options['seed'],
+        }
+
+        with seeded_database(**dataset) as (user, product):
+            endpoints = benchmark_endpoints(product)
+            unknown = set(options['endpoints']) - set(endpoints)
+            if unknown:
+                raise CommandError(f'Unknown endpoints: {", ".join(sorted(unknown))}')
+
+            session = Client()
+            session.force_login(user)
+            clients = {'session': session, 'token': Client(HTTP_AUTHORIZATION=f'Bearer {create_token(user)}')}
+
+            self.stdout.write(f"{'endpoint':<22} {'auth':>8} {'req/s':>9} {'p50 ms':>8} {'queries':>8}")
+            for name in options['endpoints']:
+                throughput = {}
+                for auth, client in clients.items():
+                    # Кэш ответов не очищается: измеряется стоимость аутентификации, а не формирования ответа
+                    measure_endpoint(client, endpoints[name], 1, warm=True)
+                    started = time.perf_counter()
+                    metrics = measure_endpoint(client, endpoints[name], options['requests'], warm=True)
+                    throughput[auth] = options['requests'] / (time.perf_counter() - started)
+                    self.stdout.write(
+                        f"{name:<22} {auth:>8} {throughput[auth]:>9.1f} {metrics['p50_ms']:>8.2f} "
+                        f"{metrics['queries']:>8}"
+                    )
+                self.stdout.write(f"{'':<22} {'gain':>8} {throughput['token'] / throughput['session']:>8.2f}x")
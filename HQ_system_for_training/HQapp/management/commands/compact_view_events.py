@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from HQapp.events import compact_view_events
+
+
+class Command(BaseCommand):
+    help = (
+        'Roll up lesson view events recorded since the last watermark into hourly and daily '
+        'per-product, per-lesson aggregates.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help='Events rolled up per transaction')
+        parser.add_argument('--settle-seconds', type=float, default=None,
+                            help='Skip events younger than this, by default VIEW_EVENT_SETTLE_SECONDS')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        total = 0
+        while True:
+            compacted = compact_view_events(options['batch_size'], options['settle_seconds'])
+            if not compacted:
+                break
+            total += compacted
+        self.stdout.write(self.style.SUCCESS(f'Rolled up {total} lesson view events'))
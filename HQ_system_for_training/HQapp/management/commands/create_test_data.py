@@ -1,49 +1,261 @@
-from django.core.management.base import BaseCommand
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import django
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
-from HQapp.models import Product, Lesson, UserLessonView
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections
+from django.db.models import Max
+from django.db.models.signals import post_delete, pre_delete
 from faker import Faker
-import random
+
+from HQapp.models import Product, Lesson, UserLessonView, ProductStats, UserProductProgress, LessonViewEvent, \
+    LessonViewRollup, EventWatermark, UserTokenVersion
+from HQapp.response_cache import CATALOG, bump_versions
+from HQapp.stats import rebuild_product_stats, rebuild_user_progress, rebuild_stats_after_delete, \
+    remember_products_before_delete
+from HQapp.tokens import USER_CACHE, invalidate_cached_user
+
+ProductLesson = Product.lessons.through
+ProductAccess = Product.users_with_access.through
+
+# Таблицы, очищаемые запросами DELETE без сигналов: сначала зависимые, затем продукты и уроки
+CLEARED_MODELS = (
+    LessonViewEvent, LessonViewRollup, EventWatermark, UserLessonView, UserProductProgress, ProductStats,
+    UserTokenVersion, ProductAccess, ProductLesson, Product, Lesson,
+)
+
+# Обработчики удаления пользователя, которые при очистке только выполняли бы лишние запросы
+USER_DELETE_RECEIVERS = (
+    (pre_delete, remember_products_before_delete),
+    (post_delete, rebuild_stats_after_delete),
+    (post_delete, invalidate_cached_user),
+)
+
+
+@contextmanager
+def receivers_disconnected(sender, receivers):
+    for signal, receiver in receivers:
+        signal.disconnect(receiver, sender=sender)
+    try:
+        yield
+    finally:
+        for signal, receiver in receivers:
+            signal.connect(receiver, sender=sender)
+
+
+def _init_worker():
+    # Процессы-исполнители не должны использовать соединения с базой данных родительского процесса
+    django.setup()
+    connections.close_all()
+
+
+def create_users(options, start_id, end_id):
+    """
+    Создает пользователей с идентификаторами из диапазона [start_id, end_id) одним пакетом.
+    Пароль хешируется один раз в родительском процессе и переиспользуется.
+    """
+    User.objects.bulk_create([
+        User(id=user_id, username=f'user{user_id}', email=f'user{user_id}@example.com',
+             password=options['password_hash'])
+        for user_id in range(start_id, end_id)
+    ], batch_size=options['batch_size'])
+    return end_id - start_id
+
+
+def create_progress(options, start_id, end_id):
+    """
+    Создает доступы к продуктам и просмотры уроков для пользователей из диапазона [start_id, end_id)
+    и пересчитывает их прогресс, поэтому в памяти находятся только пары пользователей одного диапазона.
+    Генератор случайных чисел зависит только от зерна и диапазона, поэтому результат
+    не зависит от количества процессов.
+    """
+    rng = random.Random(f"{options['seed']}:{start_id}")
+    catalog = options['catalog']
+    product_ids = list(catalog)
+    access_count = round(options['access_ratio'] * len(product_ids))
+
+    # Уроки с известной длительностью, по которым bulk_create() вычисляет статус просмотра без запросов
+    lessons = {
+        lesson_id: Lesson(pk=lesson_id, duration=duration)
+        for product_lessons in catalog.values() for lesson_id, duration in product_lessons
+    }
+    accesses, views = [], []
+    for user_id in range(start_id, end_id):
+        for product_id in rng.sample(product_ids, k=access_count):
+            accesses.append(ProductAccess(product_id=product_id, user_id=user_id))
+            for lesson_id, duration in catalog[product_id]:
+                if rng.random() < options['view_ratio']:
+                    views.append(UserLessonView(
+                        user_id=user_id, lesson=lessons[lesson_id], viewed_duration=rng.randint(0, duration),
+                    ))
+
+    ProductAccess.objects.bulk_create(accesses, batch_size=options['batch_size'])
+    UserLessonView.objects.bulk_create(views, batch_size=options['batch_size'])
+    rebuild_user_progress(user_ids=range(start_id, end_id))
+    return len(accesses) + len(views)
+
+
+def _run_chunk(task):
+    function, options, start_id, end_id = task
+    return function(options, start_id, end_id)
+
 
 class Command(BaseCommand):
     help = 'Create test data for the application'
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Number of users to create')
+        parser.add_argument('--products', type=int, default=10, help='Number of products to create')
+        parser.add_argument('--lessons-per-product', type=int, default=10, help='Lessons in each product')
+        parser.add_argument('--access-ratio', type=float, default=0.3,
+                            help='Share of products each user has access to')
+        parser.add_argument('--view-ratio', type=float, default=1.0,
+                            help='Share of accessible lessons each user has progress for')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducible datasets')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Users generated in memory at once')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT statement')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Worker processes, each handling a disjoint user ID range')
+        parser.add_argument('--keep-existing', action='store_true', help='Do not delete existing data first')
+
+    def handle(self, *args, **options):
+        if not 0 <= options['access_ratio'] <= 1 or not 0 <= options['view_ratio'] <= 1:
+            raise CommandError('--access-ratio and --view-ratio must be between 0 and 1')
+        if options['users'] < 1 or options['chunk_size'] < 1 or options['workers'] < 1:
+            raise CommandError('--users, --chunk-size and --workers must be positive')
+        if options['workers'] > 1 and connections['default'].vendor == 'sqlite':
+            self.stderr.write('SQLite serializes writers, extra worker processes will mostly wait for locks')
+
+        seed = options['seed'] if options['seed'] is not None else random.randrange(2 ** 32)
+        self.stdout.write(f'Using seed {seed}')
+
+        if not options['keep_existing']:
+            self.clear(options['batch_size'])
+
+        first_user_id = (User.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+        user_ids = (first_user_id, first_user_id + options['users'])
+        chunk_options = {
+            'seed': seed,
+            'batch_size': options['batch_size'],
+            'access_ratio': options['access_ratio'],
+            'view_ratio': options['view_ratio'],
+            # Хеширование пароля намеренно медленное, поэтому выполняется один раз для всех пользователей
+            'password_hash': make_password('testpassword'),
+        }
+
+        self.run_chunks('users', create_users, chunk_options, user_ids, options)
+        self.reset_sequences(User)
+        chunk_options['catalog'] = self.create_catalog(options, seed, user_ids)
+        self.run_chunks('access and progress rows', create_progress, chunk_options, user_ids, options)
+
+        rebuild_product_stats()
+        self.stdout.write(self.style.SUCCESS('Successfully created test data'))
+
+    def clear(self, batch_size):
+        """
+        Удаляет существующие тестовые данные порциями по batch_size строк, не загружая их в память.
+
+        Таблицы просмотров, журнала событий, прогресса, статистики, версий токенов и связей, а затем
+        продуктов и уроков очищаются запросами DELETE без сигналов. Пользователи удаляются через ORM
+        (вместе со строками таблиц django.contrib.auth) порциями с отключенными обработчиками статистики
+        и кэша токенов: данные, которые они обновляют, уже удалены, а статистика пересчитывается
+        один раз после генерации.
+        """
+        for model in CLEARED_MODELS:
+            self.delete_in_chunks(model, batch_size)
+
+        users = User.objects.exclude(is_superuser=True).order_by('pk').values_list('pk', flat=True)
+        with receivers_disconnected(User, USER_DELETE_RECEIVERS):
+            while chunk := list(users[:batch_size]):
+                User.objects.filter(pk__in=chunk).delete()
+        USER_CACHE.clear()
+        bump_versions([CATALOG])
+
+    @staticmethod
+    def delete_in_chunks(model, batch_size):
+        """
+        Удаляет все строки таблицы модели запросами DELETE не больше чем по batch_size строк,
+        каждый в своей транзакции.
+        """
+        connection = connections['default']
+        table = connection.ops.quote_name(model._meta.db_table)
+        pk = connection.ops.quote_name(model._meta.pk.column)
+        with connection.cursor() as cursor:
+            while True:
+                cursor.execute(f'DELETE FROM {table} WHERE {pk} IN (SELECT {pk} FROM {table} LIMIT %s)', [batch_size])
+                if cursor.rowcount < batch_size:
+                    break
+
+    def reset_sequences(self, *models):
+        """
+        Сдвигает последовательности первичных ключей после вставки строк с явными идентификаторами,
+        иначе следующие записи, созданные без идентификатора (например, в PostgreSQL), получат занятые ключи.
+        """
+        connection = connections['default']
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
+
+    def create_catalog(self, options, seed, user_ids):
+        """
+        Создает продукты и уроки и возвращает каталог {product_id: [(lesson_id, duration), ...]}.
+        """
         fake = Faker()
+        fake.seed_instance(seed)
+        rng = random.Random(seed)
 
-        # Optionally, clear existing data (be cautious with this in a real environment)
-        Product.objects.all().delete()
-        Lesson.objects.all().delete()
-        User.objects.exclude(is_superuser=True).delete()
-        UserLessonView.objects.all().delete()
-
-        # Create some test users
-        users = []
-        for _ in range(10):
-            username = f"{fake.user_name()}{random.randint(1000, 9999)}"  # Добавляем к имени пользователя уникальное число
-            email = fake.email()
-            password = 'testpassword'
-
-            user = User.objects.create_user(username, email, password)
-            users.append(user)
-        #superuser = User.objects.create_superuser('superuser', 'superuser@example.com', 'superpassword')
-
-        # Create some test products and lessons with fake data
-        for _ in range(10):  # e.g. creating 5 products and 10 lessons
-            product = Product.objects.create(title=fake.word(), owner=random.choice(users))
-            product.users_with_access.set(random.sample(users, k=3))  # Randomly adding 3 users with access to this product
-
-            for _ in range(10):
-                lesson = Lesson.objects.create(
+        products = Product.objects.bulk_create([
+            Product(title=fake.word(), owner_id=rng.randrange(*user_ids)) for _ in range(options['products'])
+        ])
+        catalog = {}
+        for product in products:
+            lessons = Lesson.objects.bulk_create([
+                Lesson(
                     title=fake.sentence(),
                     video_link=fake.url(),
-                    duration=fake.random_int(min=300, max=3600)  # Duration between 5 mins and 1 hour
+                    duration=rng.randint(300, 3600),  # Duration between 5 mins and 1 hour
                 )
-                product.lessons.add(lesson)
-
-                for user in users:  # Создаем объекты UserLessonView для каждого пользователя и урока
-                    UserLessonView.objects.create(
-                        user=user,
-                        lesson=lesson,
-                        viewed_duration=random.randint(0, lesson.duration),  # Случайное значение от 0 до duration
-                    )
-        self.stdout.write(self.style.SUCCESS('Successfully created test data'))
+                for _ in range(options['lessons_per_product'])
+            ])
+            ProductLesson.objects.bulk_create([
+                ProductLesson(product_id=product.pk, lesson_id=lesson.pk) for lesson in lessons
+            ])
+            catalog[product.pk] = [(lesson.pk, lesson.duration) for lesson in lessons]
+        self.stdout.write(f'Created {len(products)} products with {options["lessons_per_product"]} lessons each')
+        return catalog
+
+    def run_chunks(self, label, function, chunk_options, user_ids, options):
+        """
+        Выполняет функцию для диапазонов пользователей размером chunk_size, последовательно
+        или в нескольких процессах, и выводит прогресс со скоростью вставки строк.
+        """
+        tasks = [
+            (function, chunk_options, start_id, min(start_id + options['chunk_size'], user_ids[1]))
+            for start_id in range(user_ids[0], user_ids[1], options['chunk_size'])
+        ]
+        started = time.perf_counter()
+        rows = 0
+
+        if options['workers'] > 1:
+            connections.close_all()
+            executor = ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker)
+            results = executor.map(_run_chunk, tasks)
+        else:
+            executor = None
+            results = map(_run_chunk, tasks)
+
+        try:
+            for done, created in enumerate(results, start=1):
+                rows += created
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f'{label}: chunk {done}/{len(tasks)}, {rows} rows, {rows / max(elapsed, 1e-9):.0f} rows/s'
+                )
+        finally:
+            if executor is not None:
+                executor.shutdown()
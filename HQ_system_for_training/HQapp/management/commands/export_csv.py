@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from HQapp.exports import progress_queryset, progress_rows, statistics_queryset, statistics_rows, write_csv
+from HQapp.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Write product statistics or per-user lesson progress of a product to a CSV file'
+
+    def add_arguments(self, parser):
+        export = parser.add_mutually_exclusive_group(required=True)
+        export.add_argument('--statistics', action='store_true', help='Export product statistics')
+        export.add_argument('--product', type=int, help='Export progress of all users in the product with this id')
+        parser.add_argument(
+            '--owner', type=int,
+            help='Only export statistics of products owned by the user with this id (default: all products)',
+        )
+        parser.add_argument('--output', '-o', help='Output file (default: stdout)')
+
+    def handle(self, *args, **options):
+        if options['statistics']:
+            rows = statistics_rows(statistics_queryset(owner_id=options['owner']))
+        else:
+            if not Product.objects.filter(pk=options['product']).exists():
+                raise CommandError(f'Product {options["product"]} does not exist')
+            rows = progress_rows(progress_queryset(options['product']))
+
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as file:
+                count = write_csv(rows, file)
+            self.stdout.write(self.style.SUCCESS(f'Exported {count} rows to {options["output"]}'))
+        else:
+            write_csv(rows, self.stdout)
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from HQapp.schema import write_schema
+
+
+class Command(BaseCommand):
+    help = 'Generate the OpenAPI schema served at /swagger.json, /swagger/ and /redoc/ into a static JSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', help='Output file (default: OPENAPI_SCHEMA["PATH"] setting)')
+
+    def handle(self, *args, **options):
+        path = options['output'] or settings.OPENAPI_SCHEMA['PATH']
+        size = write_schema(path)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {size} bytes of OpenAPI schema to {path}'))
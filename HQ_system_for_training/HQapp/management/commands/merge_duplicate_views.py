@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from HQapp.progress import merge_duplicate_views
+
+
+class Command(BaseCommand):
+    help = (
+        'Merge duplicate lesson views of the same user into one row keeping the maximum viewed_duration. '
+        'Run it before applying the unique (user, lesson) constraint on large tables.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report duplicates, without merging them')
+
+    def handle(self, *args, **options):
+        groups, removed = merge_duplicate_views(dry_run=options['dry_run'])
+        action = 'Would remove' if options['dry_run'] else 'Removed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {removed} duplicate rows in {groups} (user, lesson) groups'
+        ))
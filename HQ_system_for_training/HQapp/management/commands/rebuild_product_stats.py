@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from HQapp.stats import rebuild_product_stats, verify_product_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the precomputed product statistics from scratch and verify them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify-only', action='store_true',
+            help='Only compare stored statistics with the source tables, without rebuilding',
+        )
+
+    def handle(self, *args, **options):
+        if not options['verify_only']:
+            with transaction.atomic():
+                rebuilt = rebuild_product_stats()
+            self.stdout.write(f'Rebuilt statistics for {rebuilt} products')
+
+        mismatches = verify_product_stats()
+        for product_id, field, actual, expected in mismatches:
+            self.stderr.write(f'Product {product_id}: {field} is {actual}, expected {expected}')
+        if mismatches:
+            raise CommandError(f'Found {len(mismatches)} mismatched statistics values')
+        self.stdout.write(self.style.SUCCESS('Product statistics are consistent'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from HQapp.stats import rebuild_user_progress, verify_user_progress
+
+
+class Command(BaseCommand):
+    help = 'Find per-user product progress rows that disagree with the source tables and rebuild them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify-only', action='store_true',
+            help='Only report mismatched progress, without repairing it',
+        )
+
+    def handle(self, *args, **options):
+        mismatches = verify_user_progress()
+        for user_id, product_id, field, actual, expected in mismatches:
+            self.stderr.write(f'User {user_id}, product {product_id}: {field} is {actual}, expected {expected}')
+
+        if mismatches and not options['verify_only']:
+            product_ids = {product_id for _, product_id, *_ in mismatches}
+            with transaction.atomic():
+                repaired = rebuild_user_progress(product_ids)
+            self.stdout.write(f'Rebuilt progress of {repaired} users in {len(product_ids)} products')
+            mismatches = verify_user_progress()
+
+        if mismatches:
+            raise CommandError(f'Found {len(mismatches)} mismatched progress values')
+        self.stdout.write(self.style.SUCCESS('User progress is consistent'))
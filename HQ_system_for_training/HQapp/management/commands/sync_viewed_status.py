@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from HQapp.stats import sync_viewed_status
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute is_viewed for lesson views whose status disagrees with viewed_duration and the lesson '
+        'duration, then rebuild statistics and user progress of the affected products.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report mismatched views, without fixing them')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            changed = sync_viewed_status(dry_run=options['dry_run'])
+        action = 'Would fix' if options['dry_run'] else 'Fixed'
+        self.stdout.write(self.style.SUCCESS(f'{action} the viewed status of {changed} lesson views'))
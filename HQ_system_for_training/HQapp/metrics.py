@@ -0,0 +1,307 @@
+"""
+Метрики в формате Prometheus, собираемые в памяти процесса.
+
+Каждый поток пишет значения в собственный словарь без блокировок; при чтении
+метрик словари всех потоков объединяются. Счетчики и гистограммы завершившегося потока переносятся
+в общий словарь завершившихся потоков, поэтому количество словарей не растет с числом потоков,
+а его датчики (gauge) отбрасываются. Если задан каталог METRICS['MULTIPROCESS_DIR'],
+каждый процесс (например, воркер gunicorn) периодически сохраняет свои значения в файл
+<pid>.json этого каталога, а при чтении метрик суммируются файлы всех процессов.
+Значения датчиков (gauge) завершившихся процессов при этом не учитываются.
+"""
+import atexit
+import bisect
+import itertools
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import weakref
+from collections import defaultdict
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, math.inf)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+logger = logging.getLogger(__name__)
+
+
+class _ThreadStore:
+    """
+    Хранилище значений потока. Освобождается вместе с данными потока (threading.local)
+    при его завершении, после чего значения переносятся в хранилище завершившихся потоков.
+    """
+    __slots__ = ('values', '__weakref__')
+
+    def __init__(self):
+        self.values = {}
+
+
+class MetricsRegistry:
+    """
+    Реестр метрик с потоковыми хранилищами значений.
+
+    Хранилище — словарь {(имя метрики, значения меток): значение}. Поток создает свое хранилище
+    при первой записи (под блокировкой), после чего пишет в него без синхронизации.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        # Повторно входимая блокировка: перенос хранилища может запустить сборщик мусора в любом месте
+        self._lock = threading.RLock()
+        self._stores = {}
+        self._retired = {}
+        self._store_ids = itertools.count()
+        self._local = threading.local()
+        self._flusher_pid = None
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def store(self):
+        try:
+            return self._local.store.values
+        except AttributeError:
+            pass
+        store = _ThreadStore()
+        with self._lock:
+            store_id = next(self._store_ids)
+            self._stores[store_id] = store.values
+            if self._flusher_pid != os.getpid():
+                self._start_flusher()
+        weakref.finalize(store, self._retire, store_id).atexit = False
+        self._local.store = store
+        return store.values
+
+    def _retire(self, store_id):
+        """
+        Переносит значения счетчиков и гистограмм завершившегося потока в хранилище завершившихся потоков.
+        Значения датчиков отбрасываются: они описывают состояние потока (например, его соединения
+        с базой данных), которого после завершения больше нет.
+        """
+        with self._lock:
+            values = self._stores.pop(store_id, None)
+            if values:
+                self._merge_into(self._retired, {
+                    key: value for key, value in list(values.items()) if self.metrics[key[0]].type != 'gauge'
+                })
+
+    def _merge_into(self, merged, values):
+        # list(dict.items()) выполняется атомарно относительно записей других потоков
+        for key, value in list(values.items()):
+            merged[key] = self.metrics[key[0]].merge(merged.get(key), value)
+
+    def local_samples(self):
+        """
+        Объединяет значения всех потоков процесса: {(имя, метки): значение}.
+        """
+        merged = {}
+        # Под блокировкой, чтобы хранилище не было учтено дважды, если его поток завершится во время чтения
+        with self._lock:
+            self._merge_into(merged, self._retired)
+            for values in list(self._stores.values()):
+                self._merge_into(merged, values)
+        return merged
+
+    def collect(self):
+        """
+        Возвращает значения всех процессов, если задан общий каталог, иначе — только текущего.
+        """
+        samples = self.local_samples()
+        directory = settings.METRICS['MULTIPROCESS_DIR']
+        if not directory:
+            return samples
+
+        self.flush()
+        samples = {}
+        for name in os.listdir(directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, name)) as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError):
+                continue  # Файл удален или записывается в этот момент
+            alive = _process_alive(snapshot['pid'])
+            for metric_name, labels, value in snapshot['samples']:
+                metric = self.metrics.get(metric_name)
+                if metric is None or (metric.type == 'gauge' and not alive):
+                    continue
+                key = (metric_name, tuple(labels))
+                samples[key] = metric.merge(samples.get(key), value)
+        return samples
+
+    def flush(self):
+        """
+        Атомарно сохраняет значения процесса в файл общего каталога.
+        """
+        directory = settings.METRICS['MULTIPROCESS_DIR']
+        if not directory:
+            return
+        snapshot = {
+            'pid': os.getpid(),
+            'samples': [[name, list(labels), value] for (name, labels), value in self.local_samples().items()],
+        }
+        # Уникальный временный файл: сохранение вызывают и фоновый поток, и чтение метрик (/metrics)
+        descriptor, temporary = tempfile.mkstemp(dir=directory, prefix=f'{os.getpid()}.', suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'w') as file:
+                json.dump(snapshot, file)
+            os.replace(temporary, os.path.join(directory, f'{os.getpid()}.json'))
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    def _start_flusher(self):
+        self._flusher_pid = os.getpid()
+        if not settings.METRICS['MULTIPROCESS_DIR']:
+            return
+        stopped = threading.Event()
+
+        def run():
+            while not stopped.wait(settings.METRICS['FLUSH_INTERVAL']):
+                try:
+                    self.flush()
+                except Exception:
+                    # Ошибка одного сохранения (например, заполненный диск) не должна останавливать поток
+                    logger.exception('Failed to flush metrics')
+
+        threading.Thread(target=run, name='metrics-flusher', daemon=True).start()
+        atexit.register(self.flush)
+
+    def render(self):
+        """
+        Возвращает метрики в текстовом формате Prometheus.
+        """
+        by_metric = defaultdict(list)
+        for (name, labels), value in sorted(self.collect().items()):
+            by_metric[name].append((labels, value))
+
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for labels, value in by_metric.get(name, []):
+                lines.extend(metric.expose(dict(zip(metric.labelnames, labels)), value))
+        return '\n'.join(lines) + '\n'
+
+
+def _process_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    return '+Inf' if value == math.inf else repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Монотонно возрастающий счетчик.
+    """
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = registry or REGISTRY
+        self.registry.register(self)
+
+    def inc(self, *labels, amount=1):
+        store = self.registry.store()
+        key = (self.name, labels)
+        store[key] = store.get(key, 0) + amount
+
+    @staticmethod
+    def merge(total, value):
+        return value if total is None else total + value
+
+    def expose(self, labels, value):
+        return [f'{self.name}{_format_labels(labels)} {_format_value(value)}']
+
+
+class Gauge(Counter):
+    """
+    Датчик, значение которого складывается из значений всех потоков и процессов.
+    """
+    type = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        """
+        Устанавливает значение датчика для текущего потока.
+        """
+        self.registry.store()[(self.name, labels)] = value
+
+
+class Histogram(Counter):
+    """
+    Гистограмма. Значение — список количеств наблюдений в каждом интервале и их сумма.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, *labels):
+        store = self.registry.store()
+        key = (self.name, labels)
+        counts = store.get(key)
+        if counts is None:
+            counts = store[key] = [0] * (len(self.buckets) + 1)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    @staticmethod
+    def merge(total, value):
+        return list(value) if total is None else [a + b for a, b in zip(total, value)]
+
+    def expose(self, labels, value):
+        lines = []
+        cumulative = 0
+        for bucket, count in zip(self.buckets, value):
+            cumulative += count
+            bucket_labels = dict(labels, le=_format_value(bucket))
+            lines.append(f'{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}')
+        lines.append(f'{self.name}_sum{_format_labels(labels)} {_format_value(value[-1])}')
+        lines.append(f'{self.name}_count{_format_labels(labels)} {cumulative}')
+        return lines
+
+
+REGISTRY = MetricsRegistry()
+
+REQUESTS = Counter('hqapp_http_requests_total', 'HTTP requests by view, method and status.',
+                   ['view', 'method', 'status'])
+REQUEST_LATENCY = Histogram('hqapp_http_request_duration_seconds', 'HTTP request latency by view.', ['view'])
+IN_FLIGHT = Gauge('hqapp_http_requests_in_flight', 'HTTP requests being processed.')
+DB_QUERIES = Histogram('hqapp_db_queries_per_request', 'SQL queries per sampled request by view.', ['view'],
+                       buckets=QUERY_COUNT_BUCKETS)
+DB_DURATION = Histogram('hqapp_db_duration_seconds_per_request', 'SQL time per sampled request by view.', ['view'])
+DB_CONNECTIONS = Gauge('hqapp_db_connections_open', 'Open database connections by alias.', ['alias'])
@@ -0,0 +1,321 @@
+"""
+Инструментирование запросов: SQL-запросы и время обработки.
+
+Для каждого запроса из выборки (настройка REQUEST_INSTRUMENTATION['SAMPLE_RATE']) через
+connection.execute_wrapper считаются SQL-запросы и их суммарное время, а запросы группируются
+по нормализованному SQL: повторение одного и того же запроса с разными параметрами —
+признак проблемы N+1. Результаты возвращаются в заголовке Server-Timing, записываются
+структурированной строкой в журнал HQapp.requests, а медленные запросы вместе с
+нормализованным SQL — в журнал HQapp.slow_requests.
+"""
+import functools
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core import checks
+from django.db import connections
+from django.utils.module_loading import import_string
+from rest_framework.serializers import BaseSerializer
+
+from . import metrics
+
+logger = logging.getLogger('HQapp.requests')
+slow_logger = logging.getLogger('HQapp.slow_requests')
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """
+    Приводит SQL к общему виду: литералы и параметры заменяются на ?, а списки параметров
+    любой длины — на (...), поэтому запросы, отличающиеся только значениями, совпадают.
+    """
+    sql = _STRING_LITERAL.sub('?', sql.replace('%s', '?'))
+    sql = _NUMBER.sub('?', sql)
+    return _PLACEHOLDER_LIST.sub('(...)', sql)
+
+
+class QueryCollector:
+    """
+    Обертка выполнения SQL-запросов, собирающая количество и время запросов по нормализованному SQL.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+        self.shape_seconds = defaultdict(float)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            shape = normalize_sql(sql)
+            self.count += 1
+            self.seconds += elapsed
+            self.shapes[shape] += 1
+            self.shape_seconds[shape] += elapsed
+
+    def duplicates(self, threshold):
+        """
+        Возвращает нормализованные запросы, выполненные не менее threshold раз.
+        """
+        return [
+            {'sql': shape, 'count': count, 'ms': round(self.shape_seconds[shape] * 1000, 2)}
+            for shape, count in self.shapes.most_common() if count >= threshold
+        ]
+
+
+# Измерения текущего запроса; через контекст они доступны сериализаторам, которым запрос не передается
+_current = ContextVar('hqapp_instrumentation', default=None)
+
+
+def _timed_serializer_data(data):
+    """
+    Оборачивает свойство BaseSerializer.data: время формирования данных верхнего уровня
+    без SQL-запросов, выполненных при этом, добавляется к измерению ser текущего запроса.
+    Вложенные сериализаторы входят во время внешнего.
+    """
+    @functools.wraps(data.fget)
+    def wrapper(self):
+        state = _current.get()
+        if state is None or state['serializing']:
+            return data.fget(self)
+        collector = state['collector']
+        state['serializing'] = True
+        started, db_started = time.perf_counter(), collector.seconds if collector else 0.0
+        try:
+            return data.fget(self)
+        finally:
+            db = collector.seconds - db_started if collector else 0.0
+            state['serialize'] += time.perf_counter() - started - db
+            state['serializing'] = False
+
+    return property(wrapper)
+
+
+BaseSerializer.data = _timed_serializer_data(BaseSerializer.data)
+
+
+class RequestInstrumentationMiddleware:
+    """
+    Промежуточный слой, измеряющий SQL-запросы и время обработки запроса.
+
+    Время разбивается на db (SQL-запросы), ser (сериализация: свойство data сериализаторов DRF
+    без SQL-запросов), render (отрисовка ответа DRF или шаблона) и app (остальное: код представления).
+    Для запросов вне выборки
+    измеряется только общее время, чтобы медленные запросы попадали в журнал всегда.
+    Потоковые ответы формируются после выхода из промежуточного слоя, поэтому их SQL не учитывается.
+    Слой поддерживает и синхронный, и асинхронный режим, чтобы не переводить асинхронные представления в поток.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        config = settings.REQUEST_INSTRUMENTATION
+        if not config['ENABLED']:
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        collector = self.start(request, config)
+        with ExitStack() as stack:
+            if collector is not None:
+                self.install(stack, collector)
+            token = _current.set(request._instrumentation)
+            try:
+                response = self.get_response(request)
+            finally:
+                _current.reset(token)
+
+        self.report(request, response, config, collector, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        config = settings.REQUEST_INSTRUMENTATION
+        if not config['ENABLED']:
+            return await self.get_response(request)
+
+        started = time.perf_counter()
+        collector = self.start(request, config)
+        stack = ExitStack()
+        if collector is not None:
+            # Асинхронный ORM выполняет запросы в потоке sync_to_async этого запроса,
+            # поэтому обертка устанавливается на соединения того же потока
+            await sync_to_async(self.install)(stack, collector)
+        token = _current.set(request._instrumentation)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+            await sync_to_async(stack.close)()
+
+        self.report(request, response, config, collector, time.perf_counter() - started)
+        return response
+
+    def start(self, request, config):
+        collector = QueryCollector() if random.random() < config['SAMPLE_RATE'] else None
+        request._instrumentation = {'render': 0.0, 'serialize': 0.0, 'serializing': False, 'collector': collector}
+        return collector
+
+    @staticmethod
+    def install(stack, collector):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(collector))
+
+    def process_template_response(self, request, response):
+        # process_template_response вызывается в обратном порядке MIDDLEWARE. Выше этого слоя нет слоев
+        # с process_template_response (проверка HQapp.W002), поэтому он вызывается последним,
+        # непосредственно перед отрисовкой
+        render_started = time.perf_counter()
+
+        def finish_render(rendered):
+            request._instrumentation['render'] = time.perf_counter() - render_started
+
+        response.add_post_render_callback(finish_render)
+        return response
+
+    def report(self, request, response, config, collector, total):
+        render = request._instrumentation['render']
+        serialize = request._instrumentation['serialize']
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 2),
+            'serialize_ms': round(serialize * 1000, 2),
+            'render_ms': round(render * 1000, 2),
+            'sampled': collector is not None,
+        }
+        timings = [('ser', serialize, None), ('render', render, None)]
+        if collector is not None:
+            duplicates = collector.duplicates(config['DUPLICATE_QUERY_THRESHOLD'])
+            record.update({
+                'queries': collector.count,
+                'db_ms': round(collector.seconds * 1000, 2),
+                'duplicate_queries': sum(duplicate['count'] for duplicate in duplicates),
+            })
+            timings += [
+                ('db', collector.seconds, f'{collector.count} queries'),
+                ('app', max(total - collector.seconds - serialize - render, 0.0), None),
+            ]
+        timings.append(('total', total, None))
+
+        if config['SERVER_TIMING']:
+            response['Server-Timing'] = ', '.join(
+                f'{name};dur={seconds * 1000:.2f}' + (f';desc="{desc}"' if desc else '')
+                for name, seconds, desc in timings
+            )
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(record))
+
+        if total * 1000 >= config['SLOW_REQUEST_MS'] or (
+            collector is not None and collector.count >= config['SLOW_QUERY_COUNT']
+        ):
+            if collector is not None:
+                record['duplicates'] = duplicates
+                record['sql'] = [
+                    {'sql': shape, 'count': count, 'ms': round(collector.shape_seconds[shape] * 1000, 2)}
+                    for shape, count in collector.shapes.most_common()
+                ]
+            slow_logger.warning(json.dumps(record))
+
+
+@checks.register()
+def check_instrumentation_order(app_configs, **kwargs):
+    """
+        Предупреждает, если выше RequestInstrumentationMiddleware в MIDDLEWARE есть слои
+        с process_template_response: они вызываются после него, и их время попадает в render.
+    """
+    path = f'{__name__}.{RequestInstrumentationMiddleware.__name__}'
+    if path not in settings.MIDDLEWARE:
+        return []
+    warnings = []
+    for preceding in settings.MIDDLEWARE[:settings.MIDDLEWARE.index(path)]:
+        try:
+            middleware = import_string(preceding)
+        except ImportError:
+            continue
+        if hasattr(middleware, 'process_template_response'):
+            warnings.append(checks.Warning(
+                f'{preceding} defines process_template_response and is listed before {path}, '
+                'so its work before rendering is reported as render time.',
+                hint=f'Move {path} above {preceding} in MIDDLEWARE.',
+                id='HQapp.W002',
+            ))
+    return warnings
+
+
+class MetricsMiddleware:
+    """
+    Промежуточный слой, обновляющий метрики Prometheus (HQapp.metrics) для каждого запроса.
+
+    Запись метрики — несколько операций со словарем текущего потока без блокировок, поэтому
+    слой не добавляет заметной задержки. Метрики SQL берутся из измерений
+    RequestInstrumentationMiddleware и доступны только для запросов из его выборки.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        metrics.IN_FLIGHT.inc()
+        response = None
+        try:
+            response = self.get_response(request)
+            return response
+        finally:
+            self.record(request, response, started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        metrics.IN_FLIGHT.inc()
+        response = None
+        try:
+            response = await self.get_response(request)
+            return response
+        finally:
+            self.record(request, response, started)
+
+    @staticmethod
+    def record(request, response, started):
+        metrics.IN_FLIGHT.dec()
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        status = str(response.status_code) if response is not None else '500'
+        metrics.REQUESTS.inc(view, request.method, status)
+        metrics.REQUEST_LATENCY.observe(time.perf_counter() - started, view)
+
+        collector = getattr(request, '_instrumentation', {}).get('collector')
+        if collector is not None:
+            metrics.DB_QUERIES.observe(collector.count, view)
+            metrics.DB_DURATION.observe(collector.seconds, view)
+        for connection in connections.all(initialized_only=True):
+            metrics.DB_CONNECTIONS.set(int(connection.connection is not None), connection.alias)
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.5 on 2026-10-17 03:42
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+import django.db.models.deletion
+
+
+def populate_product_stats(apps, schema_editor):
+    """
+    Заполняет статистику для уже существующих продуктов.
+    """
+    Product = apps.get_model('HQapp', 'Product')
+    ProductStats = apps.get_model('HQapp', 'ProductStats')
+    UserLessonView = apps.get_model('HQapp', 'UserLessonView')
+
+    views = UserLessonView.objects.order_by().values('lesson__included_in_products').annotate(
+        viewed_time=Sum('viewed_duration'), watched=Count('pk', filter=Q(is_viewed=True)),
+    )
+    views = {row['lesson__included_in_products']: row for row in views}
+    students = Product.users_with_access.through.objects.order_by().values('product_id').annotate(count=Count('pk'))
+    students = {row['product_id']: row['count'] for row in students}
+
+    ProductStats.objects.bulk_create([
+        ProductStats(
+            product_id=product_id,
+            watched_lessons_count=views.get(product_id, {}).get('watched', 0),
+            total_viewed_time=views.get(product_id, {}).get('viewed_time') or 0,
+            students_count=students.get(product_id, 0),
+        )
+        for product_id in Product.objects.values_list('pk', flat=True)
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('HQapp', '0002_remove_productlesson_lesson_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userlessonview',
+            name='viewed_duration',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='ProductStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('watched_lessons_count', models.IntegerField(default=0)),
+                ('total_viewed_time', models.BigIntegerField(default=0)),
+                ('students_count', models.IntegerField(default=0)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='HQapp.product')),
+            ],
+        ),
+        migrations.RunPython(populate_product_stats, migrations.RunPython.noop),
+    ]
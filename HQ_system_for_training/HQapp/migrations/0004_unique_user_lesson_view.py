@@ -0,0 +1,61 @@
+# Generated by Django 4.2.5 on 2026-10-17 03:44
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+
+
+def merge_duplicate_views(apps, schema_editor):
+    """
+    Объединяет повторяющиеся просмотры одного урока одним пользователем перед добавлением
+    ограничения уникальности, сохраняя максимальный прогресс, и пересчитывает статистику продуктов.
+    """
+    Product = apps.get_model('HQapp', 'Product')
+    ProductStats = apps.get_model('HQapp', 'ProductStats')
+    UserLessonView = apps.get_model('HQapp', 'UserLessonView')
+
+    duplicates = UserLessonView.objects.order_by().values('user_id', 'lesson_id').annotate(
+        count=Count('pk'),
+        viewed_duration=Max('viewed_duration'),
+        last_viewed_date=Max('last_viewed_date'),
+        viewed_count=Count('pk', filter=Q(is_viewed=True)),
+    ).filter(count__gt=1)
+
+    merged = False
+    for group in duplicates.iterator():
+        rows = UserLessonView.objects.filter(user_id=group['user_id'], lesson_id=group['lesson_id'])
+        keep = rows.order_by('-viewed_duration', '-last_viewed_date', 'pk').values_list('pk', flat=True).first()
+        rows.exclude(pk=keep).delete()
+        UserLessonView.objects.filter(pk=keep).update(
+            viewed_duration=group['viewed_duration'],
+            last_viewed_date=group['last_viewed_date'],
+            is_viewed=group['viewed_count'] > 0,
+        )
+        merged = True
+
+    if not merged:
+        return
+
+    views = UserLessonView.objects.order_by().values('lesson__included_in_products').annotate(
+        viewed_time=Sum('viewed_duration'), watched=Count('pk', filter=Q(is_viewed=True)),
+    )
+    views = {row['lesson__included_in_products']: row for row in views}
+    for product_id in Product.objects.values_list('pk', flat=True):
+        ProductStats.objects.filter(product_id=product_id).update(
+            watched_lessons_count=views.get(product_id, {}).get('watched', 0),
+            total_viewed_time=views.get(product_id, {}).get('viewed_time') or 0,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('HQapp', '0003_productstats'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_views, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='userlessonview',
+            constraint=models.UniqueConstraint(fields=('user', 'lesson'), name='unique_user_lesson_view'),
+        ),
+    ]
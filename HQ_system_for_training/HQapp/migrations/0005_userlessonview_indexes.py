@@ -0,0 +1,21 @@
+# Generated by Django 4.2.5 on 2026-10-17 03:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('HQapp', '0004_unique_user_lesson_view'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userlessonview',
+            index=models.Index(fields=['lesson', 'is_viewed'], name='userlessonview_lesson_viewed'),
+        ),
+        migrations.AddIndex(
+            model_name='userlessonview',
+            index=models.Index(fields=['user', 'last_viewed_date'], name='userlessonview_user_date'),
+        ),
+    ]
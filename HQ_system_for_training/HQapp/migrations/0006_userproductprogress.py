@@ -0,0 +1,60 @@
+# Generated by Django 4.2.5 on 2026-10-17 04:17
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+import django.db.models.deletion
+
+
+def populate_user_progress(apps, schema_editor):
+    """
+    Заполняет прогресс для уже выданных доступов к продуктам.
+    """
+    Product = apps.get_model('HQapp', 'Product')
+    UserLessonView = apps.get_model('HQapp', 'UserLessonView')
+    UserProductProgress = apps.get_model('HQapp', 'UserProductProgress')
+
+    totals = Product.lessons.through.objects.order_by().values('product_id').annotate(count=Count('pk'))
+    totals = {row['product_id']: row['count'] for row in totals}
+    views = UserLessonView.objects.order_by().values('user_id', 'lesson__included_in_products').annotate(
+        watched=Sum('viewed_duration'), completed=Count('pk', filter=Q(is_viewed=True)),
+    )
+    views = {(row['user_id'], row['lesson__included_in_products']): row for row in views}
+
+    UserProductProgress.objects.bulk_create([
+        UserProductProgress(
+            user_id=user_id,
+            product_id=product_id,
+            completed_lessons=views.get((user_id, product_id), {}).get('completed', 0),
+            total_lessons=totals.get(product_id, 0),
+            watched_seconds=views.get((user_id, product_id), {}).get('watched') or 0,
+        )
+        for user_id, product_id in Product.users_with_access.through.objects.values_list('user_id', 'product_id')
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('HQapp', '0005_userlessonview_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserProductProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('completed_lessons', models.IntegerField(default=0)),
+                ('total_lessons', models.IntegerField(default=0)),
+                ('watched_seconds', models.BigIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_progress', to='HQapp.product')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_progress', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='userproductprogress',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='unique_user_product_progress'),
+        ),
+        migrations.RunPython(populate_user_progress, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2.5 on 2026-10-17 04:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('HQapp', '0006_userproductprogress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_event_id', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LessonViewEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('watched_seconds', models.IntegerField()),
+                ('completed', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('lesson', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='HQapp.lesson')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LessonViewRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.CharField(choices=[('hour', 'Час'), ('day', 'Сутки')], max_length=4)),
+                ('bucket_start', models.DateTimeField()),
+                ('watched_seconds', models.BigIntegerField(default=0)),
+                ('events', models.IntegerField(default=0)),
+                ('completed', models.IntegerField(default=0)),
+                ('lesson', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='view_rollups', to='HQapp.lesson')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='view_rollups', to='HQapp.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket', 'bucket_start'], name='lessonviewrollup_bucket_start')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='lessonviewrollup',
+            constraint=models.UniqueConstraint(fields=('bucket', 'product', 'bucket_start', 'lesson'), name='unique_lesson_view_rollup'),
+        ),
+    ]
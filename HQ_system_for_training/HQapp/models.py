@@ -1,7 +1,114 @@
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models import Count, ExpressionWrapper, F, FloatField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThanOrEqual
 from django.db.models.signals import pre_save
 from django.dispatch import receiver
+from django.utils import timezone
+
+# Доля длительности урока, после просмотра которой урок считается просмотренным.
+VIEWED_THRESHOLD = 0.8
+
+
+def lesson_is_viewed(viewed_duration, lesson_duration):
+    """
+        Проверяет, просмотрен ли урок: просмотренная длительность составляет
+        не меньше VIEWED_THRESHOLD от длительности урока.
+    """
+    return viewed_duration >= lesson_duration * VIEWED_THRESHOLD
+
+
+def is_viewed_expression(viewed_duration=None, lesson_id=None):
+    """
+        Возвращает SQL-выражение статуса просмотра — то же условие, что и lesson_is_viewed(),
+        с длительностью урока из коррелированного подзапроса, — для запросов UPDATE и фильтров.
+
+        Args:
+        viewed_duration (optional): Новая просмотренная длительность (значение или выражение).
+                                    По умолчанию — текущее значение столбца.
+        lesson_id (optional): Новый урок (идентификатор или выражение). По умолчанию — текущий урок строки.
+    """
+    if viewed_duration is None:
+        viewed_duration = F('viewed_duration')
+    elif not hasattr(viewed_duration, 'resolve_expression'):
+        viewed_duration = Value(viewed_duration)
+    lesson_duration = Subquery(
+        Lesson.objects.filter(pk=OuterRef('lesson_id') if lesson_id is None else lesson_id).values('duration')[:1]
+    )
+    return GreaterThanOrEqual(
+        viewed_duration, ExpressionWrapper(lesson_duration * VIEWED_THRESHOLD, output_field=FloatField()),
+    )
+
+
+class ProductQuerySet(models.QuerySet):
+    """
+        Набор запросов для модели Product.
+
+        Методы:
+        - with_statistics(): Аннотирует продукты статистикой просмотров и количеством студентов.
+    """
+
+    def with_statistics(self):
+        """
+            Аннотирует каждый продукт статистикой коррелированными подзапросами,
+            поэтому вся статистика вычисляется одним SQL-запросом независимо от числа продуктов.
+
+            Аннотации:
+            - watched_lessons_count: Количество просмотренных уроков продукта.
+            - total_viewed_time: Общее время просмотра уроков продукта в секундах.
+            - students_count: Количество пользователей с доступом к продукту.
+        """
+        views = UserLessonView.objects.filter(
+            lesson__included_in_products=OuterRef('pk')
+        ).order_by().values('lesson__included_in_products')
+        watched = views.filter(is_viewed=True).annotate(count=Count('pk')).values('count')
+        viewed_time = views.annotate(total=Sum('viewed_duration')).values('total')
+        students = Product.users_with_access.through.objects.filter(
+            product_id=OuterRef('pk')
+        ).order_by().values('product_id').annotate(count=Count('pk')).values('count')
+
+        return self.annotate(
+            watched_lessons_count=Coalesce(Subquery(watched), 0),
+            total_viewed_time=Coalesce(Subquery(viewed_time), 0),
+            students_count=Coalesce(Subquery(students), 0),
+        )
+
+
+class UserLessonViewQuerySet(models.QuerySet):
+    """
+        Набор запросов для модели UserLessonView.
+
+        Статус просмотра is_viewed всегда вычисляется по просмотренной длительности и длительности урока,
+        в том числе в массовых записях, которые не отправляют сигнал pre_save:
+        - update(): при изменении просмотренной длительности, урока или статуса просмотра
+          статус вычисляется выражением is_viewed_expression() в том же запросе UPDATE.
+        - bulk_create(): статус вычисляется для всех объектов по длительностям уроков,
+          загруженным одним запросом (или по уже загруженным урокам объектов), в том числе при обновлении конфликтующих строк:
+          если update_fields содержит просмотренную длительность или урок, в него добавляется is_viewed.
+    """
+
+    def update(self, **kwargs):
+        if kwargs.keys() & {'viewed_duration', 'lesson', 'lesson_id', 'is_viewed'}:
+            lesson_id = kwargs.get('lesson_id', kwargs.get('lesson'))
+            kwargs['is_viewed'] = is_viewed_expression(
+                kwargs.get('viewed_duration'), lesson_id.pk if isinstance(lesson_id, Lesson) else lesson_id,
+            )
+        return super().update(**kwargs)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        cached = UserLessonView.lesson.is_cached
+        missing = {obj.lesson_id for obj in objs if not cached(obj)}
+        durations = dict(Lesson.objects.filter(pk__in=missing).values_list('pk', 'duration')) if missing else {}
+        for obj in objs:
+            duration = obj.lesson.duration if cached(obj) else durations.get(obj.lesson_id)
+            if duration is not None:
+                obj.is_viewed = lesson_is_viewed(obj.viewed_duration, duration)
+        update_fields = kwargs.get('update_fields')
+        if update_fields and set(update_fields) & PROGRESS_SOURCE_FIELDS and 'is_viewed' not in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'is_viewed']
+        return super().bulk_create(objs, *args, **kwargs)
 
 
 class Product(models.Model):
@@ -25,6 +132,8 @@ class Product(models.Model):
     users_with_access = models.ManyToManyField(User, related_name='accessible_products')
     lessons = models.ManyToManyField('Lesson', related_name='included_in_products')
 
+    objects = ProductQuerySet.as_manager()
+
     def __str__(self):
         return self.title
 
@@ -51,6 +160,10 @@ class Lesson(models.Model):
         return self.title
 
 
+# Поля, от которых зависит статус просмотра is_viewed.
+PROGRESS_SOURCE_FIELDS = frozenset({'viewed_duration', 'lesson', 'lesson_id'})
+
+
 class UserLessonView(models.Model):
     """
         Модель Просмотра Урока Пользователем, представляющая собой информацию
@@ -76,27 +189,219 @@ class UserLessonView(models.Model):
     is_viewed = models.BooleanField(default=False)
     last_viewed_date = models.DateTimeField(auto_now=True)
 
+    objects = UserLessonViewQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'lesson'], name='unique_user_lesson_view'),
+        ]
+        indexes = [
+            models.Index(fields=['lesson', 'is_viewed'], name='userlessonview_lesson_viewed'),
+            models.Index(fields=['user', 'last_viewed_date'], name='userlessonview_user_date'),
+        ]
+
     def __str__(self):
         return f"{self.user} посмотрел {self.lesson}, {self.last_viewed_date}"
 
+    def save(self, *args, update_fields=None, **kwargs):
+        # Статус просмотра вычисляется в pre_save из длительности, поэтому сохраняется вместе с ней
+        if update_fields is not None and set(update_fields) & PROGRESS_SOURCE_FIELDS:
+            update_fields = {*update_fields, 'is_viewed'}
+        super().save(*args, update_fields=update_fields, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Запоминаем загруженный прогресс, чтобы при сохранении обновлять статистику приращениями.
+        instance = super().from_db(db, field_names, values)
+        instance.remember_progress()
+        return instance
+
+    def remember_progress(self):
+        """
+            Сохраняет текущие значения пользователя, урока, просмотренной длительности и статуса просмотра,
+            относительно которых вычисляются приращения статистики при следующем сохранении.
+        """
+        loaded = self.__dict__
+        fields = ('user_id', 'lesson_id', 'viewed_duration', 'is_viewed')
+        if all(name in loaded for name in fields):
+            self._progress_snapshot = tuple(loaded[name] for name in fields)
+
+
+class ProductStats(models.Model):
+    """
+        Модель предварительно вычисленной статистики продукта.
+
+        Поддерживается приращениями при сохранении просмотров уроков и изменении уроков
+        или доступов продукта, поэтому статистика читается без агрегации по UserLessonView.
+
+        Поля:
+        - product (OneToOneField): Продукт, к которому относится статистика.
+        - watched_lessons_count (IntegerField): Количество просмотренных уроков продукта.
+        - total_viewed_time (BigIntegerField): Общее время просмотра уроков продукта в секундах.
+        - students_count (IntegerField): Количество пользователей с доступом к продукту.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='stats')
+    watched_lessons_count = models.IntegerField(default=0)
+    total_viewed_time = models.BigIntegerField(default=0)  # В секундах.
+    students_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Статистика {self.product}"
+
+
+class UserProductProgress(models.Model):
+    """
+        Модель предварительно вычисленного прогресса пользователя по продукту.
+
+        Строка существует для каждой пары (пользователь, продукт), в которой у пользователя есть доступ
+        к продукту, и поддерживается приращениями вместе со статистикой продуктов (HQapp.stats),
+        поэтому прогресс по всем продуктам пользователя читается одним запросом без агрегации по UserLessonView.
+
+        Поля:
+        - user (ForeignKey): Пользователь.
+        - product (ForeignKey): Продукт, к которому у пользователя есть доступ.
+        - completed_lessons (IntegerField): Количество просмотренных пользователем уроков продукта.
+        - total_lessons (IntegerField): Количество уроков продукта.
+        - watched_seconds (BigIntegerField): Общее время просмотра пользователем уроков продукта в секундах.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='product_progress')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='user_progress')
+    completed_lessons = models.IntegerField(default=0)
+    total_lessons = models.IntegerField(default=0)
+    watched_seconds = models.BigIntegerField(default=0)  # В секундах.
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='unique_user_product_progress'),
+        ]
+
+    def __str__(self):
+        return f"Прогресс {self.user} по {self.product}"
+
+
+class LessonViewEvent(models.Model):
+    """
+        Модель события просмотра урока — запись журнала, который только дополняется.
+
+        Событие записывается при каждом увеличении просмотренной длительности урока пользователем
+        и сворачивается командой compact_view_events в почасовые и посуточные агрегаты LessonViewRollup.
+
+        Поля:
+        - user (ForeignKey): Пользователь, который смотрел урок.
+        - lesson (ForeignKey): Урок.
+        - watched_seconds (IntegerField): Прирост просмотренной длительности в секундах.
+        - completed (BooleanField): Урок стал просмотренным в результате этого события.
+        - created_at (DateTimeField): Время события.
+    """
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE)
+    watched_seconds = models.IntegerField()  # В секундах.
+    completed = models.BooleanField(default=False)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.user} смотрел {self.lesson} {self.watched_seconds} с, {self.created_at}"
+
+
+class LessonViewRollup(models.Model):
+    """
+        Модель агрегата событий просмотра урока в продукте за час или сутки.
+
+        Поля:
+        - bucket (CharField): Размер интервала: hour или day.
+        - bucket_start (DateTimeField): Начало интервала (UTC).
+        - product (ForeignKey): Продукт, в который входит урок.
+        - lesson (ForeignKey): Урок.
+        - watched_seconds (BigIntegerField): Суммарный прирост просмотренной длительности в секундах.
+        - events (IntegerField): Количество событий просмотра.
+        - completed (IntegerField): Количество уроков, ставших просмотренными.
+    """
+    HOUR = 'hour'
+    DAY = 'day'
+    BUCKET_CHOICES = [(HOUR, 'Час'), (DAY, 'Сутки')]
+
+    bucket = models.CharField(max_length=4, choices=BUCKET_CHOICES)
+    bucket_start = models.DateTimeField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='view_rollups')
+    lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE, related_name='view_rollups')
+    watched_seconds = models.BigIntegerField(default=0)  # В секундах.
+    events = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['bucket', 'product', 'bucket_start', 'lesson'], name='unique_lesson_view_rollup',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['bucket', 'bucket_start'], name='lessonviewrollup_bucket_start'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_bucket_display()} {self.bucket_start}: {self.product}, {self.lesson}"
+
+
+class EventWatermark(models.Model):
+    """
+        Модель отметки обработки журнала: идентификатор последнего свернутого события.
+
+        Поля:
+        - name (CharField): Имя обработчика журнала.
+        - last_event_id (BigIntegerField): Идентификатор последнего обработанного события.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    last_event_id = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.last_event_id}"
+
+
+class UserTokenVersion(models.Model):
+    """
+        Модель версии токенов аутентификации пользователя (HQapp.tokens).
+
+        Токен действителен, только пока записанная в нем версия совпадает с текущей, поэтому увеличение
+        версии отзывает все выданные пользователю токены. У пользователя без строки версия равна 0.
+
+        Поля:
+        - user (OneToOneField): Пользователь.
+        - version (PositiveIntegerField): Текущая версия токенов.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='token_version')
+    version = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.version}"
+
 
 @receiver(pre_save, sender=UserLessonView)
-def update_is_viewed(sender, instance, **kwargs):
+def update_is_viewed(sender, instance, update_fields=None, raw=False, **kwargs):
     """
         Обработчик сигнала pre_save для модели UserLessonView.
 
-        Обновляет поле is_viewed экземпляра UserLessonView перед его сохранением,
-        если просмотренная длительность урока составляет 80% или более от
-        общей длительности урока.
+        Вычисляет поле is_viewed экземпляра UserLessonView перед его сохранением: True, если
+        просмотренная длительность урока составляет 80% или более от общей длительности урока,
+        иначе False. Длительность берется из уже загруженного урока экземпляра; урок загружается
+        запросом только его длительности, если он не загружен. Сохранение только других полей
+        (update_fields без viewed_duration и lesson) статус не пересчитывает, а при сохранении
+        с ними UserLessonView.save() добавляет is_viewed в update_fields.
 
         Параметры:
         - sender (Model): Модель, отправляющая сигнал. В данном случае, это UserLessonView.
         - instance (UserLessonView): Экземпляр модели UserLessonView, который сохраняется.
+        - update_fields (frozenset): Сохраняемые поля или None, если сохраняются все поля.
+        - raw (bool): Сохранение при загрузке фикстур; статус берется из фикстуры.
         - kwargs (dict): Дополнительные аргументы (не используются в данной функции).
 
         Возвращаемое значение:
-        - Нет. Функция только обновляет поле is_viewed экземпляра UserLessonView, если необходимо.
+        - Нет. Функция только обновляет поле is_viewed экземпляра UserLessonView.
     """
-    lesson_duration = instance.lesson.duration
-    if instance.viewed_duration >= lesson_duration * 0.8:
-        instance.is_viewed = True
+    if raw or (update_fields is not None and not update_fields & PROGRESS_SOURCE_FIELDS):
+        return
+    if UserLessonView.lesson.is_cached(instance):
+        lesson_duration = instance.lesson.duration
+    else:
+        lesson_duration = Lesson.objects.values_list('duration', flat=True).get(pk=instance.lesson_id)
+    instance.is_viewed = lesson_is_viewed(instance.viewed_duration, lesson_duration)
@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Курсорная пагинация по стабильному порядку идентификаторов.
+
+    Следующая страница выбирается условием id > курсора, поэтому стоимость запроса
+    не зависит от номера страницы, в отличие от пагинации со смещением.
+    Размер страницы задается параметром запроса page_size, но не более max_page_size.
+    Недействительный курсор или размер страницы — ошибка запроса (400).
+    """
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def get_page_size(self, request):
+        value = request.query_params.get(self.page_size_query_param)
+        if value is None:
+            return self.page_size
+        try:
+            page_size = int(value)
+        except ValueError:
+            page_size = 0
+        if page_size < 1:
+            raise ValidationError({self.page_size_query_param: 'Ожидается положительное целое число.'})
+        return min(page_size, self.max_page_size)
+
+    def decode_cursor(self, request):
+        try:
+            return super().decode_cursor(request)
+        except NotFound:
+            raise ValidationError({self.cursor_query_param: self.invalid_cursor_message})
+
+
+class StreamingListMixin:
+    """
+    Примесь для списковых представлений, добавляющая потоковый режим ответа.
+
+    При параметре запроса ?stream=1 пагинация не применяется, а элементы JSON-массива
+    сериализуются и отправляются по мере чтения из базы данных пачками по stream_chunk_size
+    (по умолчанию — настройка STREAMING_CHUNK_SIZE), поэтому пиковое потребление памяти
+    не зависит от размера выборки.
+    """
+    stream_chunk_size = None
+
+    def is_streaming(self):
+        return self.request.query_params.get('stream') in ('1', 'true')
+
+    def list(self, request, *args, **kwargs):
+        if self.is_streaming():
+            return self.stream_list()
+        return super().list(request, *args, **kwargs)
+
+    def stream_list(self):
+        # Выборка выполняется после выхода из dispatch(), когда чтение с реплики уже выключено,
+        # поэтому база данных закрепляется сейчас
+        queryset = self.filter_queryset(self.get_queryset()).order_by('pk')
+        queryset = queryset.using(queryset.db)
+        response = StreamingHttpResponse(self.stream_json(queryset), content_type='application/json')
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    def stream_json(self, queryset):
+        """
+        Генерирует JSON-массив сериализованных объектов по частям.
+        """
+        encoder = JSONEncoder(ensure_ascii=False)
+        separator = ''
+        yield '['
+        for obj in queryset.iterator(chunk_size=self.stream_chunk_size or settings.STREAMING_CHUNK_SIZE):
+            yield separator + encoder.encode(self.get_serializer(obj).data)
+            separator = ','
+        yield ']'
@@ -0,0 +1,51 @@
+"""
+Разбор списков идентификаторов пользователей в формате CSV.
+
+Идентификатор берется из первого столбца каждой строки; первая строка может быть заголовком.
+Строки читаются по одной, поэтому загрузка не разбирается в память целиком.
+"""
+import codecs
+import csv
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+def read_user_ids(lines):
+    """
+        Возвращает идентификаторы пользователей из строк CSV по мере чтения.
+
+        Args:
+        lines (iterable): Строки CSV (str).
+
+        Raises:
+        ParseError: Если значение первого столбца (кроме заголовка) не является положительным целым числом.
+    """
+    for number, row in enumerate(csv.reader(lines), start=1):
+        value = row[0].strip() if row else ''
+        if not value:
+            continue
+        if value.isdigit() and int(value) > 0:
+            yield int(value)
+        elif number > 1:
+            raise ParseError(f'Строка {number}: ожидается идентификатор пользователя, получено {value[:50]!r}.')
+
+
+def read_user_ids_from_file(file, encoding=None):
+    """
+        Возвращает идентификаторы пользователей из двоичного файла или потока с CSV.
+    """
+    return read_user_ids(codecs.iterdecode(file, encoding or settings.DEFAULT_CHARSET))
+
+
+class UserIdsCSVParser(BaseParser):
+    """
+    Парсер тела запроса text/csv: возвращает генератор идентификаторов пользователей,
+    читающий тело запроса построчно.
+    """
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding')
+        return read_user_ids_from_file(stream, encoding)
@@ -11,4 +11,14 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
 
-        return obj.owner == request.user
\ No newline at end of file
+        # Сравнение идентификаторов не загружает владельца объекта
+        return obj.owner_id == request.user.pk
+
+class IsOwner(permissions.BasePermission):
+    """
+    Разрешение, допускающее к объекту только его владельца, в том числе для чтения
+    (например, для выгрузки данных продукта).
+    """
+
+    def has_object_permission(self, request, view, obj):
+        return obj.owner_id == request.user.pk
@@ -0,0 +1,482 @@
+"""
+Пакетная запись прогресса просмотра уроков.
+
+Сигналы плеера (heartbeat) с одинаковыми парами (пользователь, урок) объединяются
+по максимальной просмотренной длительности, а затем записываются одной вставкой
+с обновлением при конфликте. Статус просмотра вычисляется для всего пакета сразу,
+а статистика продуктов и прогресс пользователей по продуктам обновляются приращениями.
+Приросты прогресса записываются в журнал событий просмотра (HQapp.events).
+
+При включенной отложенной записи (PROGRESS_WRITE_BEHIND) сигналы накапливаются
+в буфере ProgressBuffer и записываются фоновым потоком по размеру или по времени.
+
+В режиме производительности SQLite (SQLITE_PERFORMANCE) записи прогресса из всех потоков
+процесса выполняются по очереди одним потоком SerializedWriter: SQLite допускает только одного
+писателя, и конкурирующие транзакции иначе завершаются ошибкой database is locked.
+
+Повторяющиеся просмотры одного урока объединяет merge_duplicate_views() (одноименная команда):
+на больших таблицах ее запускают перед миграцией 0004 с ограничением уникальности (пользователь, урок).
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count, Max
+
+from .models import Lesson, ProductStats, UserLessonView, UserProductProgress
+from .sqlite import is_enabled as sqlite_performance_enabled
+from .response_cache import CATALOG, bump_versions, product_scope, user_scope
+from .events import log_view_events
+from .stats import ProductLesson, apply_view_deltas, rebuild_product_stats, rebuild_user_progress
+
+logger = logging.getLogger(__name__)
+
+
+def coalesce_heartbeats(heartbeats):
+    """
+        Объединяет сигналы с одинаковыми парами (пользователь, урок), оставляя максимальную длительность.
+
+        Args:
+        heartbeats (iterable): Кортежи (user_id, lesson_id, viewed_duration).
+
+        Returns:
+        tuple: Словарь {(user_id, lesson_id): viewed_duration} и количество объединенных сигналов.
+    """
+    progress = {}
+    received = 0
+    for user_id, lesson_id, viewed_duration in heartbeats:
+        received += 1
+        key = (user_id, lesson_id)
+        if viewed_duration > progress.get(key, -1):
+            progress[key] = viewed_duration
+    return progress, received - len(progress)
+
+
+def record_progress(progress):
+    """
+        Записывает прогресс просмотра уроков одной вставкой с обновлением при конфликте.
+
+        Просмотренная длительность никогда не уменьшается: из нового и сохраненного значения
+        записывается максимальное. Сигналы для уроков, которых не существует, пропускаются.
+        Строки пользователей пакета блокируются до конца транзакции, поэтому одновременные пакеты
+        тех же пользователей записываются по очереди и каждый сравнивает свои значения с уже
+        записанными другим пакетом (SQLite и так выполняет записи по очереди).
+
+        Args:
+        progress (dict): Словарь {(user_id, lesson_id): viewed_duration}.
+
+        Returns:
+        dict: Количество записанных строк (written) и пропущенных сигналов (skipped).
+    """
+    if not progress:
+        return {'written': 0, 'skipped': 0}
+
+    # Загруженные уроки передаются в объекты просмотров, поэтому bulk_create() вычисляет статус просмотра без запросов
+    lessons = Lesson.objects.only('duration').in_bulk({lesson_id for _, lesson_id in progress})
+    received = len(progress)
+    progress = {key: value for key, value in progress.items() if key[1] in lessons}
+    skipped = received - len(progress)
+    if not progress:
+        return {'written': 0, 'skipped': skipped}
+
+    user_ids = {user_id for user_id, _ in progress}
+    with transaction.atomic():
+        # Блокировка пользователей, а не только их просмотров, сериализует и вставку новых строк;
+        # порядок по id исключает взаимные блокировки пакетов
+        list(User.objects.select_for_update().filter(pk__in=user_ids).order_by('pk').values_list('pk', flat=True))
+        existing = {
+            (user_id, lesson_id): (viewed_duration, is_viewed)
+            for user_id, lesson_id, viewed_duration, is_viewed in UserLessonView.objects.select_for_update().filter(
+                user_id__in=user_ids,
+                lesson_id__in={lesson_id for _, lesson_id in progress},
+            ).values_list('user_id', 'lesson_id', 'viewed_duration', 'is_viewed')
+        }
+
+        rows = [
+            UserLessonView(
+                user_id=user_id, lesson=lessons[lesson_id],
+                viewed_duration=max(viewed_duration, existing.get((user_id, lesson_id), (0, False))[0]),
+            )
+            for (user_id, lesson_id), viewed_duration in progress.items()
+        ]
+        UserLessonView.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['user', 'lesson'],
+            update_fields=['viewed_duration', 'is_viewed', 'last_viewed_date'],
+        )
+
+        deltas = defaultdict(lambda: [0, 0])
+        for row in rows:
+            old_duration, old_viewed = existing.get((row.user_id, row.lesson_id), (0, False))
+            deltas[row.user_id, row.lesson_id][0] += row.viewed_duration - old_duration
+            deltas[row.user_id, row.lesson_id][1] += int(row.is_viewed) - int(old_viewed)
+        apply_view_deltas(deltas)
+        log_view_events(deltas)
+
+    # Пакетная вставка не отправляет сигналы, поэтому закэшированные ответы пользователей сбрасываются явно
+    bump_versions({user_scope(user_id) for user_id in user_ids})
+    return {'written': len(rows), 'skipped': skipped}
+
+
+def write_progress(progress):
+    """
+        Записывает прогресс функцией record_progress(): через очередь единственного писателя
+        в режиме производительности SQLite или непосредственно в вызывающем потоке.
+    """
+    writer = get_progress_writer()
+    if writer is None:
+        return record_progress(progress)
+    return writer.submit(record_progress, progress)
+
+
+def merge_duplicate_views(dry_run=False):
+    """
+        Объединяет повторяющиеся просмотры одного урока одним пользователем в одну запись
+        с максимальной просмотренной длительностью и последней датой просмотра,
+        после чего пересчитывает статистику и прогресс пользователей затронутых продуктов.
+
+        Команда запускается до применения ограничения уникальности (миграция 0004) на больших таблицах,
+        поэтому лишние записи удаляются запросом DELETE без сигналов, которые обновляют прогресс
+        пользователей, а статистика и прогресс пересчитываются, только если их таблицы уже созданы.
+
+        Args:
+        dry_run (bool): Только подсчитать повторы, ничего не изменяя.
+
+        Returns:
+        tuple: Количество групп повторов и количество удаленных записей.
+    """
+    duplicates = UserLessonView.objects.order_by().values('user_id', 'lesson_id').annotate(
+        count=Count('pk'),
+        viewed_duration=Max('viewed_duration'),
+        last_viewed_date=Max('last_viewed_date'),
+    ).filter(count__gt=1)
+
+    groups = removed = 0
+    user_ids, lesson_ids = set(), set()
+    table = connection.ops.quote_name(UserLessonView._meta.db_table)
+    with transaction.atomic():
+        for group in duplicates.iterator():
+            groups += 1
+            removed += group['count'] - 1
+            user_ids.add(group['user_id'])
+            lesson_ids.add(group['lesson_id'])
+            if dry_run:
+                continue
+            rows = UserLessonView.objects.filter(user_id=group['user_id'], lesson_id=group['lesson_id'])
+            keep = rows.order_by('-viewed_duration', '-last_viewed_date', 'pk').values_list('pk', flat=True).first()
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'DELETE FROM {table} WHERE user_id = %s AND lesson_id = %s AND id <> %s',
+                    [group['user_id'], group['lesson_id'], keep],
+                )
+            # Статус просмотра вычисляется по объединенной длительности в том же запросе UPDATE
+            rows.filter(pk=keep).update(
+                viewed_duration=group['viewed_duration'],
+                last_viewed_date=group['last_viewed_date'],
+            )
+
+        if lesson_ids and not dry_run:
+            product_ids = list(
+                ProductLesson.objects.filter(lesson_id__in=lesson_ids).values_list('product_id', flat=True)
+            )
+            tables = set(connection.introspection.table_names())
+            if ProductStats._meta.db_table in tables:
+                rebuild_product_stats(product_ids)
+            if UserProductProgress._meta.db_table in tables:
+                rebuild_user_progress(product_ids)
+            # Удаление запросом DELETE не отправляет сигналы, поэтому закэшированные ответы сбрасываются явно
+            bump_versions([CATALOG, *map(product_scope, product_ids), *map(user_scope, user_ids)])
+    return groups, removed
+
+
+class ProgressBuffer:
+    """
+        Буфер отложенной записи прогресса просмотра уроков.
+
+        Хранит последнюю максимальную длительность для каждой пары (пользователь, урок)
+        и записывает накопленный прогресс функцией record_progress() из фонового потока,
+        когда буфер достигает flush_size записей или проходит flush_interval секунд.
+        Количество пар в буфере ограничено max_size: при заполнении add() и add_many() ожидают
+        освобождения места не дольше block_timeout секунд на вызов, после чего сигналы отбрасываются.
+
+        Счетчики (counters()):
+        - accepted: Принятые сигналы с новыми парами.
+        - coalesced: Сигналы, объединенные с уже находящимися в буфере.
+        - dropped: Сигналы, отброшенные из-за переполнения буфера.
+        - flushed: Записанные в базу данных пары.
+        - failed: Пары, которые не удалось записать.
+    """
+
+    def __init__(self, max_size=10000, flush_size=1000, flush_interval=1.0, block_timeout=0.5):
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self._counters = dict.fromkeys(('accepted', 'coalesced', 'dropped', 'flushed', 'failed'), 0)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def counters(self):
+        """
+            Возвращает копию счетчиков буфера и текущее количество ожидающих записи пар (pending).
+        """
+        with self._condition:
+            return dict(self._counters, pending=len(self._pending))
+
+    def add(self, user_id, lesson_id, viewed_duration):
+        """
+            Добавляет сигнал прогресса в буфер.
+
+            Returns:
+            bool: False, если сигнал отброшен из-за переполнения буфера.
+        """
+        return self.add_many({(user_id, lesson_id): viewed_duration}) == 1
+
+    def add_many(self, progress):
+        """
+            Добавляет в буфер прогресс пакета сигналов.
+
+            Ожидание места ограничено block_timeout секунд на весь пакет, а не на каждый сигнал:
+            после истечения срока новые пары принимаются только при наличии свободного места.
+
+            Args:
+            progress (dict): Словарь {(user_id, lesson_id): viewed_duration}.
+
+            Returns:
+            int: Количество принятых сигналов; остальные отброшены из-за переполнения буфера.
+        """
+        accepted = 0
+        deadline = time.monotonic() + self.block_timeout
+        with self._condition:
+            for key, viewed_duration in progress.items():
+                if key in self._pending:
+                    self._pending[key] = max(self._pending[key], viewed_duration)
+                    self._counters['coalesced'] += 1
+                    accepted += 1
+                    continue
+
+                while len(self._pending) >= self.max_size:
+                    self._condition.notify_all()  # Будим фоновый поток, чтобы он освободил место
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or self._thread is None:
+                        break
+                    self._condition.wait(remaining)
+                if len(self._pending) >= self.max_size:
+                    self._counters['dropped'] += 1
+                    continue
+
+                self._pending[key] = viewed_duration
+                self._counters['accepted'] += 1
+                accepted += 1
+                if len(self._pending) >= self.flush_size:
+                    self._condition.notify_all()
+        return accepted
+
+    def flush(self):
+        """
+            Синхронно записывает весь накопленный прогресс в вызывающем потоке.
+
+            Returns:
+            int: Количество записанных пар.
+        """
+        with self._flush_lock:
+            with self._condition:
+                batch, self._pending = self._pending, {}
+                self._condition.notify_all()  # Освободилось место для ожидающих производителей
+            if not batch:
+                return 0
+            try:
+                write_progress(batch)
+            except Exception:
+                logger.exception('Failed to flush %d progress updates', len(batch))
+                with self._condition:
+                    self._counters['failed'] += len(batch)
+                return 0
+            with self._condition:
+                self._counters['flushed'] += len(batch)
+            return len(batch)
+
+    def start(self):
+        """
+            Запускает фоновый поток записи. Повторный вызов в том же процессе ничего не делает,
+            а после fork() поток запускается заново.
+        """
+        with self._condition:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._stopping = False
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='progress-write-behind', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        """
+            Останавливает фоновый поток и записывает оставшийся прогресс.
+        """
+        with self._condition:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+            self._condition.notify_all()
+        if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout)
+        self.flush()
+        connection.close()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._stopping or len(self._pending) >= self.flush_size, timeout=self.flush_interval,
+                )
+                if self._stopping:
+                    break
+            close_old_connections()
+            self.flush()
+        connection.close()
+
+
+class SerializedWriter:
+    """
+        Очередь записей, выполняемых по одной фоновым потоком со своим соединением с базой данных.
+
+        submit() помещает функцию в очередь и ожидает ее результата, поэтому для вызывающего кода
+        запись остается синхронной, но транзакции разных потоков процесса никогда не конкурируют
+        за блокировку записи SQLite.
+
+        Счетчики (counters()):
+        - completed: Выполненные записи.
+        - failed: Записи, завершившиеся исключением.
+        - queued: Записи, ожидающие выполнения.
+    """
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._counters = dict.fromkeys(('completed', 'failed'), 0)
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters, queued=self._queue.qsize())
+
+    def submit(self, function, *args):
+        """
+            Выполняет function(*args) в потоке писателя и возвращает результат или возбуждает исключение.
+        """
+        if threading.current_thread() is self._thread:
+            return function(*args)
+        self.start()
+        future = Future()
+        self._queue.put((future, function, args))
+        return future.result()
+
+    def start(self):
+        """
+            Запускает поток писателя. Повторный вызов в том же процессе ничего не делает,
+            а после fork() поток запускается заново.
+        """
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='serialized-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        """
+            Выполняет уже поставленные в очередь записи и останавливает поток писателя.
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            future, function, args = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            close_old_connections()
+            try:
+                result = function(*args)
+            except BaseException as error:
+                future.set_exception(error)
+                outcome = 'failed'
+            else:
+                future.set_result(result)
+                outcome = 'completed'
+            with self._lock:
+                self._counters[outcome] += 1
+        connection.close()
+
+
+_progress_writer = None
+_progress_buffer = None
+_progress_buffer_lock = threading.Lock()
+
+
+def get_progress_writer():
+    """
+        Возвращает очередь единственного писателя прогресса или None, если режим производительности
+        SQLite или сериализация записей (SQLITE_PERFORMANCE['SERIALIZE_WRITES']) выключены.
+    """
+    global _progress_writer
+    if not (sqlite_performance_enabled(connection) and settings.SQLITE_PERFORMANCE['SERIALIZE_WRITES']):
+        return None
+    with _progress_buffer_lock:
+        if _progress_writer is None:
+            _progress_writer = SerializedWriter()
+    return _progress_writer
+
+
+def get_progress_buffer():
+    """
+        Возвращает буфер отложенной записи прогресса, запуская его фоновый поток,
+        или None, если отложенная запись выключена в настройке PROGRESS_WRITE_BEHIND.
+    """
+    global _progress_buffer
+    options = settings.PROGRESS_WRITE_BEHIND
+    if not options.get('ENABLED'):
+        return None
+    with _progress_buffer_lock:
+        if _progress_buffer is None:
+            _progress_buffer = ProgressBuffer(
+                max_size=options.get('MAX_SIZE', 10000),
+                flush_size=options.get('FLUSH_SIZE', 1000),
+                flush_interval=options.get('FLUSH_INTERVAL', 1.0),
+                block_timeout=options.get('BLOCK_TIMEOUT', 0.5),
+            )
+    _progress_buffer.start()
+    return _progress_buffer
+
+
+def shutdown_progress_buffer():
+    """
+        Останавливает буфер отложенной записи, записывает оставшийся прогресс
+        и останавливает очередь единственного писателя.
+        Вызывается точками входа wsgi.py и asgi.py при завершении процесса.
+    """
+    if _progress_buffer is not None:
+        _progress_buffer.stop()
+    if _progress_writer is not None:
+        _progress_writer.stop()
@@ -0,0 +1,196 @@
+"""
+Кэширование ответов API с инвалидацией по версиям.
+
+Ответ кэшируется в кэше Django под ключом, включающим адрес запроса и текущие версии
+данных, от которых он зависит: версию пользователя (его доступы и прогресс просмотра),
+версию продукта (его уроки) и версию каталога (любые изменения уроков и продуктов).
+Обработчики сигналов меняют версии при изменении данных, поэтому устаревшие ответы
+никогда не читаются и вытесняются из кэша по времени жизни. Тот же ключ служит ETag:
+на запрос с совпадающим If-None-Match ответ 304 возвращается без обращения к базе данных.
+
+Версии должны быть общими для всех процессов: изменение версии в кэше одного процесса не видно
+другим, которые продолжат отдавать устаревшие ответы и 304. Поэтому проверка развертывания
+HQapp.W001 (manage.py check --deploy) предупреждает о кэше, хранящемся в памяти процесса.
+"""
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import Product, Lesson, UserLessonView
+
+CATALOG = 'catalog'
+
+# Бэкенды, не разделяющие данные между процессами.
+PROCESS_LOCAL_CACHE_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+        Предупреждает, если версии ответов хранятся в кэше, не общем для процессов.
+        Выполняется только при проверке развертывания: сервер разработки и тесты работают в одном процессе.
+    """
+    backend = settings.CACHES['default']['BACKEND']
+    if backend not in PROCESS_LOCAL_CACHE_BACKENDS:
+        return []
+    return [checks.Warning(
+        f'The default cache {backend} is not shared between processes, so response cache versions '
+        'bumped in one worker are not seen by the others and stale responses and 304s are served.',
+        hint='Set CACHE_BACKEND and CACHE_LOCATION to a shared cache such as Redis, Memcached or the database '
+             'cache, or silence HQapp.W001 if the application runs in a single process.',
+        id='HQapp.W001',
+    )]
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+def product_scope(product_id):
+    return f'product:{product_id}'
+
+
+def _version_key(scope):
+    return f'hqapp:version:{scope}'
+
+
+def get_versions(scopes):
+    """
+        Возвращает текущие версии областей данных одним обращением к кэшу.
+        Отсутствующим в кэше областям назначается новая версия.
+
+        Args:
+        scopes (list): Области данных, например ['user:1', 'catalog'].
+
+        Returns:
+        list: Версии в порядке областей.
+    """
+    keys = [_version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+async def aget_versions(scopes):
+    """
+        Асинхронная версия get_versions.
+    """
+    keys = [_version_key(scope) for scope in scopes]
+    versions = await cache.aget_many(keys)
+    for key in keys:
+        if key not in versions:
+            await cache.aadd(key, time.time_ns(), None)
+            versions[key] = await cache.aget(key)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(scopes):
+    """
+        Назначает областям данных новые версии, делая закэшированные ответы для них недействительными.
+
+        Args:
+        scopes (iterable): Области данных.
+    """
+    version = time.time_ns()
+    cache.set_many({_version_key(scope): version for scope in set(scopes)}, None)
+
+
+def versioned_response_cache(get):
+    """
+        Декоратор метода get представления API, кэширующий ответы с инвалидацией по версиям и поддержкой ETag.
+
+        Представление определяет метод get_cache_scopes(request, *args, **kwargs), возвращающий области данных,
+        от которых зависит ответ. Кэшируются только успешные ответы аутентифицированным пользователям;
+        потоковые ответы не кэшируются.
+    """
+    @functools.wraps(get)
+    def wrapper(self, request, *args, **kwargs):
+        if not request.user.is_authenticated or getattr(self, 'is_streaming', lambda: False)():
+            return get(self, request, *args, **kwargs)
+
+        scopes = self.get_cache_scopes(request, *args, **kwargs)
+        versions = get_versions(scopes)
+        identity = '|'.join([type(self).__name__, request.build_absolute_uri(), *scopes, *map(str, versions)])
+        etag = '"%s"' % hashlib.md5(identity.encode()).hexdigest()
+
+        if etag in request.headers.get('If-None-Match', ''):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            cache_key = f'hqapp:response:{etag}'
+            data = cache.get(cache_key)
+            if data is None:
+                response = get(self, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cache.set(cache_key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+            else:
+                response = Response(data)
+
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    return wrapper
+
+
+@receiver(post_save, sender=UserLessonView)
+@receiver(post_delete, sender=UserLessonView)
+def bump_user_on_view_change(sender, instance, **kwargs):
+    """
+        Делает недействительными ответы пользователя при изменении его прогресса просмотра.
+    """
+    bump_versions([user_scope(instance.user_id)])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def bump_product_on_change(sender, instance, **kwargs):
+    """
+        Делает недействительными ответы с продуктом при его изменении или удалении.
+    """
+    bump_versions([product_scope(instance.pk), CATALOG])
+
+
+@receiver(post_save, sender=Lesson)
+@receiver(pre_delete, sender=Lesson)
+def bump_products_on_lesson_change(sender, instance, **kwargs):
+    """
+        Делает недействительными ответы с продуктами, в которые входит измененный или удаляемый урок.
+    """
+    product_ids = Product.lessons.through.objects.filter(lesson_id=instance.pk).values_list('product_id', flat=True)
+    bump_versions([CATALOG, *map(product_scope, product_ids)])
+
+
+@receiver(m2m_changed, sender=Product.lessons.through)
+def bump_products_on_lessons_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+        Делает недействительными ответы с продуктами, уроки которых изменились.
+    """
+    if action == 'pre_clear' and reverse:
+        # После очистки продукты урока уже неизвестны, поэтому они запоминаются заранее
+        instance._response_cache_products = list(
+            Product.lessons.through.objects.filter(lesson_id=instance.pk).values_list('product_id', flat=True)
+        )
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        product_ids = [instance.pk]
+    elif action == 'post_clear':
+        product_ids = instance.__dict__.pop('_response_cache_products', [])
+    else:
+        product_ids = pk_set or []
+    bump_versions([CATALOG, *map(product_scope, product_ids)])
@@ -0,0 +1,109 @@
+"""
+Маршрутизация запросов к базе данных между основной базой и репликами.
+
+Записи и чтения по умолчанию выполняются в основной базе 'default'. Представления только
+для чтения (ReplicaReadMixin) на время обработки запроса включают чтение со случайной
+реплики из настройки DATABASE_REPLICAS.
+
+Чтобы пользователь сразу видел собственные изменения (read-your-writes), чтения остаются
+в основной базе, если данные пользователя или каталог изменились не раньше чем REPLICA_PIN_SECONDS
+назад. Время изменения берется из версий кэша ответов (HQapp.response_cache), которые обновляются
+при каждой записи прогресса, доступов, уроков и продуктов; поэтому ответы, построенные по
+отстающей реплике, не попадают в кэш под новой версией. При нескольких процессах кэш должен быть общим.
+"""
+import functools
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+
+from .response_cache import CATALOG, aget_versions, get_versions, user_scope
+
+PRIMARY = 'default'
+
+_read_from_replica = ContextVar('hqapp_read_from_replica', default=False)
+
+
+def _recently_changed(versions):
+    return time.time_ns() - max(versions) < settings.REPLICA_PIN_SECONDS * 10 ** 9
+
+
+def can_read_from_replica(user):
+    """
+        Проверяет, можно ли читать данные пользователя с реплики: реплики настроены,
+        а данные пользователя и каталог не менялись последние REPLICA_PIN_SECONDS секунд.
+    """
+    if not settings.DATABASE_REPLICAS or not user.is_authenticated:
+        return False
+    return not _recently_changed(get_versions([user_scope(user.pk), CATALOG]))
+
+
+async def acan_read_from_replica(user):
+    """
+        Асинхронная версия can_read_from_replica.
+    """
+    if not settings.DATABASE_REPLICAS or not user.is_authenticated:
+        return False
+    return not _recently_changed(await aget_versions([user_scope(user.pk), CATALOG]))
+
+
+class PrimaryReplicaRouter:
+    """
+    Маршрутизатор: чтения в контексте ReplicaReadMixin — на реплики, остальные запросы — в основную базу.
+    Связанные объекты (в том числе prefetch_related) объекта, прочитанного с реплики, читаются с той же реплики.
+    """
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in settings.DATABASE_REPLICAS:
+            return instance._state.db
+        if _read_from_replica.get() and settings.DATABASE_REPLICAS:
+            return random.choice(settings.DATABASE_REPLICAS)
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная база
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
+
+
+class ReplicaReadMixin:
+    """
+    Примесь для представлений DRF только для чтения: чтения обработчика выполняются на реплике.
+
+    Чтение с реплики включается после аутентификации и проверки прав (которые выполняются
+    в основной базе) и выключается по завершении обработки запроса.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        token = _read_from_replica.set(False)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            _read_from_replica.reset(token)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        _read_from_replica.set(can_read_from_replica(request.user))
+
+
+def async_replica_reads(view):
+    """
+    Декоратор асинхронного представления только для чтения: запросы представления выполняются на реплике.
+    Применяется после загрузки пользователя (внутри async_login_required).
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        token = _read_from_replica.set(await acan_read_from_replica(request.user))
+        try:
+            return await view(request, *args, **kwargs)
+        finally:
+            _read_from_replica.reset(token)
+
+    return wrapper
@@ -0,0 +1,101 @@
+"""
+Статическая схема OpenAPI.
+
+Схема генерируется один раз командой generate_openapi_schema (при развертывании) в файл OPENAPI_SCHEMA['PATH'],
+а представления отдают содержимое файла из памяти процесса с ETag и долгим кэшированием, не разбирая
+представления и сериализаторы при каждом запросе. drf_yasg импортируется только при генерации схемы;
+если файла нет, схема один раз генерируется в памяти процесса.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_INFO = {
+    'title': 'API',
+    'default_version': 'v1',
+    'description': 'API documentation',
+    'terms_of_service': 'https://www.yourapp.com/terms/',
+    'contact': {'email': 'bar.norilsk@gmail.com'},
+    'license': {'name': 'alpha'},
+}
+
+_lock = threading.Lock()
+_loaded = None  # (время изменения файла, содержимое, ETag)
+
+
+def generate_schema():
+    """
+        Генерирует схему OpenAPI всех эндпоинтов проекта.
+
+        Returns:
+        bytes: Схема в формате JSON.
+    """
+    from drf_yasg import openapi
+    from drf_yasg.codecs import OpenAPICodecJson
+    from drf_yasg.generators import OpenAPISchemaGenerator
+
+    info = openapi.Info(
+        contact=openapi.Contact(**SCHEMA_INFO['contact']),
+        license=openapi.License(**SCHEMA_INFO['license']),
+        **{key: value for key, value in SCHEMA_INFO.items() if key not in ('contact', 'license')},
+    )
+    schema = OpenAPISchemaGenerator(info).get_schema(request=None, public=True)
+    return OpenAPICodecJson(validators=[]).encode(schema)
+
+
+def write_schema(path=None):
+    """
+        Генерирует схему и атомарно заменяет ею файл, чтобы работающие процессы не прочитали его частично.
+
+        Args:
+        path (str, optional): По умолчанию — настройка OPENAPI_SCHEMA['PATH'].
+
+        Returns:
+        int: Размер схемы в байтах.
+    """
+    path = path or settings.OPENAPI_SCHEMA['PATH']
+    content = generate_schema()
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile('wb', dir=directory, delete=False) as file:
+        file.write(content)
+    # Временный файл создается с правами 0600, а схему читают процессы веб-сервера других пользователей
+    os.chmod(file.name, 0o644)
+    os.replace(file.name, path)
+    return len(content)
+
+
+def load_schema():
+    """
+        Возвращает схему и ее ETag. Файл перечитывается только после изменения, поэтому новая схема
+        подхватывается без перезапуска процессов.
+
+        Returns:
+        tuple: (содержимое в байтах, ETag).
+    """
+    global _loaded
+    path = settings.OPENAPI_SCHEMA['PATH']
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+
+    loaded = _loaded
+    if loaded is None or loaded[0] != mtime:
+        with _lock:
+            if _loaded is None or _loaded[0] != mtime:
+                if mtime is None:
+                    logger.warning('OpenAPI schema %s not found; run generate_openapi_schema', path)
+                    content = generate_schema()
+                else:
+                    with open(path, 'rb') as file:
+                        content = file.read()
+                _loaded = (mtime, content, '"%s"' % hashlib.md5(content).hexdigest())
+            loaded = _loaded
+    return loaded[1], loaded[2]
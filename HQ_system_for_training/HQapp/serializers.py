@@ -1,5 +1,7 @@
 from rest_framework import serializers
-from .models import Product, Lesson, UserLessonView
+from .models import Product, Lesson, UserLessonView, UserProductProgress
+from django.conf import settings
+from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
 
 
@@ -53,6 +55,21 @@ class LessonSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class SimpleLessonSerializer(serializers.ModelSerializer):
+    """
+        Сериализатор для представления базовой информации об уроке без продуктов, в которые он входит.
+
+        Поля:
+            id: Идентификатор урока.
+            title: Название урока.
+            video_link: Ссылка на видео урока.
+            duration: Длительность урока в секундах.
+    """
+    class Meta:
+        model = Lesson
+        fields = ['id', 'title', 'video_link', 'duration']
+
+
 class UserLessonViewSerializer(serializers.ModelSerializer):
     """
         Сериализатор для представления информации о просмотрах уроков пользователями.
@@ -73,6 +90,44 @@ class UserLessonViewSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'lesson', 'viewed_duration', 'is_viewed', 'last_viewed_date']
 
 
+class ProgressHeartbeatListSerializer(serializers.ListSerializer):
+    """
+        Пакет сигналов прогресса. Размер пакета ограничен настройкой PROGRESS_BATCH_MAX_SIZE
+        и проверяется до проверки отдельных сигналов.
+    """
+    default_error_messages = {
+        'max_length': 'Пакет не может содержать более {max_length} сигналов.',
+    }
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('max_length', settings.PROGRESS_BATCH_MAX_SIZE)
+        super().__init__(*args, **kwargs)
+
+
+class ProgressHeartbeatSerializer(serializers.Serializer):
+    """
+        Сериализатор сигнала прогресса просмотра урока, отправляемого видеоплеером.
+
+        Поля:
+            lesson_id: Идентификатор просматриваемого урока.
+            viewed_duration: Просмотренная длительность урока в секундах.
+            user_id: Идентификатор пользователя. Необязателен, по умолчанию — текущий пользователь;
+                     сигналы других пользователей может отправлять только сотрудник (is_staff).
+    """
+    lesson_id = serializers.IntegerField(min_value=1)
+    viewed_duration = serializers.IntegerField(min_value=0)
+    user_id = serializers.IntegerField(min_value=1, required=False)
+
+    def validate_user_id(self, value):
+        user = self.context['request'].user
+        if value != user.pk and not user.is_staff:
+            raise serializers.ValidationError('Нельзя отправлять прогресс другого пользователя.')
+        return value
+
+    class Meta:
+        list_serializer_class = ProgressHeartbeatListSerializer
+
+
 class ProductSerializer(serializers.ModelSerializer):
     """
         Сериализатор для представления информации о продукте.
@@ -93,6 +148,70 @@ class ProductSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'owner', 'users_with_access', 'lessons']
 
 
+class ProductListSerializer(serializers.ModelSerializer):
+    """
+        Облегченный сериализатор для списка продуктов.
+
+        Вместо вложенных пользователей и уроков содержит количество студентов и идентификаторы уроков,
+        поэтому размер ответа не зависит от количества студентов продукта.
+        Если в контексте передано expand с 'lessons', уроки выводятся полностью сериализатором SimpleLessonSerializer.
+
+        Поля:
+            id: Идентификатор продукта.
+            title: Название продукта.
+            owner: Владелец продукта. Представлен сериализатором UserSerializer.
+            students_count: Количество пользователей с доступом к продукту.
+            lessons: Идентификаторы уроков продукта или сами уроки при expand=lessons.
+    """
+    expandable_fields = {'lessons': SimpleLessonSerializer}
+
+    owner = UserSerializer(read_only=True)
+    students_count = serializers.IntegerField(source='stats.students_count', read_only=True, default=0)
+    lessons = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+
+    class Meta:
+        model = Product
+        fields = ['id', 'title', 'owner', 'students_count', 'lessons']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for name in self.context.get('expand', ()):
+            if name in self.expandable_fields:
+                self.fields[name] = self.expandable_fields[name](many=True, read_only=True)
+
+
+class UserProductProgressSerializer(serializers.ModelSerializer):
+    """
+        Сериализатор прогресса пользователя по продукту.
+
+        Поля:
+            product: Продукт. Представлен сериализатором SimpleProductSerializer.
+            completed_lessons: Количество просмотренных уроков продукта.
+            total_lessons: Количество уроков продукта.
+            watched_seconds: Общее время просмотра уроков продукта в секундах.
+    """
+    product = SimpleProductSerializer(read_only=True)
+
+    class Meta:
+        model = UserProductProgress
+        fields = ['product', 'completed_lessons', 'total_lessons', 'watched_seconds']
+
+
+class TokenObtainSerializer(serializers.Serializer):
+    """
+    Сериализатор учетных данных для получения токена аутентификации.
+    """
+    username = serializers.CharField()
+    password = serializers.CharField(style={'input_type': 'password'}, trim_whitespace=False, write_only=True)
+
+    def validate(self, attrs):
+        user = authenticate(self.context.get('request'), username=attrs['username'], password=attrs['password'])
+        if user is None:
+            raise serializers.ValidationError('Неверное имя пользователя или пароль.', code='authorization')
+        attrs['user'] = user
+        return attrs
+
+
 #class ProductStatisticSerializer(serializers.Serializer):
  #   """
   #  Сериализатор для статистики продукта.
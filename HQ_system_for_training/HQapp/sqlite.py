@@ -0,0 +1,43 @@
+"""
+Режим производительности SQLite.
+
+При включенной настройке SQLITE_PERFORMANCE каждое новое соединение с SQLite настраивается
+директивами PRAGMA: журнал WAL (читатели не блокируют писателя и наоборот), synchronous=NORMAL
+(без fsync на каждую фиксацию транзакции, что безопасно в режиме WAL), увеличенный кэш страниц,
+отображение файла базы в память и ожидание блокировки вместо немедленной ошибки database is locked.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def is_enabled(connection):
+    return connection.vendor == 'sqlite' and settings.SQLITE_PERFORMANCE['ENABLED']
+
+
+def pragmas():
+    """
+        Возвращает директивы PRAGMA режима производительности в порядке применения.
+    """
+    options = settings.SQLITE_PERFORMANCE
+    return [
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'NORMAL'),
+        # Отрицательное значение cache_size задает размер кэша в килобайтах, а не в страницах
+        ('cache_size', -options['CACHE_SIZE_KB']),
+        ('mmap_size', options['MMAP_SIZE']),
+        ('busy_timeout', options['BUSY_TIMEOUT_MS']),
+        ('temp_store', 'MEMORY'),
+    ]
+
+
+@receiver(connection_created)
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """
+        Применяет директивы PRAGMA режима производительности к новому соединению с SQLite.
+    """
+    if not is_enabled(connection):
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas():
+            cursor.execute(f'PRAGMA {name} = {value}')
@@ -0,0 +1,556 @@
+"""
+Поддержка предварительно вычисленной статистики продуктов (ProductStats)
+и прогресса пользователей по продуктам (UserProductProgress).
+
+Статистика и прогресс обновляются приращениями в обработчиках сигналов при сохранении и удалении
+просмотров уроков, а также при изменении уроков и доступов продукта. Функции
+rebuild_product_stats() и verify_product_stats(), rebuild_user_progress() и verify_user_progress()
+пересчитывают и проверяют их с нуля по исходным таблицам. Функция sync_viewed_status() исправляет
+статус просмотра, не соответствующий длительностям уроков.
+"""
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.db.models import Case, Count, Exists, F, IntegerField, OuterRef, Q, Sum, Value, When
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .events import log_view_events
+from .models import Product, Lesson, UserLessonView, ProductStats, UserProductProgress, is_viewed_expression
+from .response_cache import CATALOG, bump_versions, product_scope
+
+STAT_FIELDS = ('watched_lessons_count', 'total_viewed_time', 'students_count')
+PROGRESS_FIELDS = ('completed_lessons', 'total_lessons', 'watched_seconds')
+
+# Количество пар (пользователь, продукт) в одном запросе UPDATE, чтобы не превысить ограничение
+# SQLite на количество параметров запроса.
+PROGRESS_UPDATE_BATCH_SIZE = 100
+
+ProductLesson = Product.lessons.through
+ProductAccess = Product.users_with_access.through
+
+
+def product_statistic(product, total_users):
+    """
+        Формирует статистику продукта с предварительно загруженной статистикой (select_related('stats')).
+
+        Args:
+        product (Product): Продукт.
+        total_users (int): Общее количество пользователей.
+
+        Returns:
+        dict: Статистика продукта.
+    """
+    stats = getattr(product, 'stats', None) or ProductStats(product=product)
+
+    # Расчет процента приобретения продукта
+    students_count = stats.students_count
+    acquisition_percentage = (students_count / total_users) * 100 if total_users > 0 else 0
+
+    return {
+        'product': product.title,
+        'watched_lessons_count': stats.watched_lessons_count,
+        'total_viewed_time': stats.total_viewed_time,
+        'students_count': students_count,
+        'acquisition_percentage': acquisition_percentage,
+    }
+
+
+def apply_product_deltas(deltas):
+    """
+        Прибавляет приращения к статистике продуктов одним запросом UPDATE.
+
+        Args:
+        deltas (dict): Словарь {product_id: {поле статистики: приращение}}.
+    """
+    deltas = {product_id: changes for product_id, changes in deltas.items() if any(changes.values())}
+    if not deltas:
+        return
+
+    updates = {}
+    for field in STAT_FIELDS:
+        whens = [
+            When(product_id=product_id, then=Value(changes[field]))
+            for product_id, changes in deltas.items() if changes.get(field)
+        ]
+        if whens:
+            updates[field] = F(field) + Case(*whens, default=Value(0), output_field=IntegerField())
+    ProductStats.objects.filter(product_id__in=deltas).update(**updates)
+
+
+def apply_progress_deltas(deltas):
+    """
+        Прибавляет приращения к прогрессу пользователей по продуктам запросами UPDATE
+        по PROGRESS_UPDATE_BATCH_SIZE пар. Пары без строки прогресса (без доступа к продукту) пропускаются.
+
+        Args:
+        deltas (dict): Словарь {(user_id, product_id): {поле прогресса: приращение}}.
+    """
+    deltas = [(pair, changes) for pair, changes in deltas.items() if any(changes.values())]
+    for start in range(0, len(deltas), PROGRESS_UPDATE_BATCH_SIZE):
+        batch = deltas[start:start + PROGRESS_UPDATE_BATCH_SIZE]
+        updates = {}
+        for field in PROGRESS_FIELDS:
+            whens = [
+                When(user_id=user_id, product_id=product_id, then=Value(changes[field]))
+                for (user_id, product_id), changes in batch if changes.get(field)
+            ]
+            if whens:
+                updates[field] = F(field) + Case(*whens, default=Value(0), output_field=IntegerField())
+        UserProductProgress.objects.filter(
+            user_id__in={user_id for (user_id, _), _ in batch},
+            product_id__in={product_id for (_, product_id), _ in batch},
+        ).update(**updates)
+
+
+def apply_view_deltas(view_deltas):
+    """
+        Переносит приращения просмотров уроков на статистику всех продуктов, включающих эти уроки,
+        и на прогресс пользователей по этим продуктам.
+
+        Args:
+        view_deltas (dict): Словарь {(user_id, lesson_id): (приращение времени просмотра, приращение просмотренных)}.
+    """
+    view_deltas = {pair: delta for pair, delta in view_deltas.items() if any(delta)}
+    if not view_deltas:
+        return
+
+    lesson_products = defaultdict(list)
+    memberships = ProductLesson.objects.filter(
+        lesson_id__in={lesson_id for _, lesson_id in view_deltas}
+    ).values_list('product_id', 'lesson_id')
+    for product_id, lesson_id in memberships:
+        lesson_products[lesson_id].append(product_id)
+
+    deltas = defaultdict(lambda: defaultdict(int))
+    progress_deltas = defaultdict(lambda: defaultdict(int))
+    for (user_id, lesson_id), (viewed_time, watched) in view_deltas.items():
+        for product_id in lesson_products[lesson_id]:
+            deltas[product_id]['total_viewed_time'] += viewed_time
+            deltas[product_id]['watched_lessons_count'] += watched
+            progress_deltas[user_id, product_id]['watched_seconds'] += viewed_time
+            progress_deltas[user_id, product_id]['completed_lessons'] += watched
+    apply_product_deltas(deltas)
+    apply_progress_deltas(progress_deltas)
+
+
+def rebuild_product_stats(product_ids=None):
+    """
+        Пересчитывает статистику продуктов с нуля и сохраняет ее одной пакетной вставкой с обновлением.
+
+        Args:
+        product_ids (iterable, optional): Идентификаторы продуктов. По умолчанию пересчитываются все продукты.
+
+        Returns:
+        int: Количество пересчитанных продуктов.
+    """
+    products = Product.objects.with_statistics()
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+
+    rows = [
+        ProductStats(product_id=product.pk, **{field: getattr(product, field) for field in STAT_FIELDS})
+        for product in products.only('pk')
+    ]
+    ProductStats.objects.bulk_create(
+        rows, update_conflicts=True, unique_fields=['product'], update_fields=list(STAT_FIELDS),
+    )
+    return len(rows)
+
+
+def verify_product_stats():
+    """
+        Сравнивает сохраненную статистику с вычисленной по исходным таблицам.
+
+        Returns:
+        list: Список кортежей (product_id, поле, сохраненное значение, ожидаемое значение) для расхождений.
+    """
+    stored = {
+        stats['product_id']: stats
+        for stats in ProductStats.objects.values('product_id', *STAT_FIELDS)
+    }
+    mismatches = []
+    for product in Product.objects.with_statistics().only('pk'):
+        row = stored.get(product.pk)
+        for field in STAT_FIELDS:
+            actual = row[field] if row else None
+            expected = getattr(product, field)
+            if actual != expected:
+                mismatches.append((product.pk, field, actual, expected))
+    return mismatches
+
+
+def _expected_user_progress(product_ids=None, user_ids=None):
+    """
+        Вычисляет прогресс по исходным таблицам для всех пар (пользователь, продукт) с доступом.
+
+        Args:
+        product_ids (iterable, optional): Ограничивает вычисление этими продуктами.
+        user_ids (iterable, optional): Ограничивает вычисление этими пользователями.
+
+        Returns:
+        dict: Словарь {(user_id, product_id): {поле прогресса: значение}}.
+    """
+    access = ProductAccess.objects.all()
+    lessons = ProductLesson.objects.order_by()
+    views = UserLessonView.objects.order_by()
+    if product_ids is not None:
+        access = access.filter(product_id__in=product_ids)
+        lessons = lessons.filter(product_id__in=product_ids)
+        views = views.filter(lesson__included_in_products__in=product_ids)
+    if user_ids is not None:
+        access = access.filter(user_id__in=user_ids)
+        views = views.filter(user_id__in=user_ids)
+
+    totals = dict(lessons.values('product_id').annotate(count=Count('pk')).values_list('product_id', 'count'))
+    progress = {
+        (user_id, product_id): {'completed_lessons': 0, 'total_lessons': totals.get(product_id, 0), 'watched_seconds': 0}
+        for user_id, product_id in access.values_list('user_id', 'product_id')
+    }
+    views = views.values('user_id', 'lesson__included_in_products').annotate(
+        completed=Count('pk', filter=Q(is_viewed=True)), watched=Sum('viewed_duration'),
+    )
+    for row in views:
+        # Просмотры уроков продуктов, к которым у пользователя нет доступа, в прогресс не входят
+        values = progress.get((row['user_id'], row['lesson__included_in_products']))
+        if values is not None:
+            values['completed_lessons'] = row['completed']
+            values['watched_seconds'] = row['watched'] or 0
+    return progress
+
+
+def _save_user_progress(progress):
+    UserProductProgress.objects.bulk_create(
+        [
+            UserProductProgress(user_id=user_id, product_id=product_id, **values)
+            for (user_id, product_id), values in progress.items()
+        ],
+        batch_size=500, update_conflicts=True, unique_fields=['user', 'product'], update_fields=list(PROGRESS_FIELDS),
+    )
+
+
+def rebuild_user_progress(product_ids=None, user_ids=None):
+    """
+        Пересчитывает прогресс пользователей по продуктам с нуля: удаляет строки без доступа
+        и сохраняет вычисленные значения пакетной вставкой с обновлением.
+
+        Args:
+        product_ids (iterable, optional): Идентификаторы продуктов. По умолчанию пересчитываются все продукты.
+        user_ids (iterable, optional): Идентификаторы пользователей. По умолчанию пересчитываются все
+                                       пользователи; для больших баз прогресс лучше пересчитывать
+                                       частями, чтобы не держать в памяти все пары.
+
+        Returns:
+        int: Количество пересчитанных пар (пользователь, продукт).
+    """
+    if product_ids is not None:
+        product_ids = list(product_ids)
+    if user_ids is not None:
+        user_ids = list(user_ids)
+    progress = _expected_user_progress(product_ids, user_ids)
+
+    stale = UserProductProgress.objects.exclude(
+        Exists(ProductAccess.objects.filter(user_id=OuterRef('user_id'), product_id=OuterRef('product_id')))
+    )
+    if product_ids is not None:
+        stale = stale.filter(product_id__in=product_ids)
+    if user_ids is not None:
+        stale = stale.filter(user_id__in=user_ids)
+    stale.delete()
+    _save_user_progress(progress)
+    return len(progress)
+
+
+def verify_user_progress():
+    """
+        Сравнивает сохраненный прогресс пользователей с вычисленным по исходным таблицам.
+
+        Returns:
+        list: Список кортежей (user_id, product_id, поле, сохраненное значение, ожидаемое значение)
+        для расхождений. Для отсутствующей строки сохраненное значение — None,
+        для лишней строки (без доступа к продукту) — ожидаемое.
+    """
+    stored = {
+        (row['user_id'], row['product_id']): row
+        for row in UserProductProgress.objects.values('user_id', 'product_id', *PROGRESS_FIELDS)
+    }
+    expected = _expected_user_progress()
+    mismatches = []
+    for pair in sorted(stored.keys() | expected.keys()):
+        row, values = stored.get(pair), expected.get(pair)
+        for field in PROGRESS_FIELDS:
+            actual = row[field] if row else None
+            value = values[field] if values else None
+            if actual != value:
+                mismatches.append((*pair, field, actual, value))
+    return mismatches
+
+
+def sync_viewed_status(lesson_ids=None, dry_run=False):
+    """
+        Находит просмотры, статус которых не соответствует условию is_viewed_expression() (например,
+        после изменения длительности урока), исправляет его одним запросом UPDATE и пересчитывает
+        статистику и прогресс пользователей затронутых продуктов.
+
+        Args:
+        lesson_ids (iterable, optional): Проверяемые уроки. По умолчанию проверяются все просмотры.
+        dry_run (bool): Только подсчитать несоответствия, ничего не изменяя.
+
+        Returns:
+        int: Количество просмотров с неверным статусом.
+    """
+    views = UserLessonView.objects.alias(expected_viewed=is_viewed_expression()).exclude(
+        is_viewed=F('expected_viewed')
+    )
+    if lesson_ids is not None:
+        views = views.filter(lesson_id__in=lesson_ids)
+    changed = list(views.values_list('lesson_id', flat=True))
+    if not changed or dry_run:
+        return len(changed)
+
+    changed_lessons = set(changed)
+    UserLessonView.objects.filter(lesson_id__in=changed_lessons).update(is_viewed=is_viewed_expression())
+    product_ids = list(
+        ProductLesson.objects.filter(lesson_id__in=changed_lessons).values_list('product_id', flat=True).distinct()
+    )
+    rebuild_product_stats(product_ids)
+    rebuild_user_progress(product_ids)
+    # Массовое обновление не отправляет сигналы, поэтому закэшированные ответы с этими продуктами сбрасываются явно
+    bump_versions([CATALOG, *map(product_scope, product_ids)])
+    return len(changed)
+
+
+def _lesson_totals(lesson_ids):
+    """
+        Возвращает суммарное время просмотра и количество просмотренных по каждому уроку.
+    """
+    totals = UserLessonView.objects.filter(lesson_id__in=lesson_ids).order_by().values('lesson_id').annotate(
+        viewed_time=Sum('viewed_duration'), watched=Count('pk', filter=Q(is_viewed=True)),
+    )
+    return {row['lesson_id']: (row['viewed_time'] or 0, row['watched']) for row in totals}
+
+
+def _changed_pairs(instance, reverse, pk_set):
+    """
+        Возвращает пары (product_id, id связанного объекта) для изменения связи многие-ко-многим.
+    """
+    if reverse:
+        return [(product_id, instance.pk) for product_id in pk_set]
+    return [(instance.pk, related_id) for related_id in pk_set]
+
+
+def _existing_pairs(through, instance, reverse, pk_set, field):
+    """
+        Возвращает только реально существующие пары связи, которые будут удалены.
+    """
+    if reverse:
+        rows = through.objects.filter(**{field: instance.pk, 'product_id__in': pk_set})
+    else:
+        rows = through.objects.filter(**{'product_id': instance.pk, f'{field}__in': pk_set})
+    return list(rows.values_list('product_id', field))
+
+
+def _affected_products(through, instance, reverse, field):
+    """
+        Возвращает идентификаторы продуктов, затрагиваемых очисткой связи.
+    """
+    if not reverse:
+        return [instance.pk]
+    return list(through.objects.filter(**{field: instance.pk}).values_list('product_id', flat=True))
+
+
+def _apply_lesson_pairs(pairs, sign):
+    totals = _lesson_totals({lesson_id for _, lesson_id in pairs})
+    deltas = defaultdict(lambda: defaultdict(int))
+    for product_id, lesson_id in pairs:
+        viewed_time, watched = totals.get(lesson_id, (0, 0))
+        deltas[product_id]['total_viewed_time'] += sign * viewed_time
+        deltas[product_id]['watched_lessons_count'] += sign * watched
+    apply_product_deltas(deltas)
+    _apply_progress_lesson_pairs(pairs, sign)
+
+
+def _apply_progress_lesson_pairs(pairs, sign):
+    """
+        Изменяет количество уроков в прогрессе всех пользователей продуктов и добавляет или вычитает
+        их просмотры уроков, включаемых в продукт или исключаемых из него.
+    """
+    if not pairs:
+        return
+    product_lessons = defaultdict(set)
+    for product_id, lesson_id in pairs:
+        product_lessons[product_id].add(lesson_id)
+    UserProductProgress.objects.filter(product_id__in=product_lessons).update(total_lessons=F('total_lessons') + Case(
+        *(When(product_id=product_id, then=Value(sign * len(lesson_ids)))
+          for product_id, lesson_ids in product_lessons.items()),
+        default=Value(0), output_field=IntegerField(),
+    ))
+
+    lesson_products = defaultdict(list)
+    for product_id, lesson_id in pairs:
+        lesson_products[lesson_id].append(product_id)
+    views = UserLessonView.objects.filter(
+        lesson_id__in=lesson_products,
+        user_id__in=ProductAccess.objects.filter(product_id__in=product_lessons).values('user_id'),
+    ).values_list('user_id', 'lesson_id', 'viewed_duration', 'is_viewed')
+    deltas = defaultdict(lambda: defaultdict(int))
+    for user_id, lesson_id, viewed_duration, is_viewed in views:
+        for product_id in lesson_products[lesson_id]:
+            deltas[user_id, product_id]['watched_seconds'] += sign * viewed_duration
+            deltas[user_id, product_id]['completed_lessons'] += sign * int(is_viewed)
+    apply_progress_deltas(deltas)
+
+
+def _apply_access_pairs(pairs, sign):
+    deltas = defaultdict(lambda: defaultdict(int))
+    for product_id, _ in pairs:
+        deltas[product_id]['students_count'] += sign
+    apply_product_deltas(deltas)
+    apply_access_progress(pairs, sign)
+
+
+def apply_access_progress(pairs, sign):
+    """
+        Создает прогресс пользователей по продуктам при выдаче доступа или удаляет его при отзыве.
+
+        Args:
+        pairs (iterable): Пары (product_id, user_id) выданных или отозванных доступов.
+        sign (int): 1 при выдаче доступа, -1 при отзыве.
+    """
+    user_pairs = {(user_id, product_id) for product_id, user_id in pairs}
+    if not user_pairs:
+        return
+    if sign > 0:
+        progress = _expected_user_progress(
+            {product_id for _, product_id in user_pairs}, {user_id for user_id, _ in user_pairs},
+        )
+        _save_user_progress({pair: values for pair, values in progress.items() if pair in user_pairs})
+    else:
+        product_users = defaultdict(set)
+        for user_id, product_id in user_pairs:
+            product_users[product_id].add(user_id)
+        condition = Q()
+        for product_id, user_ids in product_users.items():
+            condition |= Q(product_id=product_id, user_id__in=user_ids)
+        UserProductProgress.objects.filter(condition).delete()
+
+
+def _handle_m2m_change(through, field, apply_pairs, instance, action, reverse, pk_set):
+    if action == 'post_add' and pk_set:
+        apply_pairs(_changed_pairs(instance, reverse, pk_set), 1)
+    elif action == 'pre_remove' and pk_set:
+        instance._stats_removed_pairs = _existing_pairs(through, instance, reverse, pk_set, field)
+    elif action == 'post_remove':
+        apply_pairs(instance.__dict__.pop('_stats_removed_pairs', []), -1)
+    elif action == 'pre_clear':
+        instance._stats_cleared_products = _affected_products(through, instance, reverse, field)
+    elif action == 'post_clear':
+        product_ids = instance.__dict__.pop('_stats_cleared_products', [])
+        rebuild_product_stats(product_ids)
+        rebuild_user_progress(product_ids)
+
+
+@receiver(post_save, sender=Product)
+def create_product_stats(sender, instance, created, raw=False, **kwargs):
+    """
+        Создает пустую статистику для нового продукта.
+    """
+    if created and not raw:
+        ProductStats.objects.create(product=instance)
+
+
+@receiver(post_save, sender=UserLessonView)
+def update_stats_on_view_save(sender, instance, created, raw=False, **kwargs):
+    """
+        Переносит изменение прогресса просмотра на статистику продуктов урока
+        и записывает событие просмотра в журнал.
+    """
+    if raw:
+        return
+    snapshot = None if created else getattr(instance, '_progress_snapshot', None)
+    if not created and snapshot is None:
+        # Исходное состояние неизвестно, поэтому статистика и прогресс продуктов урока пересчитываются целиком.
+        product_ids = list(
+            ProductLesson.objects.filter(lesson_id=instance.lesson_id).values_list('product_id', flat=True)
+        )
+        rebuild_product_stats(product_ids)
+        rebuild_user_progress(product_ids)
+    else:
+        deltas = defaultdict(lambda: [0, 0])
+        if snapshot is not None:
+            user_id, lesson_id, viewed_duration, is_viewed = snapshot
+            deltas[user_id, lesson_id][0] -= viewed_duration
+            deltas[user_id, lesson_id][1] -= int(is_viewed)
+        deltas[instance.user_id, instance.lesson_id][0] += instance.viewed_duration
+        deltas[instance.user_id, instance.lesson_id][1] += int(instance.is_viewed)
+        apply_view_deltas(deltas)
+        log_view_events(deltas)
+    instance.remember_progress()
+
+
+@receiver(post_delete, sender=UserLessonView)
+def update_stats_on_view_delete(sender, instance, **kwargs):
+    """
+        Вычитает удаленный просмотр из статистики продуктов урока и прогресса пользователя.
+    """
+    user_id, lesson_id, viewed_duration, is_viewed = getattr(
+        instance, '_progress_snapshot',
+        (instance.user_id, instance.lesson_id, instance.viewed_duration, instance.is_viewed),
+    )
+    apply_view_deltas({(user_id, lesson_id): (-viewed_duration, -int(is_viewed))})
+
+
+@receiver(post_save, sender=Lesson)
+def sync_viewed_status_on_lesson_save(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """
+        Пересчитывает статус просмотров урока при изменении его длительности.
+    """
+    if created or raw or (update_fields is not None and 'duration' not in update_fields):
+        return
+    sync_viewed_status([instance.pk])
+
+
+@receiver(pre_delete, sender=Lesson)
+@receiver(pre_delete, sender=User)
+def remember_products_before_delete(sender, instance, **kwargs):
+    """
+        Запоминает продукты, связи с которыми удаляются каскадно без сигналов m2m_changed.
+    """
+    if sender is Lesson:
+        products = ProductLesson.objects.filter(lesson_id=instance.pk)
+    else:
+        products = ProductAccess.objects.filter(user_id=instance.pk)
+    instance._stats_products = list(products.values_list('product_id', flat=True))
+
+
+@receiver(post_delete, sender=Lesson)
+@receiver(post_delete, sender=User)
+def rebuild_stats_after_delete(sender, instance, **kwargs):
+    """
+        Пересчитывает статистику продуктов, затронутых каскадным удалением урока или пользователя,
+        и прогресс пользователей по продуктам удаленного урока. Прогресс удаленного пользователя
+        удаляется каскадно.
+    """
+    product_ids = instance.__dict__.pop('_stats_products', None)
+    if product_ids:
+        rebuild_product_stats(product_ids)
+        if sender is Lesson:
+            rebuild_user_progress(product_ids)
+
+
+@receiver(m2m_changed, sender=ProductLesson)
+def update_stats_on_lessons_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+        Добавляет или вычитает просмотры уроков, включаемых в продукт или исключаемых из него,
+        и изменяет количество уроков в прогрессе пользователей продукта.
+    """
+    _handle_m2m_change(ProductLesson, 'lesson_id', _apply_lesson_pairs, instance, action, reverse, pk_set)
+
+
+@receiver(m2m_changed, sender=ProductAccess)
+def update_stats_on_access_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+        Изменяет количество студентов продукта и создает или удаляет прогресс пользователя
+        при выдаче или отзыве доступа.
+    """
+    _handle_m2m_change(ProductAccess, 'user_id', _apply_access_pairs, instance, action, reverse, pk_set)
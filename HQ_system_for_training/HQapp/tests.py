@@ -1,3 +1,2076 @@
-from django.test import TestCase
+import csv
+import datetime
+import gc
+import json
+import math
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.checks import run_checks
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.models import F, QuerySet
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models.signals import post_delete, pre_delete
+from django.test import TestCase as DjangoTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import metrics, schema
+from .management.commands import create_test_data
+from .access import bulk_change_access, get_accessible_product_ids, has_product_access, invalidate_access
+from .benchmarks import benchmark_endpoints, compare_with_baseline, measure_endpoint
+from .events import ROLLUP_WATERMARK, compact_view_events
+from .exports import PROGRESS_COLUMNS, STATISTICS_COLUMNS
+from .metrics import MetricsRegistry
+from .middleware import QueryCollector, check_instrumentation_order, normalize_sql
+from .models import Product, Lesson, UserLessonView, UserProductProgress, LessonViewEvent, LessonViewRollup, \
+    EventWatermark, UserTokenVersion
+from .progress import ProgressBuffer, SerializedWriter, get_progress_writer, record_progress, \
+    shutdown_progress_buffer
+from .response_cache import check_shared_cache
+from .routers import PrimaryReplicaRouter, _read_from_replica
+from .serializers import LessonSerializer
+from .stats import apply_product_deltas, rebuild_product_stats, rebuild_user_progress, verify_product_stats, \
+    verify_user_progress
+from .tokens import USER_CACHE, create_token, revoke_tokens
+
+
+class TestCase(DjangoTestCase):
+    """
+    Базовый тест, очищающий кэш, чтобы закэшированные данные не переходили между тестами.
+    """
+
+    def setUp(self):
+        cache.clear()
+        USER_CACHE.clear()
+        super().setUp()
+
+
+class ProductStatisticViewTests(TestCase):
+    """
+    Тесты представления статистики по продуктам.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner', password='password')
+        self.student = User.objects.create_user('student', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def create_product(self, index):
+        product = Product.objects.create(title=f'Продукт {index}', owner=self.owner)
+        product.users_with_access.add(self.student)
+        lessons = [
+            Lesson.objects.create(title=f'Урок {index}.{i}', video_link='https://example.com', duration=100)
+            for i in range(2)
+        ]
+        product.lessons.add(*lessons)
+        UserLessonView.objects.create(user=self.student, lesson=lessons[0], viewed_duration=90)
+        UserLessonView.objects.create(user=self.student, lesson=lessons[1], viewed_duration=10)
+        return product
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('product-statistics'))
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_payload(self):
+        self.create_product(1)
+        Product.objects.create(title='Пустой продукт', owner=self.owner)
+
+        response = self.client.get(reverse('product-statistics'))
+
+        self.assertEqual(response.json(), [
+            {
+                'product': 'Продукт 1',
+                'watched_lessons_count': 1,
+                'total_viewed_time': 100,
+                'students_count': 1,
+                'acquisition_percentage': 50.0,
+            },
+            {
+                'product': 'Пустой продукт',
+                'watched_lessons_count': 0,
+                'total_viewed_time': 0,
+                'students_count': 0,
+                'acquisition_percentage': 0.0,
+            },
+        ])
+
+    def test_query_count_does_not_grow_with_products(self):
+        self.create_product(1)
+        queries_for_one = self.count_queries()
+
+        for index in range(2, 12):
+            self.create_product(index)
+
+        self.assertEqual(self.count_queries(), queries_for_one)
+
+
+class ProductStatsTests(TestCase):
+    """
+    Тесты инкрементального обновления предварительно вычисленной статистики продуктов.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner', password='password')
+        self.student = User.objects.create_user('student', password='password')
+        self.product = Product.objects.create(title='Продукт', owner=self.owner)
+        self.other_product = Product.objects.create(title='Другой продукт', owner=self.owner)
+        self.lesson = Lesson.objects.create(title='Урок', video_link='https://example.com', duration=100)
+
+    def assertConsistent(self):
+        self.assertEqual(verify_product_stats(), [])
+        self.assertEqual(verify_user_progress(), [])
+
+    def test_view_saves_update_stats(self):
+        self.product.lessons.add(self.lesson)
+        view = UserLessonView.objects.create(user=self.student, lesson=self.lesson, viewed_duration=10)
+        self.assertConsistent()
+
+        view.viewed_duration = 90
+        view.save()
+        self.assertConsistent()
+
+        view = UserLessonView.objects.get(pk=view.pk)
+        view.viewed_duration = 95
+        view.save()
+        self.product.stats.refresh_from_db()
+        self.assertEqual(self.product.stats.total_viewed_time, 95)
+        self.assertEqual(self.product.stats.watched_lessons_count, 1)
+
+        view.delete()
+        self.assertConsistent()
+
+    def test_lesson_membership_changes_update_stats(self):
+        UserLessonView.objects.create(user=self.student, lesson=self.lesson, viewed_duration=90)
+        self.product.lessons.add(self.lesson)
+        self.lesson.included_in_products.add(self.other_product)
+        self.assertConsistent()
+
+        self.product.lessons.remove(self.lesson, self.lesson)
+        self.assertConsistent()
+
+        self.lesson.included_in_products.clear()
+        self.assertConsistent()
+
+    def test_access_changes_update_stats(self):
+        self.product.users_with_access.add(self.student, self.owner)
+        self.student.accessible_products.add(self.other_product)
+        self.assertConsistent()
+
+        self.product.users_with_access.remove(self.student)
+        self.product.users_with_access.remove(self.student)
+        self.assertConsistent()
+
+        self.other_product.users_with_access.clear()
+        self.student.delete()
+        self.assertConsistent()
+
+    def test_lesson_delete_updates_stats(self):
+        self.product.lessons.add(self.lesson)
+        UserLessonView.objects.create(user=self.student, lesson=self.lesson, viewed_duration=90)
+
+        self.lesson.delete()
+        self.assertConsistent()
+
+    def test_rebuild_repairs_drift(self):
+        self.product.users_with_access.add(self.student)
+        self.product.stats.students_count = 10
+        self.product.stats.save()
+        self.assertNotEqual(verify_product_stats(), [])
+
+        rebuild_product_stats()
+        self.assertConsistent()
+
+
+class UserProductProgressTests(TestCase):
+    """
+    Тесты инкрементального обновления прогресса пользователей по продуктам и эндпоинта /api/my-progress/.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner', password='password')
+        self.student = User.objects.create_user('student', password='password')
+        self.product = Product.objects.create(title='Продукт', owner=self.owner)
+        self.other_product = Product.objects.create(title='Другой продукт', owner=self.owner)
+        self.lessons = Lesson.objects.bulk_create([
+            Lesson(title=f'Урок {i}', video_link='https://example.com', duration=100) for i in range(3)
+        ])
+        self.product.lessons.add(*self.lessons[:2])
+        self.other_product.lessons.add(*self.lessons[1:])
+        self.product.users_with_access.add(self.student)
+
+    def assertProgress(self, product, completed_lessons, total_lessons, watched_seconds):
+        self.assertEqual(verify_user_progress(), [])
+        progress = UserProductProgress.objects.get(user=self.student, product=product)
+        self.assertEqual(
+            (progress.completed_lessons, progress.total_lessons, progress.watched_seconds),
+            (completed_lessons, total_lessons, watched_seconds),
+        )
+
+    def test_views_and_lesson_changes_update_progress(self):
+        self.assertProgress(self.product, 0, 2, 0)
+        view = UserLessonView.objects.create(user=self.student, lesson=self.lessons[0], viewed_duration=50)
+        record_progress({(self.student.pk, self.lessons[1].pk): 90, (self.owner.pk, self.lessons[1].pk): 90})
+        self.assertProgress(self.product, 1, 2, 140)
+
+        view.viewed_duration = 85
+        view.save()
+        self.assertProgress(self.product, 2, 2, 175)
+
+        self.product.lessons.remove(self.lessons[1])
+        self.assertProgress(self.product, 1, 1, 85)
+        self.lessons[2].included_in_products.add(self.product)
+        self.assertProgress(self.product, 1, 2, 85)
+
+        view.delete()
+        self.assertProgress(self.product, 0, 2, 0)
+        self.lessons[2].delete()
+        self.assertProgress(self.product, 0, 1, 0)
+
+    def test_access_changes_create_and_delete_progress(self):
+        record_progress({(self.student.pk, self.lessons[2].pk): 90})
+        self.student.accessible_products.add(self.other_product)
+        self.assertProgress(self.other_product, 1, 2, 90)
+
+        self.other_product.users_with_access.remove(self.student)
+        self.assertFalse(UserProductProgress.objects.filter(product=self.other_product).exists())
+        self.assertEqual(verify_user_progress(), [])
+
+        self.student.accessible_products.clear()
+        self.assertFalse(UserProductProgress.objects.exists())
+        self.assertEqual(verify_user_progress(), [])
+
+    def test_repair_command(self):
+        UserProductProgress.objects.filter(user=self.student).update(watched_seconds=500)
+        UserProductProgress.objects.create(user=self.owner, product=self.product)
+
+        with self.assertRaises(CommandError):
+            call_command('repair_user_progress', '--verify-only', stdout=StringIO(), stderr=StringIO())
+        stdout = StringIO()
+        call_command('repair_user_progress', stdout=stdout, stderr=StringIO())
+        self.assertIn('consistent', stdout.getvalue())
+        self.assertEqual(verify_user_progress(), [])
+
+    def test_rebuild_for_selected_users(self):
+        self.product.users_with_access.add(self.owner)
+        UserProductProgress.objects.update(watched_seconds=500)
+        UserProductProgress.objects.create(user=self.student, product=self.other_product)
+
+        self.assertEqual(rebuild_user_progress(user_ids=[self.student.pk]), 1)
+        self.assertFalse(UserProductProgress.objects.filter(product=self.other_product).exists())
+        self.assertEqual(UserProductProgress.objects.get(user=self.student).watched_seconds, 0)
+        self.assertEqual(UserProductProgress.objects.get(user=self.owner).watched_seconds, 500)
+
+    def test_endpoint(self):
+        record_progress({(self.student.pk, self.lessons[0].pk): 90})
+        client = APIClient()
+        client.force_authenticate(self.student)
+
+        with self.assertNumQueries(1):
+            response = client.get(reverse('my-progress'))
+        self.assertEqual(response.data, [{
+            'product': {'id': self.product.pk, 'title': 'Продукт'},
+            'completed_lessons': 1, 'total_lessons': 2, 'watched_seconds': 90,
+        }])
+
+        self.product.lessons.add(self.lessons[2])
+        self.assertEqual(client.get(reverse('my-progress')).data[0]['total_lessons'], 3)
+
+
+class ViewedStatusTests(TestCase):
+    """
+    Тесты вычисления статуса просмотра при сохранении, массовых записях и изменении длительности урока.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner', password='password')
+        self.student = User.objects.create_user('student', password='password')
+        self.product = Product.objects.create(title='Продукт', owner=self.owner)
+        self.lessons = Lesson.objects.bulk_create([
+            Lesson(title=f'Урок {i}', video_link='https://example.com', duration=100) for i in range(2)
+        ])
+        self.product.lessons.add(*self.lessons)
+        self.product.users_with_access.add(self.student)
+
+    def assertViewed(self, lesson, expected):
+        self.assertEqual(UserLessonView.objects.get(user=self.student, lesson=lesson).is_viewed, expected)
+
+    def test_save_with_update_fields_writes_status(self):
+        view = UserLessonView.objects.create(user=self.student, lesson=self.lessons[0], viewed_duration=10)
+        view = UserLessonView.objects.get(pk=view.pk)
+        view.viewed_duration = 95
+        view.save(update_fields=['viewed_duration'])
+
+        self.assertViewed(self.lessons[0], True)
+        self.assertEqual(verify_product_stats(), [])
+        self.assertEqual(verify_user_progress(), [])
+
+        view.lesson = self.lessons[1]
+        view.viewed_duration = 10
+        view.save(update_fields=['lesson', 'viewed_duration'])
+        self.assertViewed(self.lessons[1], False)
+        self.assertEqual(verify_product_stats(), [])
+
+    def test_upsert_with_update_fields_writes_status(self):
+        UserLessonView.objects.create(user=self.student, lesson=self.lessons[0], viewed_duration=10)
+        UserLessonView.objects.bulk_create(
+            [UserLessonView(user=self.student, lesson_id=self.lessons[0].pk, viewed_duration=95)],
+            update_conflicts=True, unique_fields=['user', 'lesson'], update_fields=['viewed_duration'],
+        )
+
+        self.assertViewed(self.lessons[0], True)
+
+    def test_save_uses_loaded_lesson_and_resets_status(self):
+        UserLessonView.objects.create(user=self.student, lesson=self.lessons[0], viewed_duration=90)
+        view = UserLessonView.objects.select_related('lesson').get(user=self.student)
+        view.viewed_duration = 10
+        with CaptureQueriesContext(connection) as queries:
+            view.save()
+        self.assertFalse(any('"HQapp_lesson"' in query['sql'] for query in queries.captured_queries))
+        self.assertViewed(self.lessons[0], False)
+
+        view = UserLessonView.objects.get(pk=view.pk)
+        view.viewed_duration = 80
+        view.save()
+        self.assertViewed(self.lessons[0], True)
+
+    def test_bulk_create_and_update(self):
+        UserLessonView.objects.bulk_create([
+            UserLessonView(user=self.student, lesson_id=self.lessons[0].pk, viewed_duration=90, is_viewed=False),
+            UserLessonView(user=self.student, lesson_id=self.lessons[1].pk, viewed_duration=10, is_viewed=True),
+        ])
+        self.assertViewed(self.lessons[0], True)
+        self.assertViewed(self.lessons[1], False)
+
+        views = UserLessonView.objects.filter(user=self.student)
+        views.update(viewed_duration=F('viewed_duration') + 70)
+        self.assertViewed(self.lessons[1], True)
+        views.update(is_viewed=False)
+        self.assertViewed(self.lessons[1], True)
+        views.filter(lesson=self.lessons[0]).update(viewed_duration=0)
+        self.assertViewed(self.lessons[0], False)
+
+    def test_lesson_duration_change_updates_status(self):
+        record_progress({(self.student.pk, self.lessons[0].pk): 85})
+        self.lessons[0].duration = 200
+        self.lessons[0].save()
+
+        self.assertViewed(self.lessons[0], False)
+        self.assertEqual(verify_product_stats(), [])
+        self.assertEqual(verify_user_progress(), [])
+
+    def test_sync_command_fixes_drift(self):
+        record_progress({(self.student.pk, self.lessons[0].pk): 85})
+        QuerySet.update(UserLessonView.objects.all(), is_viewed=False)  # Обход вычисления статуса
+
+        stdout = StringIO()
+        call_command('sync_viewed_status', '--dry-run', stdout=stdout)
+        self.assertIn('Would fix the viewed status of 1 ', stdout.getvalue())
+        call_command('sync_viewed_status', stdout=StringIO())
+        self.assertViewed(self.lessons[0], True)
+        self.assertEqual(verify_product_stats(), [])
+        self.assertEqual(verify_user_progress(), [])
+
+
+class LessonsByProductViewTests(TestCase):
+    """
+    Тесты представления уроков продукта.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner', password='password')
+        self.student = User.objects.create_user('student', password='password')
+        self.product = Product.objects.create(title='Продукт', owner=self.owner)
+        self.product.users_with_access.add(self.student)
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+
+    def add_lessons(self, count):
+        lessons = Lesson.objects.bulk_create([
+            Lesson(title=f'Урок {i}', video_link='https://example.com', duration=100) for i in range(count)
+        ])
+        self.product.lessons.add(*lessons)
+        return lessons
+
+    def get_lessons(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('lessons-by-product', args=[self.product.pk]))
+        self.assertEqual(response.status_code, 200)
+        return response, len(context.captured_queries)
+
+    def test_get_is_read_only_with_constant_queries(self):
+        lessons = self.add_lessons(2)
+        UserLessonView.objects.create(user=self.student, lesson=lessons[0], viewed_duration=90)
+        response, queries_for_two = self.get_lessons()
+
+        self.assertEqual(
+            [(lesson['is_viewed'], lesson['viewed_duration']) for lesson in response.data['lessons']],
+            [(True, 90), (False, 0)],
+        )
+        self.assertIsNone(response.data['lessons'][1]['last_viewed_date'])
+        self.assertEqual(UserLessonView.objects.count(), 1)
+
+        self.add_lessons(20)
+        _, queries_for_many = self.get_lessons()
+        self.assertEqual(queries_for_many, queries_for_two)
+        self.assertEqual(UserLessonView.objects.count(), 1)
+
+    def test_no_access(self):
+        self.product.users_with_access.remove(self.student)
+        response = self.client.get(reverse('lessons-by-product', args=[self.product.pk]))
+        self.assertEqual(response.status_code, 404)
+
+
+class ProductAccessTests(TestCase):
+    """
+    Тесты проверки доступа пользователей к продуктам.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner', password='password')
+        self.student = User.objects.create_user('student', password='password')
+        self.product = Product.objects.create(title='Продукт', owner=self.owner)
+        self.other_product = Product.objects.create(title='Другой продукт', owner=self.owner)
+        self.product.users_with_access.add(self.student)
+
+    def fresh_student(self):
+        return User.objects.get(pk=self.student.pk)
+
+    def test_access_check_is_single_query(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(has_product_access(self.student, self.product.pk))
+        with self.assertNumQueries(1):
+            self.assertFalse(has_product_access(self.student, self.other_product.pk))
+
+    def test_access_map_is_cached(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_accessible_product_ids(self.student), {self.product.pk})
+
+        student = self.fresh_student()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_accessible_product_ids(student), {self.product.pk})
+            self.assertTrue(has_product_access(student, self.product.pk))
+            self.assertFalse(has_product_access(student, self.other_product.pk))
+
+    def test_access_changes_invalidate_cache(self):
+        get_accessible_product_ids(self.student)
+
+        self.other_product.users_with_access.add(self.student)
+        self.assertEqual(get_accessible_product_ids(self.fresh_student()), {self.product.pk, self.other_product.pk})
+
+        self.student.accessible_products.remove(self.product)
+        self.assertEqual(get_accessible_product_ids(self.fresh_student()), {self.other_product.pk})
+
+        self.other_product.users_with_access.clear()
+        self.assertEqual(get_accessible_product_ids(self.fresh_student()), frozenset())
+
+    def test_accessible_products_list(self):
+        client = APIClient()
+        client.force_authenticate(self.student)
+
+        response = client.get(reverse('accessible-products-list'))
+
+        self.assertEqual([product['id'] for product in response.data['results']], [self.product.pk])
+
+
+class ProgressBatchViewTests(TestCase):
+    """
+    Тесты пакетной записи прогресса просмотра уроков.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner', password='password')
+        self.student = User.objects.create_user('student', password='password')
+        self.staff = User.objects.create_user('staff', password='password', is_staff=True)
+        self.product = Product.objects.create(title='Продукт', owner=self.owner)
+        self.lessons = Lesson.objects.bulk_create([
+            Lesson(title=f'Урок {i}', video_link='https://example.com', duration=100) for i in range(3)
+        ])
+        self.product.lessons.add(*self.lessons)
+        self.product.users_with_access.add(self.student, self.owner)
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+
+    def post(self, heartbeats):
+        return self.client.post(reverse('progress-batch'), heartbeats, format='json')
+
+    def test_record_progress_locks_users_before_reading(self):
+        UserLessonView.objects.create(user=self.student, lesson=self.lessons[0], viewed_duration=90)
+        with mock.patch.object(QuerySet, 'select_for_update', autospec=True,
+                               side_effect=QuerySet.select_for_update) as lock:
+            record_progress({(self.student.pk, self.lessons[0].pk): 50, (self.owner.pk, self.lessons[0].pk): 20})
+
+        self.assertEqual([call.args[0].model for call in lock.call_args_list], [User, UserLessonView])
+        self.assertEqual(UserLessonView.objects.get(user=self.student).viewed_duration, 90)
+        self.assertEqual(verify_product_stats(), [])
+        self.assertEqual(verify_user_progress(), [])
+
+    def test_batch_coalesces_and_upserts(self):
+        UserLessonView.objects.create(user=self.student, lesson=self.lessons[1], viewed_duration=50)
+
+        response = self.post([
+            {'lesson_id': self.lessons[0].pk, 'viewed_duration': 10},
+            {'lesson_id': self.lessons[0].pk, 'viewed_duration': 85},
+            {'lesson_id': self.lessons[0].pk, 'viewed_duration': 40},
+            {'lesson_id': self.lessons[1].pk, 'viewed_duration': 20},
+            {'lesson_id': 999999, 'viewed_duration': 20},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'received': 5, 'coalesced': 2, 'written': 2, 'skipped': 1})
+        views = {view.lesson_id: view for view in UserLessonView.objects.filter(user=self.student)}
+        self.assertEqual((views[self.lessons[0].pk].viewed_duration, views[self.lessons[0].pk].is_viewed), (85, True))
+        self.assertEqual((views[self.lessons[1].pk].viewed_duration, views[self.lessons[1].pk].is_viewed), (50, False))
+        self.assertEqual(verify_product_stats(), [])
+        self.assertEqual(verify_user_progress(), [])
+
+    def test_query_count_does_not_grow_with_batch(self):
+        with CaptureQueriesContext(connection) as small:
+            self.post([{'lesson_id': self.lessons[0].pk, 'viewed_duration': 10}])
+        with CaptureQueriesContext(connection) as large:
+            self.post([{'lesson_id': lesson.pk, 'viewed_duration': 90} for lesson in self.lessons])
+        self.assertEqual(len(large.captured_queries), len(small.captured_queries))
+
+    def test_other_users_require_staff(self):
+        heartbeat = {'lesson_id': self.lessons[0].pk, 'viewed_duration': 10, 'user_id': self.owner.pk}
+        self.assertEqual(self.post([heartbeat]).status_code, 400)
+
+        self.client.force_authenticate(self.staff)
+        response = self.post([heartbeat, dict(heartbeat, user_id=999999)])
+        self.assertEqual(response.data['written'], 1)
+        self.assertEqual(response.data['skipped'], 1)
+        self.assertTrue(UserLessonView.objects.filter(user=self.owner, lesson=self.lessons[0]).exists())
+
+
+    @override_settings(PROGRESS_BATCH_MAX_SIZE=2)
+    def test_batch_size_is_limited(self):
+        response = self.post([{'lesson_id': lesson.pk, 'viewed_duration': 10} for lesson in self.lessons])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(UserLessonView.objects.exists())
+
+    def test_lessons_without_access_are_skipped(self):
+        other = Product.objects.create(title='Другой продукт', owner=self.owner)
+        lesson = Lesson.objects.create(title='Закрытый урок', video_link='https://example.com', duration=100)
+        other.lessons.add(lesson)
+
+        response = self.post([
+            {'lesson_id': lesson.pk, 'viewed_duration': 90},
+            {'lesson_id': self.lessons[0].pk, 'viewed_duration': 90},
+        ])
+
+        self.assertEqual(response.data, {'received': 2, 'coalesced': 0, 'written': 1, 'skipped': 1})
+        self.assertFalse(UserLessonView.objects.filter(lesson=lesson).exists())
+        self.assertFalse(LessonViewEvent.objects.filter(lesson=lesson).exists())
+        self.assertEqual(other.stats.total_viewed_time, 0)
+        self.assertEqual(verify_product_stats(), [])
+        self.assertEqual(verify_user_progress(), [])
+
+
+class BulkProductAccessViewTests(TestCase):
+    """
+    Тесты массовой выдачи и отзыва доступов к продукту.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner', password='password')
+        self.users = User.objects.bulk_create([User(username=f'student{i}') for i in range(30)])
+        self.product = Product.objects.create(title='Продукт', owner=self.owner)
+        self.lesson = Lesson.objects.create(title='Урок', video_link='https://example.com', duration=100)
+        self.product.lessons.add(self.lesson)
+        self.product.users_with_access.add(self.users[0])
+        record_progress({(self.users[1].pk, self.lesson.pk): 90})
+        self.url = reverse('product-access-bulk', args=[self.product.pk])
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def assertConsistent(self):
+        self.assertEqual(verify_product_stats(), [])
+        self.assertEqual(verify_user_progress(), [])
+
+    @override_settings(ACCESS_BULK_CHUNK_SIZE=7)
+    def test_grant_in_chunks_invalidates_once(self):
+        self.assertEqual(get_accessible_product_ids(self.users[1]), frozenset())  # Доступы закэшированы
+        user_ids = [user.pk for user in self.users] + [self.users[1].pk, 999999]
+
+        with mock.patch('HQapp.access.invalidate_access', wraps=invalidate_access) as invalidate, \
+                mock.patch('HQapp.access.apply_product_deltas', wraps=apply_product_deltas) as apply_deltas:
+            response = self.client.post(self.url, {'user_ids': user_ids}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'requested': 31, 'granted': 29, 'unchanged': 1, 'unknown': 1})
+        invalidate.assert_called_once()
+        self.assertEqual(set(invalidate.call_args.args[0]), {user.pk for user in self.users[1:]})
+        apply_deltas.assert_called_once()
+        self.assertEqual(get_accessible_product_ids(self.users[1]), frozenset([self.product.pk]))
+        progress = UserProductProgress.objects.get(user=self.users[1], product=self.product)
+        self.assertEqual((progress.completed_lessons, progress.watched_seconds), (1, 90))
+        self.assertConsistent()
+
+    def test_locks_product_before_reading_access(self):
+        with mock.patch.object(QuerySet, 'select_for_update', autospec=True,
+                               side_effect=QuerySet.select_for_update) as lock:
+            counts = bulk_change_access(self.product.pk, [self.users[0].pk, self.users[1].pk])
+
+        self.assertEqual([call.args[0].model for call in lock.call_args_list], [Product, Product.users_with_access.through])
+        self.assertEqual(counts['changed'], 1)
+        self.assertConsistent()
+
+    def test_query_count_does_not_grow_with_users(self):
+        with CaptureQueriesContext(connection) as small:
+            self.client.post(self.url, {'user_ids': [user.pk for user in self.users[:5]]}, format='json')
+        with CaptureQueriesContext(connection) as large:
+            self.client.post(self.url, {'user_ids': [user.pk for user in self.users[5:]]}, format='json')
+        self.assertEqual(len(large.captured_queries), len(small.captured_queries))
+
+    def test_csv_body_and_upload(self):
+        csv_body = 'user_id\r\n' + ''.join(f'{user.pk},ignored\r\n' for user in self.users[:10])
+        response = self.client.post(self.url, csv_body, content_type='text/csv')
+        self.assertEqual(response.data['granted'], 9)
+
+        upload = SimpleUploadedFile('users.csv', '\n'.join(str(user.pk) for user in self.users).encode())
+        response = self.client.post(self.url, {'file': upload}, format='multipart')
+        self.assertEqual(response.data, {'requested': 30, 'granted': 20, 'unchanged': 10, 'unknown': 0})
+        self.assertConsistent()
+
+    def test_invalid_csv_changes_nothing(self):
+        response = self.client.post(self.url, f'{self.users[1].pk}\nnot-a-user\n', content_type='text/csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.product.users_with_access.count(), 1)
+
+    def test_revoke(self):
+        self.client.post(self.url, {'user_ids': [user.pk for user in self.users[:10]]}, format='json')
+        response = self.client.delete(self.url, {'user_ids': [user.pk for user in self.users[5:15]]}, format='json')
+
+        self.assertEqual(response.data, {'requested': 10, 'revoked': 5, 'unchanged': 5, 'unknown': 0})
+        self.assertEqual(self.product.users_with_access.count(), 5)
+        self.assertFalse(has_product_access(self.users[5], self.product.pk))
+        self.assertConsistent()
+
+    def test_only_owner(self):
+        self.client.force_authenticate(self.users[0])
+        response = self.client.post(self.url, {'user_ids': [self.users[1].pk]}, format='json')
+        self.assertEqual(response.status_code, 403)
+        missing = reverse('product-access-bulk', args=[999999])
+        self.client.force_authenticate(self.owner)
+        self.assertEqual(self.client.post(missing, {'user_ids': []}, format='json').status_code, 404)
+        self.assertEqual(self.client.post(self.url, {'user_ids': 'all'}, format='json').status_code, 400)
+
+
+class LessonViewEventTests(TestCase):
+    """
+    Тесты журнала событий просмотра и его свертки в агрегаты.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner', password='password')
+        self.user = User.objects.create(username='student')
+        self.product = Product.objects.create(title='Продукт', owner=self.owner)
+        self.other_product = Product.objects.create(title='Другой продукт', owner=self.owner)
+        self.lesson = Lesson.objects.create(title='Урок', video_link='https://example.com', duration=100)
+        self.product.lessons.add(self.lesson)
+        self.other_product.lessons.add(self.lesson)
+        self.url = reverse('product-statistics-timeseries')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def set_created_at(self, moment):
+        LessonViewEvent.objects.update(created_at=moment)
+
+    def test_progress_writes_append_only_events(self):
+        record_progress({(self.user.pk, self.lesson.pk): 50})
+        record_progress({(self.user.pk, self.lesson.pk): 30})  # Прогресс не вырос — события нет
+        view = UserLessonView.objects.get(user=self.user, lesson=self.lesson)
+        view.viewed_duration = 90
+        view.save()
+
+        events = list(LessonViewEvent.objects.order_by('pk').values_list('watched_seconds', 'completed'))
+        self.assertEqual(events, [(50, False), (40, True)])
+
+    def test_compaction_is_incremental(self):
+        moment = datetime.datetime(2026, 3, 1, 10, 15, tzinfo=datetime.timezone.utc)
+        record_progress({(self.user.pk, self.lesson.pk): 50})
+        self.set_created_at(moment)
+        self.assertEqual(compact_view_events(settle_seconds=0), 1)
+        self.assertEqual(compact_view_events(settle_seconds=0), 0)
+
+        record_progress({(self.user.pk, self.lesson.pk): 90})
+        LessonViewEvent.objects.filter(
+            pk__gt=EventWatermark.objects.get(name=ROLLUP_WATERMARK).last_event_id,
+        ).update(created_at=moment + datetime.timedelta(hours=1))
+        self.assertEqual(compact_view_events(settle_seconds=0), 1)
+
+        rollups = LessonViewRollup.objects.filter(product=self.product).order_by('bucket', 'bucket_start')
+        self.assertEqual(
+            list(rollups.values_list('bucket', 'watched_seconds', 'events', 'completed')),
+            [('day', 90, 2, 1), ('hour', 50, 1, 0), ('hour', 40, 1, 1)],
+        )
+        self.assertEqual(LessonViewRollup.objects.filter(product=self.other_product, bucket='day').get().events, 2)
+        self.assertEqual(
+            EventWatermark.objects.get(name=ROLLUP_WATERMARK).last_event_id, LessonViewEvent.objects.latest('pk').pk,
+        )
+
+    def test_compaction_waits_for_recent_events(self):
+        record_progress({(self.user.pk, self.lesson.pk): 50})
+        self.assertEqual(compact_view_events(settle_seconds=60), 0)
+        self.assertFalse(LessonViewRollup.objects.exists())
+
+        self.set_created_at(timezone.now() - datetime.timedelta(minutes=2))
+        self.assertEqual(compact_view_events(settle_seconds=60), 1)
+
+    def test_compact_command(self):
+        record_progress({(self.user.pk, self.lesson.pk): 50})
+        out = StringIO()
+        call_command('compact_view_events', '--settle-seconds', '0', '--batch-size', '1', stdout=out)
+        self.assertIn('Rolled up 1 lesson view events', out.getvalue())
+
+    def test_timeseries_reads_rollups(self):
+        moment = datetime.datetime(2026, 3, 1, 10, 15, tzinfo=datetime.timezone.utc)
+        record_progress({(self.user.pk, self.lesson.pk): 90})
+        self.set_created_at(moment)
+        compact_view_events(settle_seconds=0)
+        LessonViewEvent.objects.all().delete()  # Ответ строится только по агрегатам
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {
+                'bucket': 'hour', 'from': '2026-03-01', 'to': '2026-03-02', 'product': self.product.pk,
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [{
+            'product': {'id': self.product.pk, 'title': 'Продукт'},
+            'points': [{
+                'bucket_start': datetime.datetime(2026, 3, 1, 10, tzinfo=datetime.timezone.utc),
+                'watched_seconds': 90, 'events': 1, 'completed': 1,
+            }],
+        }])
+
+        response = self.client.get(self.url, {'bucket': 'hour', 'from': '2026-03-01T00:00:00', 'to': '2026-03-01T10:00:00'})
+        self.assertEqual(response.data['results'], [])
+        response = self.client.get(self.url, {'from': '2026-02-01', 'to': '2026-03-02'})
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_timeseries_validates_params(self):
+        for params in [
+            {'bucket': 'week'},
+            {'from': 'вчера'},
+            {'from': '2026-03-02', 'to': '2026-03-01'},
+            {'bucket': 'hour', 'from': '2000-01-01', 'to': '2026-01-01'},
+            {'product': 'abc'},
+        ]:
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(self.url, params).status_code, 400)
+
+
+class CSVExportTests(TestCase):
+    """
+    Тесты потоковой выгрузки статистики и прогресса в CSV.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner', password='password')
+        self.other_owner = User.objects.create(username='other_owner')
+        self.users = User.objects.bulk_create([User(username=f'student{i}') for i in range(3)])
+        self.product = Product.objects.create(title='Продукт', owner=self.owner)
+        self.other_product = Product.objects.create(title='Чужой продукт', owner=self.other_owner)
+        self.lessons = [
+            Lesson.objects.create(title=f'Урок {i}', video_link='https://example.com', duration=100) for i in range(2)
+        ]
+        self.product.lessons.add(*self.lessons)
+        self.product.users_with_access.add(*self.users[:2])
+        record_progress({
+            (self.users[0].pk, self.lessons[0].pk): 90,
+            (self.users[0].pk, self.lessons[1].pk): 10,
+            (self.users[1].pk, self.lessons[0].pk): 30,
+        })
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def read_csv(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        return list(csv.reader(StringIO(b''.join(response.streaming_content).decode())))
+
+    def test_progress_export(self):
+        response = self.client.get(reverse('product-progress-export', args=[self.product.pk]))
+        rows = self.read_csv(response)
+
+        self.assertIn('product-%d-progress.csv' % self.product.pk, response['Content-Disposition'])
+        self.assertEqual(rows[0], list(PROGRESS_COLUMNS))
+        self.assertEqual([row[:6] for row in rows[1:]], [
+            [str(self.users[0].pk), 'student0', str(self.lessons[0].pk), 'Урок 0', '90', 'True'],
+            [str(self.users[0].pk), 'student0', str(self.lessons[1].pk), 'Урок 1', '10', 'False'],
+            [str(self.users[1].pk), 'student1', str(self.lessons[0].pk), 'Урок 0', '30', 'False'],
+        ])
+
+    def test_progress_export_is_owner_only(self):
+        student = APIClient()
+        student.force_authenticate(self.users[0])
+        self.assertEqual(student.get(reverse('product-progress-export', args=[self.product.pk])).status_code, 403)
+        self.assertEqual(self.client.get(reverse('product-progress-export', args=[999999])).status_code, 404)
+        self.assertEqual(APIClient().get(reverse('product-progress-export', args=[self.product.pk])).status_code, 401)
+
+    def test_statistics_export_matches_statistics_view(self):
+        expected = self.client.get(reverse('product-statistics')).data
+        rows = self.read_csv(self.client.get(reverse('product-statistics-export')))
+
+        self.assertEqual(rows[0], list(STATISTICS_COLUMNS))
+        own = next(item for item in expected if item['product'] == 'Продукт')
+        self.assertEqual(rows[1:], [[str(own[column]) for column in STATISTICS_COLUMNS]])
+
+    def test_export_streams_in_chunks(self):
+        with override_settings(STREAMING_CHUNK_SIZE=1), CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('product-progress-export', args=[self.product.pk]))
+            rows = self.read_csv(response)
+        self.assertEqual(len(rows), 4)
+        # SQLite не поддерживает серверные курсоры: итератор читает строки пачками из одного запроса
+        self.assertEqual(sum('HQapp_userlessonview' in query['sql'] for query in queries), 1)
+
+    def test_export_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'progress.csv')
+            out = StringIO()
+            call_command('export_csv', '--product', str(self.product.pk), '--output', path, stdout=out)
+            with open(path, newline='', encoding='utf-8') as file:
+                rows = list(csv.reader(file))
+        self.assertIn('Exported 3 rows', out.getvalue())
+        self.assertEqual(len(rows), 4)
+
+        out = StringIO()
+        call_command('export_csv', '--statistics', '--owner', str(self.other_owner.pk), stdout=out)
+        rows = list(csv.reader(StringIO(out.getvalue())))
+        self.assertEqual([row[0] for row in rows], ['product', 'Чужой продукт'])
+
+        with self.assertRaises(CommandError):
+            call_command('export_csv', '--product', '999999', stdout=StringIO())
+
+
+class OpenAPISchemaTests(TestCase):
+    """
+    Тесты статической схемы OpenAPI.
+    """
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'openapi.json')
+        settings_override = override_settings(OPENAPI_SCHEMA={'PATH': self.path, 'MAX_AGE': 3600})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        schema._loaded = None
+        self.addCleanup(setattr, schema, '_loaded', None)
+
+    def test_command_writes_schema_served_with_etag(self):
+        out = StringIO()
+        call_command('generate_openapi_schema', stdout=out)
+        self.assertIn('Wrote', out.getvalue())
+
+        with mock.patch('HQapp.schema.generate_schema') as generate:
+            response = self.client.get(reverse('schema-json'))
+            generate.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('/products/{product_id}/lessons/', json.loads(response.content)['paths'])
+        self.assertIn('max-age=3600', response['Cache-Control'])
+        self.assertIn('public', response['Cache-Control'])
+
+        not_modified = self.client.get(reverse('schema-json'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+        with open(self.path, 'w') as file:
+            file.write('{"paths": {}}')
+        os.utime(self.path, ns=(0, 0))
+        changed = self.client.get(reverse('schema-json'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(json.loads(changed.content), {'paths': {}})
+
+    def test_written_schema_is_world_readable(self):
+        with mock.patch('HQapp.schema.generate_schema', return_value=b'{}'):
+            self.assertEqual(schema.write_schema(), 2)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o644)
+
+    def test_missing_schema_is_generated_once(self):
+        with mock.patch('HQapp.schema.generate_schema', return_value=b'{}') as generate, \
+                self.assertLogs('HQapp.schema', 'WARNING'):
+            self.assertEqual(self.client.get(reverse('schema-json')).content, b'{}')
+            self.assertEqual(self.client.get(reverse('schema-json')).content, b'{}')
+        generate.assert_called_once()
+
+    def test_docs_pages_load_static_schema(self):
+        for name in ('schema-swagger-ui', 'schema-redoc'):
+            with self.subTest(name=name), mock.patch('HQapp.schema.generate_schema') as generate:
+                response = self.client.get(reverse(name))
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, reverse('schema-json'))
+                self.assertIn('max-age=3600', response['Cache-Control'])
+                generate.assert_not_called()
+
+
+class TokenAuthenticationTests(TestCase):
+    """
+    Тесты аутентификации подписанными токенами.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('student', password='password')
+        self.owner = User.objects.create(username='owner')
+        self.product = Product.objects.create(title='Продукт', owner=self.owner)
+        self.product.users_with_access.add(self.user)
+        self.url = reverse('accessible-products-list')
+        self.client = APIClient()
+
+    def authorize(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_obtain_token(self):
+        response = self.client.post(reverse('auth-token'), {'username': 'student', 'password': 'password'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['expires_in'], settings.TOKEN_AUTH['MAX_AGE'])
+
+        self.authorize(response.data['token'])
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+        response = self.client.post(reverse('auth-token'), {'username': 'student', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_token_requests_skip_session_and_cache_user(self):
+        self.authorize(create_token(self.user))
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['id'], self.product.pk)
+        # Ни сессии, ни пользователя не загружается; продукты по-прежнему загружаются с владельцами
+        auth_queries = [query for query in queries if 'FROM "django_session"' in query['sql']
+                        or 'FROM "auth_user"' in query['sql']]
+        self.assertEqual(auth_queries, [])
+
+    def test_revoke_tokens(self):
+        token = create_token(self.user)
+        self.authorize(token)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+        self.assertEqual(self.client.delete(reverse('auth-token')).status_code, 204)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer')
+
+        revoke_tokens(self.user)
+        self.authorize(create_token(self.user))
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_password_change_revokes_tokens(self):
+        self.authorize(create_token(self.user))
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+        self.user.set_password('new password')
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+        self.client.credentials()
+        response = self.client.post(reverse('auth-token'), {'username': 'student', 'password': 'new password'})
+        self.authorize(response.data['token'])
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_invalid_tokens_are_rejected(self):
+        token = create_token(self.user)
+        for invalid in (token[:-1] + ('A' if token[-1] != 'A' else 'B'), 'garbage', f'{token} extra'):
+            with self.subTest(token=invalid):
+                self.authorize(invalid)
+                self.assertEqual(self.client.get(self.url).status_code, 401)
+
+        self.authorize(token)
+        expired = time.time() + settings.TOKEN_AUTH['MAX_AGE'] + 1
+        with mock.patch('django.core.signing.time.time', return_value=expired):
+            self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_deactivated_user_is_rejected(self):
+        self.authorize(create_token(self.user))
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    @override_settings(TOKEN_AUTH={'MAX_AGE': 60, 'USER_CACHE_SIZE': 2, 'USER_CACHE_TTL': 30})
+    def test_user_cache_is_lru_with_ttl(self):
+        for user_id in (1, 2, 3):
+            USER_CACHE.set(user_id, f'user{user_id}', 0)
+        self.assertIsNone(USER_CACHE.get(1))
+        self.assertEqual(USER_CACHE.get(2), ('user2', 0))
+
+        with mock.patch('HQapp.tokens.time.monotonic', return_value=time.monotonic() + 31):
+            self.assertIsNone(USER_CACHE.get(2))
+
+
+class ProgressBufferTests(TestCase):
+    """
+    Тесты буфера отложенной записи прогресса.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.student = User.objects.create_user('student', password='password')
+        self.lessons = Lesson.objects.bulk_create([
+            Lesson(title=f'Урок {i}', video_link='https://example.com', duration=100) for i in range(3)
+        ])
+
+    def test_coalesces_and_flushes(self):
+        progress_buffer = ProgressBuffer(max_size=10, flush_size=10)
+        progress_buffer.add(self.student.pk, self.lessons[0].pk, 30)
+        progress_buffer.add(self.student.pk, self.lessons[0].pk, 90)
+        progress_buffer.add(self.student.pk, self.lessons[0].pk, 60)
+        progress_buffer.add(self.student.pk, self.lessons[1].pk, 10)
+
+        self.assertEqual(progress_buffer.flush(), 2)
+        self.assertEqual(
+            dict(UserLessonView.objects.values_list('lesson_id', 'viewed_duration')),
+            {self.lessons[0].pk: 90, self.lessons[1].pk: 10},
+        )
+        self.assertEqual(
+            progress_buffer.counters(),
+            {'accepted': 2, 'coalesced': 2, 'dropped': 0, 'flushed': 2, 'failed': 0, 'pending': 0},
+        )
+
+    def test_drops_when_full(self):
+        progress_buffer = ProgressBuffer(max_size=2, flush_size=10, block_timeout=0)
+        results = [progress_buffer.add(self.student.pk, lesson.pk, 10) for lesson in self.lessons]
+        # Сигнал для пары, уже находящейся в буфере, объединяется даже при заполненном буфере
+        results.append(progress_buffer.add(self.student.pk, self.lessons[0].pk, 20))
+
+        self.assertEqual(results, [True, True, False, True])
+        self.assertEqual(progress_buffer.counters()['dropped'], 1)
+        self.assertEqual(len(progress_buffer), 2)
+
+
+class ProgressBufferThreadTests(TransactionTestCase):
+    """
+    Тесты фоновой записи буфера отложенной записи прогресса.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.student = User.objects.create_user('student', password='password')
+        self.lesson = Lesson.objects.create(title='Урок', video_link='https://example.com', duration=100)
+
+    def test_background_flush_by_size_and_on_stop(self):
+        progress_buffer = ProgressBuffer(max_size=10, flush_size=1, flush_interval=60)
+        progress_buffer.start()
+        try:
+            progress_buffer.add(self.student.pk, self.lesson.pk, 50)
+            for _ in range(100):
+                if progress_buffer.counters()['flushed']:
+                    break
+                time.sleep(0.05)
+            self.assertEqual(progress_buffer.counters()['flushed'], 1)
+        finally:
+            progress_buffer.stop()
+        self.assertEqual(UserLessonView.objects.get().viewed_duration, 50)
+
+    def test_add_many_waits_once_per_batch(self):
+        # Фоновый поток запущен, но не освобождает место: буфер не достигает flush_size
+        progress_buffer = ProgressBuffer(max_size=1, flush_size=10, flush_interval=60, block_timeout=0.2)
+        progress_buffer.start()
+        try:
+            started = time.monotonic()
+            accepted = progress_buffer.add_many({(self.student.pk, lesson_id): 10 for lesson_id in range(1, 6)})
+            elapsed = time.monotonic() - started
+        finally:
+            progress_buffer.stop()
+
+        self.assertEqual(accepted, 1)
+        self.assertEqual(progress_buffer.counters()['dropped'], 4)
+        self.assertLess(elapsed, 0.4)
+
+    @override_settings(PROGRESS_WRITE_BEHIND={'ENABLED': True, 'FLUSH_SIZE': 100, 'FLUSH_INTERVAL': 60})
+    def test_batch_view_enqueues(self):
+        product = Product.objects.create(title='Продукт', owner=self.student)
+        product.lessons.add(self.lesson)
+        product.users_with_access.add(self.student)
+        client = APIClient()
+        client.force_authenticate(self.student)
+
+        response = client.post(
+            reverse('progress-batch'), [{'lesson_id': self.lesson.pk, 'viewed_duration': 90}], format='json',
+        )
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['accepted'], 1)
+        self.assertFalse(UserLessonView.objects.exists())
+        shutdown_progress_buffer()
+        self.assertTrue(UserLessonView.objects.get().is_viewed)
+
+
+class MergeDuplicateViewsCommandTests(TransactionTestCase):
+    """
+    Тесты команды merge_duplicate_views на базе до миграции 0004: повторы еще допустимы,
+    а таблицы прогресса пользователей по продуктам (0006) еще нет.
+    """
+
+    def setUp(self):
+        cache.clear()
+        MigrationExecutor(connection).migrate([('HQapp', '0003_productstats')])
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_merges_duplicates_before_progress_table_exists(self):
+        self.assertNotIn(UserProductProgress._meta.db_table, connection.introspection.table_names())
+        student = User.objects.create_user('student', password='password')
+        product = Product.objects.create(title='Продукт', owner=student)
+        lesson = Lesson.objects.create(title='Урок', video_link='https://example.com', duration=100)
+        Product.lessons.through.objects.create(product=product, lesson=lesson)
+        UserLessonView.objects.bulk_create([
+            UserLessonView(user=student, lesson=lesson, viewed_duration=viewed_duration)
+            for viewed_duration in (30, 90, 60)
+        ])
+
+        out = StringIO()
+        call_command('merge_duplicate_views', '--dry-run', stdout=out)
+        self.assertIn('Would remove 2 duplicate rows in 1 (user, lesson) groups', out.getvalue())
+        self.assertEqual(UserLessonView.objects.count(), 3)
+
+        out = StringIO()
+        call_command('merge_duplicate_views', stdout=out)
+        self.assertIn('Removed 2 duplicate rows in 1 (user, lesson) groups', out.getvalue())
+        view = UserLessonView.objects.get()
+        self.assertEqual(view.viewed_duration, 90)
+        self.assertTrue(view.is_viewed)
+        stats = Product.objects.get(pk=product.pk).stats
+        self.assertEqual(stats.total_viewed_time, 90)
+        self.assertEqual(stats.watched_lessons_count, 1)
+
+
+class QueryPlanTests(TestCase):
+    """
+    Тесты планов запросов эндпоинтов /api/: таблицы просмотров и промежуточные таблицы
+    должны читаться только по индексам, без полного просмотра.
+    """
+    indexed_tables = ('HQapp_userlessonview', 'HQapp_product_lessons', 'HQapp_product_users_with_access')
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner', password='password')
+        self.student = User.objects.create_user('student', password='password')
+        self.product = Product.objects.create(title='Продукт', owner=self.owner)
+        self.product.users_with_access.add(self.student)
+        lessons = Lesson.objects.bulk_create([
+            Lesson(title=f'Урок {i}', video_link='https://example.com', duration=100) for i in range(3)
+        ])
+        self.product.lessons.add(*lessons)
+        UserLessonView.objects.create(user=self.student, lesson=lessons[0], viewed_duration=90)
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+
+    def capture_plans(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        plans = []
+        with connection.cursor() as cursor:
+            for query in context.captured_queries:
+                if query['sql'].startswith('SELECT'):
+                    cursor.execute(f"EXPLAIN QUERY PLAN {query['sql']}")
+                    plans.append((query['sql'], [row[-1] for row in cursor.fetchall()]))
+        return plans
+
+    def assertIndexedPlans(self, plans):
+        for sql, steps in plans:
+            for step in steps:
+                for table in self.indexed_tables:
+                    self.assertFalse(
+                        step.startswith(f'SCAN {table}') and 'INDEX' not in step,
+                        f'Полный просмотр {table}: {step}\n{sql}',
+                    )
+
+    def test_endpoint_plans_use_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Планы запросов проверяются для SQLite')
+
+        for url in (
+            reverse('accessible-lessons-list'),
+            reverse('accessible-products-list'),
+            reverse('lessons-by-product', args=[self.product.pk]),
+            reverse('product-statistics'),
+        ):
+            with self.subTest(url=url):
+                self.assertIndexedPlans(self.capture_plans(url))
+
+    def test_statistics_use_lesson_viewed_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Планы запросов проверяются для SQLite')
+
+        plan = Product.objects.with_statistics().explain()
+        self.assertIn('userlessonview_lesson_viewed', plan)
+
+
+class AccessibleProductsListViewTests(TestCase):
+    """
+    Тесты облегченного списка доступных продуктов.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner', password='password')
+        self.student = User.objects.create_user('student', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+        self.add_products(1)
+
+    def add_products(self, count, students=5):
+        users = User.objects.bulk_create([
+            User(username=f'user{User.objects.count()}_{i}') for i in range(students)
+        ])
+        for _ in range(count):
+            product = Product.objects.create(title='Продукт', owner=self.owner)
+            product.users_with_access.add(self.student, *users)
+            product.lessons.add(*Lesson.objects.bulk_create([
+                Lesson(title=f'Урок {i}', video_link='https://example.com', duration=100) for i in range(3)
+            ]))
+
+    def get_products(self, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('accessible-products-list'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results'], len(context.captured_queries)
+
+    def test_lean_representation(self):
+        products, _ = self.get_products()
+
+        product = products[0]
+        self.assertEqual(set(product), {'id', 'title', 'owner', 'students_count', 'lessons'})
+        self.assertEqual(product['students_count'], 6)
+        self.assertEqual(len(product['lessons']), 3)
+        self.assertTrue(all(isinstance(lesson, int) for lesson in product['lessons']))
+
+    def test_expand_lessons(self):
+        products, _ = self.get_products(expand='lessons')
+
+        self.assertEqual(set(products[0]['lessons'][0]), {'id', 'title', 'video_link', 'duration'})
+
+    def test_query_count_and_size_do_not_grow(self):
+        for params in ({}, {'expand': 'lessons'}):
+            with self.subTest(params=params):
+                cache.clear()
+                products, queries = self.get_products(**params)
+                size = len(str(products[0]))
+
+                self.add_products(3, students=50)
+                cache.clear()
+                products, more_queries = self.get_products(**params)
+
+                self.assertEqual(more_queries, queries)
+                # Размер продукта не зависит от количества студентов, отличаются лишь разряды идентификаторов
+                self.assertAlmostEqual(len(str(products[-1])), size, delta=10)
+
+
+class PaginationAndStreamingTests(TestCase):
+    """
+    Тесты курсорной пагинации и потокового режима списков уроков и продуктов.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner', password='password')
+        self.student = User.objects.create_user('student', password='password')
+        for index in range(3):
+            product = Product.objects.create(title=f'Продукт {index}', owner=self.owner)
+            product.users_with_access.add(self.student)
+            product.lessons.add(*Lesson.objects.bulk_create([
+                Lesson(title=f'Урок {index}.{i}', video_link='https://example.com', duration=100) for i in range(2)
+            ]))
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+
+    def collect_pages(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 4)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_cursor_pagination_walks_all_items(self):
+        lesson_ids = self.collect_pages(reverse('accessible-lessons-list') + '?page_size=4')
+        self.assertEqual(lesson_ids, sorted(Lesson.objects.values_list('pk', flat=True)))
+
+        product_ids = self.collect_pages(reverse('accessible-products-list') + '?page_size=2')
+        self.assertEqual(product_ids, sorted(Product.objects.values_list('pk', flat=True)))
+
+    def test_streaming_matches_full_list(self):
+        for name in ('accessible-lessons-list', 'accessible-products-list'):
+            with self.subTest(name=name):
+                url = reverse(name)
+                response = self.client.get(url, {'stream': 1})
+
+                self.assertTrue(response.streaming)
+                streamed = json.loads(b''.join(response.streaming_content))
+                paginated = self.client.get(url, {'page_size': 100}).json()['results']
+                self.assertEqual(streamed, paginated)
+
+
+class AccessibleLessonsListViewTests(TestCase):
+    """
+    Тесты списка доступных уроков.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner', password='password')
+        self.student = User.objects.create_user('student', password='password')
+        self.products = [Product.objects.create(title=f'Продукт {i}', owner=self.owner) for i in range(2)]
+        self.student.accessible_products.add(self.products[0])
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+
+    def add_lessons(self, count):
+        lessons = Lesson.objects.bulk_create([
+            Lesson(title=f'Урок {i}', video_link='https://example.com', duration=100) for i in range(count)
+        ])
+        for product in self.products:
+            product.lessons.add(*lessons)
+        return lessons
+
+    def get_lessons(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('accessible-lessons-list'))
+        self.assertEqual(response.status_code, 200)
+        return response.data['results'], context.captured_queries
+
+    def test_lessons_in_several_products_are_listed_once(self):
+        lessons = self.add_lessons(2)
+        Lesson.objects.create(title='Недоступный урок', video_link='https://example.com', duration=100)
+
+        results, _ = self.get_lessons()
+
+        self.assertEqual([lesson['id'] for lesson in results], [lesson.pk for lesson in lessons])
+        self.assertEqual(
+            [product['id'] for product in results[0]['included_in_products']],
+            [product.pk for product in self.products],
+        )
+
+    def test_query_count_does_not_grow_without_distinct(self):
+        self.add_lessons(2)
+        _, queries = self.get_lessons()
+
+        self.add_lessons(20)
+        _, more_queries = self.get_lessons()
+
+        self.assertEqual(len(more_queries), len(queries))
+        self.assertFalse(any('DISTINCT' in query['sql'] for query in more_queries))
+
+
+class ResponseCacheTests(TestCase):
+    """
+    Тесты кэширования ответов с инвалидацией по версиям и ETag.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner', password='password')
+        self.student = User.objects.create_user('student', password='password')
+        self.product = Product.objects.create(title='Продукт', owner=self.owner)
+        self.product.users_with_access.add(self.student)
+        self.lesson = Lesson.objects.create(title='Урок', video_link='https://example.com', duration=100)
+        self.product.lessons.add(self.lesson)
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+        self.urls = [reverse('lessons-by-product', args=[self.product.pk]), reverse('accessible-lessons-list')]
+
+    def test_repeated_get_is_served_from_cache(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                first = self.client.get(url)
+                with self.assertNumQueries(0):
+                    second = self.client.get(url)
+                self.assertEqual(second.data, first.data)
+                self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_if_none_match_returns_304_without_queries(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                with self.assertNumQueries(0):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+
+    def test_progress_change_invalidates_lessons_by_product(self):
+        url = self.urls[0]
+        etag = self.client.get(url)['ETag']
+
+        self.client.post(reverse('progress-batch'), [{'lesson_id': self.lesson.pk, 'viewed_duration': 90}], format='json')
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['lessons'][0]['is_viewed'])
+
+    def test_catalog_and_access_changes_invalidate(self):
+        url = self.urls[1]
+        self.client.get(url)
+
+        new_lesson = Lesson.objects.create(title='Новый урок', video_link='https://example.com', duration=100)
+        self.product.lessons.add(new_lesson)
+        self.assertEqual(len(self.client.get(url).data['results']), 2)
+
+        new_lesson.title = 'Переименованный урок'
+        new_lesson.save()
+        self.assertEqual(self.client.get(url).data['results'][1]['title'], 'Переименованный урок')
+
+        self.product.users_with_access.remove(self.student)
+        self.assertEqual(self.client.get(url).data['results'], [])
+        self.assertEqual(self.client.get(self.urls[0]).status_code, 404)
+
+    def test_process_local_cache_warning(self):
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://'}}
+        self.assertEqual([warning.id for warning in check_shared_cache(None)], ['HQapp.W001'])
+        with override_settings(CACHES=redis):
+            self.assertEqual(check_shared_cache(None), [])
+        self.assertEqual([warning.id for warning in run_checks(include_deployment_checks=True)
+                          if warning.id == 'HQapp.W001'], ['HQapp.W001'])
+        self.assertNotIn('HQapp.W001', [warning.id for warning in run_checks()])
+
+
+class CreateTestDataCommandTests(TestCase):
+    """
+    Тесты команды генерации тестовых данных.
+    """
+
+    def create(self, **options):
+        call_command(
+            'create_test_data', users=25, products=4, lessons_per_product=3, access_ratio=0.5,
+            chunk_size=10, batch_size=7, seed=7, stdout=StringIO(), **options,
+        )
+        return sorted(UserLessonView.objects.values_list('user__username', 'lesson__duration', 'viewed_duration'))
+
+    def test_generates_requested_dataset(self):
+        self.create()
+
+        self.assertEqual(User.objects.count(), 25)
+        self.assertEqual(Product.objects.count(), 4)
+        self.assertEqual(Lesson.objects.count(), 12)
+        self.assertEqual(Product.users_with_access.through.objects.count(), 25 * 2)
+        self.assertEqual(UserLessonView.objects.count(), 25 * 2 * 3)
+        self.assertEqual(verify_product_stats(), [])
+        self.assertEqual(verify_user_progress(), [])
+
+    def test_seed_makes_dataset_reproducible(self):
+        self.assertEqual(self.create(), self.create())
+
+    def test_clear_query_count_does_not_grow_with_rows(self):
+        admin = User.objects.create_superuser('admin', password='password')
+        counts = []
+        for users in (5, 20):
+            call_command(
+                'create_test_data', users=users, products=2, lessons_per_product=2, seed=7, stdout=StringIO(),
+            )
+            revoke_tokens(User.objects.exclude(pk=admin.pk).first())
+            view = UserLessonView.objects.first()
+            LessonViewEvent.objects.create(user_id=view.user_id, lesson_id=view.lesson_id, watched_seconds=10)
+            with CaptureQueriesContext(connection) as queries:
+                create_test_data.Command(stdout=StringIO()).clear(batch_size=1000)
+            counts.append(len(queries.captured_queries))
+
+            self.assertEqual(list(User.objects.values_list('pk', flat=True)), [admin.pk])
+            for model in (Product, Lesson, UserLessonView, LessonViewEvent, UserTokenVersion, UserProductProgress):
+                self.assertFalse(model.objects.exists())
+        self.assertEqual(counts[0], counts[1])
+        self.assertTrue(pre_delete.has_listeners(User) and post_delete.has_listeners(User))
+
+    def test_resets_primary_key_sequences(self):
+        ops = connections['default'].ops
+        with mock.patch.object(ops, 'sequence_reset_sql', wraps=ops.sequence_reset_sql) as sequence_reset_sql:
+            self.create()
+
+        self.assertIn(User, sequence_reset_sql.call_args.args[1])
+        # Пользователь без явного идентификатора не конфликтует с созданными командой
+        user = User.objects.create_user('late', password='password')
+        self.assertEqual(user.pk, User.objects.order_by('pk').last().pk)
+
+
+class BenchmarkTests(TestCase):
+    """
+    Тесты измерения производительности эндпоинтов.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('student', password='password')
+        self.product = Product.objects.create(title='Продукт', owner=self.user)
+        self.product.users_with_access.add(self.user)
+        self.product.lessons.add(
+            Lesson.objects.create(title='Урок', video_link='https://example.com', duration=100)
+        )
+        self.client.force_login(self.user)
+
+    def test_measures_every_endpoint(self):
+        for name, url in benchmark_endpoints(self.product).items():
+            with self.subTest(name):
+                metrics = measure_endpoint(self.client, url, requests=3)
+                self.assertGreater(metrics['queries'], 0)
+                self.assertGreater(metrics['bytes'], 0)
+                self.assertLessEqual(metrics['p50_ms'], metrics['p95_ms'])
+
+    def test_compare_with_baseline(self):
+        baseline = {'lessons': {'p50_ms': 10, 'p95_ms': 20, 'queries': 3, 'sql_ms': 1, 'bytes': 1000}}
+
+        self.assertEqual(compare_with_baseline(baseline, baseline, tolerance=0.5), [])
+        # Небольшое абсолютное превышение не считается регрессией даже сверх допуска
+        noisy = {'lessons': dict(baseline['lessons'], sql_ms=2.5)}
+        self.assertEqual(compare_with_baseline(noisy, baseline, tolerance=0.5), [])
+
+        slower = {'lessons': dict(baseline['lessons'], p50_ms=40, queries=4)}
+        regressions = compare_with_baseline(slower, baseline, tolerance=0.5)
+        self.assertEqual(len(regressions), 2)
+        self.assertIn('queries 4 > baseline 3', regressions[0])
+
+    def test_accessible_lessons_benchmark_reports_cold_and_warm_cache(self):
+        out = StringIO()
+        call_command('benchmark_accessible_lessons', '--sizes', '5', '--products', '2', '--repeat', '2', stdout=out)
+
+        rows = {tuple(line.split()[1:3]): int(line.split()[3]) for line in out.getvalue().splitlines()[1:]}
+        self.assertEqual(set(rows), {(name, state) for name in ('legacy', 'exists') for state in ('cold', 'warm')})
+        # Холодный запуск выполняет и запрос доступных продуктов, а не только выборку уроков
+        self.assertEqual(rows['exists', 'cold'], rows['exists', 'warm'] + 1)
+        self.assertEqual(rows['legacy', 'cold'], rows['legacy', 'warm'])
+
+
+class TemplateResponseMiddleware:
+    """
+    Промежуточный слой с process_template_response для проверки порядка MIDDLEWARE.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_template_response(self, request, response):
+        return response
+
+
+class RequestInstrumentationMiddlewareTests(TestCase):
+    """
+    Тесты промежуточного слоя, измеряющего SQL-запросы и время обработки запросов.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('student', password='password')
+        self.client.force_login(self.user)
+
+    def instrumentation(self, **overrides):
+        return override_settings(REQUEST_INSTRUMENTATION=dict(settings.REQUEST_INSTRUMENTATION, **overrides))
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            normalize_sql("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'x' LIMIT 21"),
+            'SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?',
+        )
+        self.assertEqual(normalize_sql('SELECT * FROM t WHERE id IN (%s)'), 'SELECT * FROM t WHERE id IN (...)')
+
+    def test_middleware_order_check(self):
+        self.assertEqual(check_instrumentation_order(None), [])
+        middleware = [f'{__name__}.TemplateResponseMiddleware', *settings.MIDDLEWARE]
+        with override_settings(MIDDLEWARE=middleware):
+            self.assertEqual([warning.id for warning in check_instrumentation_order(None)], ['HQapp.W002'])
+        with override_settings(MIDDLEWARE=[*settings.MIDDLEWARE, middleware[0]]):
+            self.assertEqual(check_instrumentation_order(None), [])
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('product-statistics'))
+
+        timing = response['Server-Timing']
+        for name in ('ser', 'render', 'db', 'app', 'total'):
+            self.assertIn(f'{name};dur=', timing)
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+
+    def test_serialization_is_timed_separately(self):
+        product = Product.objects.create(title='Продукт', owner=self.user)
+        product.users_with_access.add(self.user)
+        product.lessons.add(Lesson.objects.create(title='Урок', video_link='https://example.com', duration=100))
+
+        with mock.patch.object(LessonSerializer, 'to_representation', autospec=True,
+                               side_effect=lambda serializer, lesson: time.sleep(0.05) or {}):
+            response = self.client.get(reverse('accessible-lessons-list'))
+
+        timings = dict(re.findall(r'(\w+);dur=([\d.]+)', response['Server-Timing']))
+        self.assertGreaterEqual(float(timings['ser']), 50)
+        self.assertLess(float(timings['app']), 50)
+
+    def test_unsampled_request_skips_sql(self):
+        with self.instrumentation(SAMPLE_RATE=0):
+            response = self.client.get(reverse('product-statistics'))
+
+        self.assertNotIn('db;', response['Server-Timing'])
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+    def test_collector_groups_repeated_queries(self):
+        collector = QueryCollector()
+        with connection.execute_wrapper(collector):
+            # Чтение пользователей по одному — типичный N+1
+            for user in User.objects.all():
+                User.objects.get(pk=user.pk)
+            User.objects.get(pk=self.user.pk)
+
+        self.assertEqual(collector.count, 3)
+        self.assertEqual(collector.duplicates(threshold=2)[0]['count'], 2)
+        self.assertEqual(collector.duplicates(threshold=3), [])
+
+    def test_structured_log(self):
+        with self.assertLogs('HQapp.requests', 'INFO') as logs:
+            self.client.get(reverse('product-statistics'))
+
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['path'], reverse('product-statistics'))
+        self.assertEqual(record['status'], 200)
+        self.assertTrue(record['sampled'])
+        self.assertGreater(record['queries'], 0)
+        self.assertEqual(record['duplicate_queries'], 0)
+
+    def test_slow_requests_are_logged_with_sql(self):
+        with self.instrumentation(SLOW_QUERY_COUNT=1), self.assertLogs('HQapp.slow_requests') as logs:
+            self.client.get(reverse('product-statistics'))
+
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertGreaterEqual(record['queries'], 1)
+        self.assertTrue(all('%s' not in query['sql'] for query in record['sql']))
+
+    def test_fast_requests_are_not_logged_as_slow(self):
+        with self.assertNoLogs('HQapp.slow_requests'):
+            self.client.get(reverse('product-statistics'))
+
+
+class MetricsTests(TestCase):
+    """
+    Тесты метрик Prometheus.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.registry = MetricsRegistry()
+        self.requests = metrics.Counter('test_requests_total', 'Requests.', ['status'], registry=self.registry)
+        self.in_flight = metrics.Gauge('test_in_flight', 'In flight.', registry=self.registry)
+        self.latency = metrics.Histogram('test_latency_seconds', 'Latency.', buckets=(0.1, 1, math.inf),
+                                         registry=self.registry)
+
+    def test_merges_thread_values(self):
+        def work():
+            for _ in range(100):
+                self.requests.inc('200')
+            self.latency.observe(0.5)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.latency.observe(0.05)
+
+        text = self.registry.render()
+        self.assertIn('test_requests_total{status="200"} 400', text)
+        self.assertIn('test_latency_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('test_latency_seconds_bucket{le="1"} 5', text)
+        self.assertIn('test_latency_seconds_bucket{le="+Inf"} 5', text)
+        self.assertIn('test_latency_seconds_count 5', text)
+        self.assertIn('# TYPE test_in_flight gauge', text)
+
+    def test_finished_thread_stores_are_folded(self):
+        def work():
+            self.requests.inc('200')
+
+        for _ in range(20):
+            thread = threading.Thread(target=work)
+            thread.start()
+            thread.join()
+        gc.collect()
+
+        # Хранилища завершившихся потоков объединены в одно, значения сохранены
+        self.assertEqual(len(self.registry._stores), 0)
+        self.assertIn('test_requests_total{status="200"} 20', self.registry.render())
+
+    def test_finished_thread_gauges_are_dropped(self):
+        connections_open = metrics.Gauge('test_connections_open', 'Connections.', ['alias'], registry=self.registry)
+
+        def work():
+            connections_open.set(1, 'default')
+            self.in_flight.inc()
+
+        for _ in range(5):
+            thread = threading.Thread(target=work)
+            thread.start()
+            thread.join()
+        gc.collect()
+        connections_open.set(1, 'default')
+
+        text = self.registry.render()
+        self.assertIn('test_connections_open{alias="default"} 1\n', text)
+        self.assertNotIn('\ntest_in_flight ', text)
+
+    def test_concurrent_flushes(self):
+        self.requests.inc('200')
+        errors = []
+
+        def flush():
+            try:
+                for _ in range(50):
+                    self.registry.flush()
+            except Exception as error:
+                errors.append(error)
+
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(METRICS=dict(settings.METRICS, MULTIPROCESS_DIR=directory)):
+            threads = [threading.Thread(target=flush) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(os.listdir(directory), [f'{os.getpid()}.json'])
+        self.assertEqual(errors, [])
+
+    def test_flusher_survives_errors(self):
+        with self.assertLogs('HQapp.metrics', 'ERROR'), \
+                mock.patch.object(self.registry, 'flush', side_effect=OSError('No space left on device')) as flush, \
+                mock.patch('HQapp.metrics.atexit.register'), tempfile.TemporaryDirectory() as directory, \
+                override_settings(METRICS=dict(settings.METRICS, MULTIPROCESS_DIR=directory, FLUSH_INTERVAL=0.01)):
+            self.requests.inc('200')  # Первая запись запускает фоновое сохранение
+            deadline = time.monotonic() + 5
+            while flush.call_count < 3 and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertGreaterEqual(flush.call_count, 3)
+
+    def test_aggregates_processes_through_directory(self):
+        self.requests.inc('200', amount=2)
+        self.in_flight.inc()
+        finished = subprocess.Popen(['true'])
+        finished.wait()
+
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, f'{finished.pid}.json'), 'w') as file:
+                json.dump({'pid': finished.pid, 'samples': [
+                    ['test_requests_total', ['200'], 3],
+                    ['test_in_flight', [], 5],
+                ]}, file)
+            with override_settings(METRICS=dict(settings.METRICS, MULTIPROCESS_DIR=directory)):
+                text = self.registry.render()
+                self.assertTrue(os.path.exists(os.path.join(directory, f'{os.getpid()}.json')))
+
+        self.assertIn('test_requests_total{status="200"} 5', text)
+        # Датчики завершившегося процесса не учитываются
+        self.assertIn('test_in_flight 1', text)
+
+    def test_endpoint(self):
+        user = User.objects.create_user('student', password='password')
+        self.client.force_login(user)
+        self.client.get(reverse('product-statistics'))
+
+        response = self.client.get(reverse('metrics'))
+
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        text = response.content.decode()
+        self.assertIn('hqapp_http_requests_total{view="product-statistics",method="GET",status="200"}', text)
+        self.assertIn('hqapp_db_queries_per_request_bucket{view="product-statistics"', text)
+        self.assertIn('hqapp_http_requests_in_flight 1', text)
+
+    def test_recording_is_cheap(self):
+        started = time.perf_counter()
+        for _ in range(10000):
+            self.requests.inc('200')
+            self.latency.observe(0.01)
+        # Запись метрик запроса должна занимать единицы микросекунд
+        self.assertLess((time.perf_counter() - started) / 10000, 50e-6)
+
+
+class AsyncViewsTests(TestCase):
+    """
+    Тесты асинхронных версий эндпоинтов чтения.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner', password='password')
+        self.student = User.objects.create_user('student', password='password')
+        self.product = Product.objects.create(title='Продукт', owner=self.owner)
+        self.product.users_with_access.add(self.student)
+        self.lessons = [
+            Lesson.objects.create(title=f'Урок {i}', video_link='https://example.com', duration=100)
+            for i in range(3)
+        ]
+        self.product.lessons.add(*self.lessons)
+        UserLessonView.objects.create(user=self.student, lesson=self.lessons[0], viewed_duration=90)
+        self.client.force_login(self.student)
+        self.async_client.force_login(self.student)
+
+    async def test_responses_match_sync_views(self):
+        for name, args in (
+            ('accessible-lessons-list', []),
+            ('accessible-products-list', []),
+            ('lessons-by-product', [self.product.pk]),
+            ('product-statistics', []),
+        ):
+            with self.subTest(name):
+                expected = (await sync_to_async(self.client.get)(reverse(name, args=args))).json()
+                response = await self.async_client.get(reverse(f'async-{name}', args=args))
+
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), expected)
+
+    async def test_pagination(self):
+        url = reverse('async-accessible-lessons-list')
+
+        first = (await self.async_client.get(url, {'page_size': 2})).json()
+        second = (await self.async_client.get(first['next'])).json()
+        previous = (await self.async_client.get(second['previous'])).json()
+
+        self.assertEqual([lesson['id'] for lesson in first['results'] + second['results']],
+                         [lesson.pk for lesson in self.lessons])
+        self.assertIsNone(second['next'])
+        self.assertEqual(previous['results'], first['results'])
+        # Курсоры совпадают с курсорами синхронной версии
+        expected = (await sync_to_async(self.client.get)(reverse('accessible-lessons-list'), {'page_size': 2})).json()
+        self.assertEqual(first['next'].split('?')[1], expected['next'].split('?')[1])
+
+    async def test_invalid_parameters(self):
+        for params in ({'cursor': 'invalid'}, {'page_size': 'many'}, {'page_size': 0}):
+            with self.subTest(params):
+                response = await self.async_client.get(reverse('async-accessible-lessons-list'), params)
+                expected = await sync_to_async(self.client.get)(reverse('accessible-lessons-list'), params)
+
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), expected.json())
+
+    async def test_requires_authentication(self):
+        await sync_to_async(self.async_client.logout)()
+
+        response = await self.async_client.get(reverse('async-product-statistics'))
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer')
+
+    async def test_token_authentication(self):
+        await sync_to_async(self.async_client.logout)()
+        token = await sync_to_async(create_token)(self.student)
+
+        response = await self.async_client.get(
+            reverse('async-accessible-lessons-list'), headers={'Authorization': f'Bearer {token}'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 3)
+
+        response = await self.async_client.get(
+            reverse('async-accessible-lessons-list'), headers={'Authorization': 'Bearer invalid'},
+        )
+        self.assertEqual(response.status_code, 401)
+
+    async def test_product_without_access(self):
+        other = await Product.objects.acreate(title='Чужой продукт', owner=self.owner)
+
+        response = await self.async_client.get(reverse('async-lessons-by-product', args=[other.pk]))
+
+        self.assertEqual(response.status_code, 404)
+
+
+class PrimaryReplicaRouterTests(TestCase):
+    """
+    Тесты маршрутизации чтений между основной базой и репликами.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('student', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def replica_choices(self, url, method='get', **kwargs):
+        """
+        Выполняет запрос, считая выборы реплики маршрутизатором. Роль реплики играет основная база.
+        """
+        with override_settings(DATABASE_REPLICAS=['default']), \
+                mock.patch('HQapp.routers.random.choice', side_effect=lambda aliases: aliases[0]) as choice:
+            response = getattr(self.client, method)(url, **kwargs)
+        self.assertLess(response.status_code, 300)
+        return choice.call_count
+
+    def test_router(self):
+        router = PrimaryReplicaRouter()
+        with override_settings(DATABASE_REPLICAS=['replica1', 'replica2']):
+            self.assertEqual(router.db_for_read(Lesson), 'default')
+            token = _read_from_replica.set(True)
+            try:
+                self.assertIn(router.db_for_read(Lesson), ['replica1', 'replica2'])
+                self.assertEqual(router.db_for_write(Lesson), 'default')
+            finally:
+                _read_from_replica.reset(token)
+        self.assertFalse(router.allow_migrate('replica1', 'HQapp'))
+
+    @override_settings(REPLICA_PIN_SECONDS=0)
+    def test_read_only_views_use_replicas(self):
+        for name in ('accessible-lessons-list', 'accessible-products-list', 'product-statistics'):
+            with self.subTest(name):
+                self.assertGreater(self.replica_choices(reverse(name)), 0)
+        self.assertEqual(self.replica_choices(reverse('progress-batch'), 'post', data=[], format='json'), 0)
+
+    def test_reads_stick_to_primary_after_progress_update(self):
+        lesson = Lesson.objects.create(title='Урок', video_link='https://example.com', duration=100)
+        product = Product.objects.create(title='Продукт', owner=self.user)
+        product.lessons.add(lesson)
+        product.users_with_access.add(self.user)
+        self.client.post(reverse('progress-batch'), [{'lesson_id': lesson.pk, 'viewed_duration': 50}], format='json')
+
+        self.assertEqual(self.replica_choices(reverse('accessible-lessons-list')), 0)
+
+        # После задержки репликации чтения снова выполняются на реплике (кэш очищается, чтобы ответ
+        # не был взят из кэша ответов)
+        cache.clear()
+        with override_settings(REPLICA_PIN_SECONDS=0):
+            self.assertGreater(self.replica_choices(reverse('accessible-lessons-list')), 0)
+
+
+@skipUnless(settings.DATABASE_REPLICAS, 'реплики не настроены (DB_REPLICAS)')
+@override_settings(REPLICA_PIN_SECONDS=0)
+class ReplicaDatabaseTests(TransactionTestCase):
+    """
+    Тесты чтения с настоящих реплик: DB_REPLICAS=replica1.sqlite3,replica2.sqlite3 python manage.py test.
+    """
+    databases = '__all__'
+
+    def test_read_only_views_query_replicas(self):
+        user = User.objects.create_user('student', password='password')
+        product = Product.objects.create(title='Продукт', owner=user)
+        product.users_with_access.add(user)
+        product.lessons.add(Lesson.objects.create(title='Урок', video_link='https://example.com', duration=100))
+        client = APIClient()
+        client.force_authenticate(user)
+
+        contexts = [CaptureQueriesContext(connections[alias]) for alias in settings.DATABASE_REPLICAS]
+        with ExitStack() as stack:
+            for context in contexts:
+                stack.enter_context(context)
+            response = client.get(reverse('accessible-lessons-list'))
+
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertGreater(sum(len(context.captured_queries) for context in contexts), 0)
+
+    def test_streamed_list_reads_replica(self):
+        user = User.objects.create_user('student', password='password')
+        product = Product.objects.create(title='Продукт', owner=user)
+        product.users_with_access.add(user)
+        product.lessons.add(Lesson.objects.create(title='Урок', video_link='https://example.com', duration=100))
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get(reverse('accessible-lessons-list'), {'stream': '1'})
+
+        # Выборка выполняется при чтении потокового ответа, после выхода из представления
+        contexts = {alias: CaptureQueriesContext(connections[alias]) for alias in settings.DATABASES}
+        with ExitStack() as stack:
+            for context in contexts.values():
+                stack.enter_context(context)
+            lessons = json.loads(b''.join(response.streaming_content))
+
+        self.assertEqual(len(lessons), 1)
+        self.assertEqual([query['sql'] for query in contexts['default'].captured_queries], [])
+        self.assertGreater(sum(len(contexts[alias].captured_queries) for alias in settings.DATABASE_REPLICAS), 0)
+
+
+@override_settings(SQLITE_PERFORMANCE=dict(settings.SQLITE_PERFORMANCE, ENABLED=True))
+class SQLitePerformanceTests(TransactionTestCase):
+    """
+    Тесты режима производительности SQLite.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.students = [User.objects.create(username=f'student{i}') for i in range(8)]
+        self.lesson = Lesson.objects.create(title='Урок', video_link='https://example.com', duration=100)
+
+    def tearDown(self):
+        shutdown_progress_buffer()
+
+    def test_pragmas_on_new_connection(self):
+        with tempfile.TemporaryDirectory() as directory:
+            wrapper = connections.create_connection('default')
+            wrapper.settings_dict = dict(wrapper.settings_dict, NAME=os.path.join(directory, 'db.sqlite3'))
+            try:
+                with wrapper.cursor() as cursor:
+                    values = {}
+                    for name in ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size'):
+                        cursor.execute(f'PRAGMA {name}')
+                        values[name] = cursor.fetchone()[0]
+            finally:
+                wrapper.close()
+
+        self.assertEqual(values, {
+            'journal_mode': 'wal',
+            'synchronous': 1,  # NORMAL
+            'busy_timeout': settings.SQLITE_PERFORMANCE['BUSY_TIMEOUT_MS'],
+            'cache_size': -settings.SQLITE_PERFORMANCE['CACHE_SIZE_KB'],
+        })
+
+    def test_serialized_writer_runs_writes_from_threads(self):
+        writer = SerializedWriter()
+        results = []
+
+        def write(student):
+            results.append(writer.submit(record_progress, {(student.pk, self.lesson.pk): 90}))
+            connection.close()
+
+        threads = [threading.Thread(target=write, args=[student]) for student in self.students]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with self.assertRaises(ZeroDivisionError):
+            writer.submit(lambda: 1 / 0)
+        writer.stop()
+
+        self.assertEqual(results, [{'written': 1, 'skipped': 0}] * len(self.students))
+        self.assertEqual(writer.counters(), {'completed': len(self.students), 'failed': 1, 'queued': 0})
+        self.assertEqual(UserLessonView.objects.filter(is_viewed=True).count(), len(self.students))
+        self.assertEqual(verify_product_stats(), [])
+
+    def test_batch_view_writes_through_single_writer(self):
+        product = Product.objects.create(title='Продукт', owner=self.students[0])
+        product.lessons.add(self.lesson)
+        product.users_with_access.add(self.students[0])
+        client = APIClient()
+        client.force_authenticate(self.students[0])
+
+        response = client.post(
+            reverse('progress-batch'), [{'lesson_id': self.lesson.pk, 'viewed_duration': 90}], format='json',
+        )
+
+        self.assertEqual(response.data['written'], 1)
+        self.assertEqual(get_progress_writer().counters()['completed'], 1)
@@ -0,0 +1,195 @@
+"""
+Аутентификация API подписанными токенами без хранения сессий.
+
+Токен содержит идентификатор пользователя, версию его токенов и отпечаток хеша пароля и подписан HMAC с SECRET_KEY
+(django.core.signing) вместе со временем выдачи, поэтому проверка подписи и срока действия
+(TOKEN_AUTH['MAX_AGE']) не требует запросов к базе данных. Пользователь и текущая версия его токенов
+загружаются одним запросом и кэшируются в памяти процесса (LRU не больше USER_CACHE_SIZE записей,
+каждая не дольше USER_CACHE_TTL секунд).
+
+Увеличение версии (revoke_tokens) и смена пароля отзывают все выданные пользователю токены: в текущем
+процессе сразу, в остальных — не позже чем через USER_CACHE_TTL секунд, как и блокировка пользователя.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.crypto import constant_time_compare, salted_hmac
+from rest_framework import authentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from .models import UserTokenVersion
+
+TOKEN_SALT = 'HQapp.tokens'
+
+
+class UserCache:
+    """
+    Потокобезопасный LRU-кэш пользователей с временем жизни записей.
+
+    Размер и время жизни читаются из настройки TOKEN_AUTH при каждом обращении.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()  # {user_id: (время истечения, пользователь, версия токенов)}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """
+            Возвращает (пользователь, версия токенов) или None, если записи нет или она устарела.
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1], entry[2]
+
+    def set(self, user_id, user, version):
+        config = settings.TOKEN_AUTH
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + config['USER_CACHE_TTL'], user, version)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > config['USER_CACHE_SIZE']:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+USER_CACHE = UserCache()
+
+
+def get_token_version(user_id):
+    return UserTokenVersion.objects.filter(pk=user_id).values_list('version', flat=True).first() or 0
+
+
+def password_fingerprint(user):
+    """
+        Отпечаток хеша пароля пользователя: меняется при смене пароля и не раскрывает сам хеш.
+    """
+    return salted_hmac(TOKEN_SALT, user.password, algorithm='sha256').hexdigest()[:16]
+
+
+def create_token(user):
+    """
+        Выдает пользователю подписанный токен текущей версии.
+
+        Args:
+        user (User): Пользователь.
+
+        Returns:
+        str: Токен.
+    """
+    return signing.dumps([user.pk, get_token_version(user.pk), password_fingerprint(user)], salt=TOKEN_SALT)
+
+
+def revoke_tokens(user):
+    """
+        Отзывает все выданные пользователю токены, увеличивая версию его токенов.
+
+        Args:
+        user (User): Пользователь.
+    """
+    with transaction.atomic():
+        _, created = UserTokenVersion.objects.get_or_create(pk=user.pk, defaults={'version': 1})
+        if not created:
+            UserTokenVersion.objects.filter(pk=user.pk).update(version=F('version') + 1)
+    # Запись, загруженная параллельным запросом до фиксации транзакции, удаляется еще раз после фиксации
+    USER_CACHE.invalidate(user.pk)
+    transaction.on_commit(lambda: USER_CACHE.invalidate(user.pk))
+
+
+def load_user(user_id):
+    """
+        Возвращает активного пользователя и текущую версию его токенов из кэша или одним запросом.
+
+        Returns:
+        tuple: (пользователь или None, версия токенов).
+    """
+    cached = USER_CACHE.get(user_id)
+    if cached is None:
+        user = User.objects.filter(pk=user_id, is_active=True).annotate(
+            current_token_version=Coalesce('token_version__version', 0),
+        ).first()
+        if user is None:
+            return None, 0
+        cached = user, user.current_token_version
+        USER_CACHE.set(user_id, *cached)
+    user, version = cached
+    # Каждый запрос получает свою копию, чтобы изменения экземпляра не переходили между запросами
+    return copy.copy(user), version
+
+
+def authenticate_token(token):
+    """
+        Проверяет подпись, срок действия, версию токена и отпечаток пароля.
+
+        Returns:
+        User: Пользователь токена.
+
+        Raises:
+        AuthenticationFailed: Токен недействителен, истек или отозван (в том числе сменой пароля),
+                              либо пользователь неактивен.
+    """
+    try:
+        user_id, version, fingerprint = signing.loads(token, salt=TOKEN_SALT, max_age=settings.TOKEN_AUTH['MAX_AGE'])
+    except signing.SignatureExpired:
+        raise AuthenticationFailed('Срок действия токена истек.')
+    except (signing.BadSignature, TypeError, ValueError):
+        raise AuthenticationFailed('Недействительный токен.')
+
+    user, current_version = load_user(user_id)
+    if user is None:
+        raise AuthenticationFailed('Пользователь неактивен или удален.')
+    if version != current_version or not constant_time_compare(str(fingerprint), password_fingerprint(user)):
+        raise AuthenticationFailed('Токен отозван.')
+    return user
+
+
+class SignedTokenAuthentication(authentication.BaseAuthentication):
+    """
+    Аутентификация DRF по заголовку "Authorization: Bearer <токен>" без запросов к таблице сессий.
+    """
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        header = authentication.get_authorization_header(request).split()
+        if not header or header[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(header) != 2:
+            raise AuthenticationFailed('Заголовок Authorization должен содержать один токен.')
+        try:
+            token = header[1].decode()
+        except UnicodeError:
+            raise AuthenticationFailed('Недействительный токен.')
+        return authenticate_token(token), token
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """
+    Удаляет пользователя из кэша процесса при изменении, например при блокировке (is_active=False).
+    """
+    USER_CACHE.invalidate(instance.pk)
@@ -1,7 +1,10 @@
 from django.urls import path
 from rest_framework.routers import DefaultRouter
+from . import async_views
 from .views import ProductViewSet, LessonViewSet, UserLessonViewViewSet, AccessibleLessonsListView, \
-    LessonsByProductView, AccessibleProductsListView, ProductStatisticView
+    LessonsByProductView, AccessibleProductsListView, ProductStatisticView, ProgressBatchView, MyProgressView, \
+    BulkProductAccessView, ProductStatisticTimeseriesView, ProductStatisticExportView, ProductProgressExportView, \
+    TokenView
 
 """router = DefaultRouter()
 router.register(r'products', ProductViewSet)
@@ -13,5 +16,17 @@ urlpatterns = [
     path('accessible_products/', AccessibleProductsListView.as_view(), name='accessible-products-list'),
     path('products/<int:product_id>/lessons/', LessonsByProductView.as_view(), name='lessons-by-product'),
     path('product-statistics/', ProductStatisticView.as_view(), name='product-statistics'),
+    path('product-statistics/timeseries/', ProductStatisticTimeseriesView.as_view(),
+         name='product-statistics-timeseries'),
+    path('product-statistics/export.csv', ProductStatisticExportView.as_view(), name='product-statistics-export'),
+    path('products/<int:product_id>/export.csv', ProductProgressExportView.as_view(), name='product-progress-export'),
+    path('progress/batch/', ProgressBatchView.as_view(), name='progress-batch'),
+    path('my-progress/', MyProgressView.as_view(), name='my-progress'),
+    path('auth/token/', TokenView.as_view(), name='auth-token'),
+    path('products/<int:product_id>/access/bulk/', BulkProductAccessView.as_view(), name='product-access-bulk'),
+    path('async/accessible_lessons/', async_views.accessible_lessons, name='async-accessible-lessons-list'),
+    path('async/accessible_products/', async_views.accessible_products, name='async-accessible-products-list'),
+    path('async/products/<int:product_id>/lessons/', async_views.lessons_by_product, name='async-lessons-by-product'),
+    path('async/product-statistics/', async_views.product_statistic, name='async-product-statistics'),
 
 ]
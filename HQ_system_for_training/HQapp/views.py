@@ -1,17 +1,38 @@
+import datetime
+
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.models import User
-from django.db import models
-from django.http import Http404
-from django.views.generic import ListView
-from rest_framework import viewsets, permissions, generics
+from django.db.models import Exists, OuterRef, Prefetch, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views.decorators.http import require_safe
+from django.views.generic import ListView, TemplateView
+from rest_framework import viewsets, permissions, generics, status
 from rest_framework.generics import ListAPIView, get_object_or_404
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser, MultiPartParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import Product, Lesson, UserLessonView
-from .permissions import IsOwnerOrReadOnly
-from .serializers import ProductSerializer, LessonSerializer, UserLessonViewSerializer
+from . import metrics
+from .access import bulk_change_access, filter_accessible_progress, get_accessible_product_ids, has_product_access
+from .exports import progress_queryset, progress_rows, statistics_queryset, statistics_rows, stream_csv
+from .models import Product, Lesson, UserLessonView, UserProductProgress, LessonViewRollup
+from .pagination import StreamingListMixin
+from .parsers import UserIdsCSVParser, read_user_ids_from_file
+from .permissions import IsOwner, IsOwnerOrReadOnly
+from .progress import coalesce_heartbeats, get_progress_buffer, write_progress
+from .response_cache import CATALOG, product_scope, user_scope, versioned_response_cache
+from .routers import ReplicaReadMixin
+from .schema import load_schema
+from .serializers import ProductSerializer, LessonSerializer, UserLessonViewSerializer, ProgressHeartbeatSerializer, \
+    ProductListSerializer, UserProductProgressSerializer, TokenObtainSerializer
+from .stats import product_statistic
+from .tokens import create_token, revoke_tokens
 
 
 class ProductViewSet(viewsets.ModelViewSet):
@@ -62,28 +83,101 @@ class LessonViewSet(viewsets.ModelViewSet):
 
 
 class UserLessonViewViewSet(viewsets.ModelViewSet):
-    queryset = UserLessonView.objects.all()
+    # Урок загружается вместе с просмотром, поэтому при сохранении статус просмотра вычисляется без запроса урока
+    queryset = UserLessonView.objects.select_related('user', 'lesson')
     serializer_class = UserLessonViewSerializer
     permission_classes = [permissions.IsAuthenticated]
 
 
-class AccessibleLessonsListView(ListAPIView):
+def accessible_lessons_queryset(user, product_ids=None):
+    """
+    Возвращает уроки, входящие хотя бы в один продукт, доступный пользователю,
+    с предварительной выборкой продуктов, в которые входит каждый урок.
+
+    Args:
+    user (User): Пользователь.
+    product_ids (frozenset, optional): Уже полученные идентификаторы доступных продуктов.
+
+    Returns:
+    QuerySet: Доступные пользователю уроки.
+    """
+    if product_ids is None:
+        product_ids = get_accessible_product_ids(user)
+    in_accessible_product = Product.lessons.through.objects.filter(lesson_id=OuterRef('pk'), product_id__in=product_ids)
+    return Lesson.objects.filter(Exists(in_accessible_product)).prefetch_related(
+        Prefetch('included_in_products', queryset=Product.objects.only('id', 'title').order_by('pk'))
+    ).order_by('pk')
+
+
+class AccessibleLessonsListView(ReplicaReadMixin, StreamingListMixin, ListAPIView):
     """
     Получение списка уроков, доступных аутентифицированному пользователю.
 
     Предоставляет детализированный список уроков, к которым у текущего аутентифицированного пользователя есть доступ.
     Уроки выбираются на основе продуктов, к которым у пользователя есть доступ.
-    Используется оптимизированный запрос с предварительной выборкой для минимизации количества обращений к базе данных.
+    Уроки отбираются полусоединением EXISTS по промежуточной таблице без DISTINCT, а продукты уроков
+    загружаются одной предварительной выборкой, поэтому количество запросов не зависит от числа уроков.
+    Список разбивается на страницы курсорной пагинацией по id; параметр ?stream=1 включает потоковый ответ.
+    Ответы кэшируются до изменения доступов пользователя или каталога уроков и поддерживают ETag.
 
     """
     serializer_class = LessonSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_cache_scopes(self, request, *args, **kwargs):
+        return [user_scope(request.user.pk), CATALOG]
+
+    @versioned_response_cache
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
     def get_queryset(self):
-        user = self.request.user
-        accessible_products = user.accessible_products.prefetch_related('lessons').all()
-        accessible_lessons = Lesson.objects.filter(included_in_products__in=accessible_products).distinct()
-        return accessible_lessons
+        return accessible_lessons_queryset(self.request.user)
+
+
+def lessons_with_progress(product, lessons, user_lesson_views):
+    """
+    Формирует ответ со списком уроков продукта и прогрессом их просмотра пользователем.
+
+    Args:
+    product (Product): Продукт.
+    lessons (iterable): Уроки продукта.
+    user_lesson_views (dict): Просмотры уроков пользователем {lesson_id: UserLessonView}.
+
+    Returns:
+    dict: Название продукта и уроки с прогрессом просмотра.
+    """
+    lesson_data = []
+    # Формируем данные для каждого урока, подставляя значения по умолчанию для непросмотренных уроков
+    for lesson in lessons:
+        user_lesson_view = user_lesson_views.get(lesson.pk)
+        lesson_data.append({
+            'lesson_title': lesson.title,
+            'video_link': lesson.video_link,
+            'duration': lesson.duration,
+            'is_viewed': user_lesson_view.is_viewed if user_lesson_view else False,
+            'viewed_duration': user_lesson_view.viewed_duration if user_lesson_view else 0,
+            'last_viewed_date': user_lesson_view.last_viewed_date if user_lesson_view else None,
+        })
+
+    return {
+        'product_title': product.title,
+        'lessons': lesson_data,
+    }
+
+
+def product_statistics(products, total_users):
+    """
+    Формирует статистику по продуктам с предварительно загруженной статистикой (select_related('stats')).
+
+    Args:
+    products (iterable): Продукты.
+    total_users (int): Общее количество пользователей.
+
+    Returns:
+    list: Статистика каждого продукта.
+    """
+    return [product_statistic(product, total_users) for product in products]
 
 
 class LessonsByProductView(APIView):
@@ -91,8 +185,12 @@ class LessonsByProductView(APIView):
     Класс для представления уроков, включенных в продукт, доступный текущему пользователю.
     Отображает информацию о каждом уроке, такую как название урока, видео, продолжительность,
     статус просмотра, просмотренное время и последнюю дату просмотра.
+    Ответы кэшируются до изменения доступов или прогресса пользователя либо уроков продукта и поддерживают ETag.
     """
 
+    def get_cache_scopes(self, request, product_id, *args, **kwargs):
+        return [user_scope(request.user.pk), product_scope(product_id)]
+
     def get_object(self, product_id, user):
         """
         Получает продукт по идентификатору, проверяет, есть ли у пользователя доступ к продукту,
@@ -109,14 +207,14 @@ class LessonsByProductView(APIView):
         Raises:
         Http404: Если продукт не существует или у пользователя нет доступа.
         """
+        if not has_product_access(user, product_id):  # Проверка доступа запросом EXISTS или по кэшу доступов
+            raise Http404
         try:
-            product = Product.objects.get(pk=product_id)
-            if user not in product.users_with_access.all():
-                raise Http404
-            return product
+            return Product.objects.get(pk=product_id)
         except Product.DoesNotExist:
             raise Http404
 
+    @versioned_response_cache
     def get(self, request, product_id, format=None):
         """
         Отправляет GET-запрос для получения уроков, включенных в продукт,
@@ -132,90 +230,396 @@ class LessonsByProductView(APIView):
         """
         user = request.user  # Текущий пользователь
         product = self.get_object(product_id, user)  # Получаем продукт с проверкой доступа пользователя
-        lessons = Lesson.objects.filter(included_in_products=product)  # Получаем уроки, включенные в продукт
-
-        lesson_data = []
-        # Формируем данные для каждого урока
-        for lesson in lessons:
-            user_lesson_view, _ = UserLessonView.objects.get_or_create(user=user, lesson=lesson)
-            lesson_data.append({
-                'lesson_title': lesson.title,
-                'video_link': lesson.video_link,
-                'duration': lesson.duration,
-                'is_viewed': user_lesson_view.is_viewed,
-                'viewed_duration': user_lesson_view.viewed_duration,
-                'last_viewed_date': user_lesson_view.last_viewed_date,
-            })
+        lessons = Lesson.objects.filter(included_in_products=product).order_by('pk')  # Получаем уроки, включенные в продукт
 
-        # Формируем итоговый ответ
-        response_data = {
-            'product_title': product.title,
-            'lessons': lesson_data,
+        # Получаем все просмотры пользователем уроков продукта одним запросом, без создания недостающих записей
+        user_lesson_views = {
+            user_lesson_view.lesson_id: user_lesson_view
+            for user_lesson_view in UserLessonView.objects.filter(user=user, lesson__included_in_products=product)
         }
 
-        return Response(response_data)  # Отправляем ответ
+        return Response(lessons_with_progress(product, lessons, user_lesson_views))  # Отправляем ответ
+
+
+def accessible_products_queryset(product_ids, expand):
+    """
+    Возвращает продукты с владельцем, статистикой и предварительной выборкой уроков.
 
+    Args:
+    product_ids (frozenset): Идентификаторы доступных продуктов.
+    expand (set): Запрошенные расширяемые поля; при 'lessons' уроки загружаются полностью.
 
-class AccessibleProductsListView(generics.ListAPIView):
+    Returns:
+    QuerySet: Продукты, к которым у пользователя есть доступ.
+    """
+    # Для облегченного представления достаточно идентификаторов уроков
+    lessons = Lesson.objects.order_by('pk')
+    if 'lessons' not in expand:
+        lessons = lessons.only('pk')
+
+    return Product.objects.filter(pk__in=product_ids).select_related('owner', 'stats').prefetch_related(
+        Prefetch('lessons', queryset=lessons)
+    ).order_by('pk')
+
+
+class AccessibleProductsListView(ReplicaReadMixin, StreamingListMixin, generics.ListAPIView):
     """
     Класс для представления списка продуктов, доступных текущему пользователю в формате JSON.
+
+    По умолчанию продукты выводятся в облегченном виде: количество студентов и идентификаторы уроков.
+    Параметр запроса ?expand=lessons включает полную информацию об уроках.
+    Список разбивается на страницы курсорной пагинацией по id; параметр ?stream=1 включает потоковый ответ.
     """
-    serializer_class = ProductSerializer
+    serializer_class = ProductListSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_expand(self):
+        """
+        Возвращает множество запрошенных расширяемых полей из параметра запроса expand.
+        """
+        if getattr(self, 'swagger_fake_view', False):
+            return set()  # Генерация схемы OpenAPI без запроса
+        requested = self.request.query_params.get('expand', '').split(',')
+        return {name for name in requested if name in ProductListSerializer.expandable_fields}
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['expand'] = self.get_expand()
+        return context
+
     def get_queryset(self):
         """
         Определяет QuerySet продуктов, который будет использован для получения списка продуктов.
+        Предварительная выборка уроков зависит от того, запрошены ли уроки полностью.
 
         Returns:
         QuerySet: Список продуктов, доступных текущему пользователю.
         """
-        # Получаем текущего пользователя
-        current_user = self.request.user
+        # Получаем идентификаторы продуктов, доступных текущему пользователю
+        return accessible_products_queryset(get_accessible_product_ids(self.request.user), self.get_expand())
 
-        # Возвращаем продукты, к которым у пользователя есть доступ
-        return Product.objects.filter(users_with_access=current_user)
 
-
-class ProductStatisticView(APIView):
+class ProductStatisticView(ReplicaReadMixin, APIView):
     """
     Представление для отображения статистики по продуктам.
     Этот API предоставляет статистику по каждому продукту, такую как количество просмотренных уроков,
     общее время просмотра, количество студентов и процент приобретения продукта.
+    Статистика читается из предварительно вычисленной таблицы ProductStats.
     """
     permission_classes = [permissions.IsAuthenticated]  # Доступ разрешен только аутентифицированным пользователям
 
     def get(self, request, *args, **kwargs):
-        # Получение списка всех продуктов и общего количества пользователей
-        products = Product.objects.all()
+        # Получение всех продуктов с предварительно вычисленной статистикой и общего количества пользователей
+        products = Product.objects.select_related('stats').order_by('pk')
         total_users = User.objects.count()
 
-        data = []  # Итоговый список для хранения статистики каждого продукта
-        for product in products:
-            # Подсчет количества просмотренных уроков для каждого продукта
-            watched_lessons_count = UserLessonView.objects.filter(
-                lesson__included_in_products=product, is_viewed=True
-            ).count()
-
-            # Подсчет общего времени просмотра уроков для каждого продукта
-            total_viewed_time = UserLessonView.objects.filter(
-                lesson__included_in_products=product
-            ).aggregate(total_time=models.Sum('viewed_duration'))['total_time'] or 0
-
-            # Подсчет количества студентов для каждого продукта
-            students_count = product.users_with_access.count()
-
-            # Расчет процента приобретения продукта
-            acquisition_percentage = (students_count / total_users) * 100 if total_users > 0 else 0
-
-            # Добавление статистики продукта в итоговый список
-            data.append({
-                'product': product.title,
-                'watched_lessons_count': watched_lessons_count,
-                'total_viewed_time': total_viewed_time,
-                'students_count': students_count,
-                'acquisition_percentage': acquisition_percentage,
+        # Возвращение итогового списка статистики продуктов
+        return Response(product_statistics(products, total_users))
+
+
+def csv_response(rows, filename):
+    """
+    Потоковый ответ с файлом CSV, строки которого формируются по мере отправки.
+    """
+    response = StreamingHttpResponse(stream_csv(rows), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+class ProductStatisticExportView(ReplicaReadMixin, APIView):
+    """
+    Выгрузка в CSV статистики продуктов текущего пользователя-владельца в том же виде, что ProductStatisticView.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        # База данных выбирается сейчас: строки читаются уже после завершения обработки запроса
+        products = statistics_queryset(owner_id=request.user.pk)
+        return csv_response(statistics_rows(products.using(products.db)), 'product-statistics.csv')
+
+
+class ProductProgressExportView(ReplicaReadMixin, APIView):
+    """
+    Выгрузка в CSV прогресса всех пользователей по урокам продукта. Доступна только владельцу продукта.
+    """
+    permission_classes = [permissions.IsAuthenticated, IsOwner]
+
+    def get(self, request, product_id, *args, **kwargs):
+        product = get_object_or_404(Product.objects.only('pk', 'owner_id'), pk=product_id)
+        self.check_object_permissions(request, product)
+        rows = progress_queryset(product.pk)
+        return csv_response(progress_rows(rows.using(rows.db)), f'product-{product.pk}-progress.csv')
+
+
+class ProductStatisticTimeseriesView(ReplicaReadMixin, APIView):
+    """
+    Временной ряд статистики просмотров по продуктам: прирост времени просмотра, количество событий
+    просмотра и количество уроков, ставших просмотренными, за каждый час или сутки.
+
+    Параметры запроса:
+    - bucket: hour или day (по умолчанию day);
+    - from, to: границы интервала [from, to) — дата или дата и время ISO 8601 (UTC, если зона не указана);
+      по умолчанию — последние 30 суток или 48 часов;
+    - product: идентификатор продукта (по умолчанию все продукты).
+
+    Данные читаются только из агрегатов LessonViewRollup, которые строит команда compact_view_events,
+    поэтому запрос не зависит от размера журнала событий.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    default_periods = {LessonViewRollup.HOUR: datetime.timedelta(hours=48), LessonViewRollup.DAY: datetime.timedelta(days=30)}
+    bucket_sizes = {LessonViewRollup.HOUR: datetime.timedelta(hours=1), LessonViewRollup.DAY: datetime.timedelta(days=1)}
+    max_buckets = 2000
+
+    def get(self, request, *args, **kwargs):
+        bucket = request.query_params.get('bucket', LessonViewRollup.DAY)
+        if bucket not in self.bucket_sizes:
+            raise ValidationError({'bucket': f'Ожидается одно из значений: {", ".join(self.bucket_sizes)}.'})
+        end = self.parse_moment('to') or timezone.now()
+        start = self.parse_moment('from') or end - self.default_periods[bucket]
+        if start >= end:
+            raise ValidationError({'from': 'Начало интервала должно быть раньше конца.'})
+        if (end - start) / self.bucket_sizes[bucket] > self.max_buckets:
+            raise ValidationError(f'Интервал не может содержать более {self.max_buckets} значений {bucket}.')
+
+        rollups = LessonViewRollup.objects.filter(bucket=bucket, bucket_start__gte=start, bucket_start__lt=end)
+        product_id = request.query_params.get('product')
+        if product_id is not None:
+            if not product_id.isdigit():
+                raise ValidationError({'product': 'Ожидается идентификатор продукта.'})
+            rollups = rollups.filter(product_id=product_id)
+        points = rollups.values('product_id', 'product__title', 'bucket_start').annotate(
+            total_watched_seconds=Sum('watched_seconds'), total_events=Sum('events'), total_completed=Sum('completed'),
+        ).order_by('product_id', 'bucket_start')
+
+        series = {}
+        for point in points:
+            product = series.setdefault(point['product_id'], {
+                'product': {'id': point['product_id'], 'title': point['product__title']}, 'points': [],
             })
+            product['points'].append({
+                'bucket_start': point['bucket_start'],
+                'watched_seconds': point['total_watched_seconds'],
+                'events': point['total_events'],
+                'completed': point['total_completed'],
+            })
+        return Response({'bucket': bucket, 'from': start, 'to': end, 'results': list(series.values())})
 
-        # Возвращение итогового списка статистики продуктов
-        return Response(data)
+    def parse_moment(self, name):
+        """
+        Разбирает параметр запроса с датой или датой и временем; значение без часового пояса считается UTC.
+        """
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        try:
+            moment = parse_datetime(value)
+            if moment is None:
+                date = parse_date(value)
+                moment = datetime.datetime.combine(date, datetime.time()) if date else None
+        except ValueError:
+            moment = None
+        if moment is None:
+            raise ValidationError({name: 'Ожидается дата или дата и время в формате ISO 8601.'})
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment, datetime.timezone.utc)
+        return moment
+
+
+class MyProgressView(ReplicaReadMixin, APIView):
+    """
+    Прогресс текущего пользователя по каждому доступному ему продукту: количество просмотренных уроков,
+    количество уроков продукта и время просмотра. Прогресс читается одним запросом из предварительно
+    вычисленной таблицы UserProductProgress.
+    Ответы кэшируются до изменения доступов или прогресса пользователя либо каталога уроков и поддерживают ETag.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_cache_scopes(self, request, *args, **kwargs):
+        return [user_scope(request.user.pk), CATALOG]
+
+    @versioned_response_cache
+    def get(self, request, *args, **kwargs):
+        progress = UserProductProgress.objects.filter(user=request.user).select_related('product').only(
+            'completed_lessons', 'total_lessons', 'watched_seconds', 'product__id', 'product__title',
+        ).order_by('product_id')
+        return Response(UserProductProgressSerializer(progress, many=True).data)
+
+
+class BulkProductAccessView(APIView):
+    """
+    Массовая выдача (POST) и отзыв (DELETE) доступа к продукту. Доступно только владельцу продукта.
+
+    Пользователи передаются одним из способов:
+    - JSON {"user_ids": [1, 2, ...]};
+    - CSV с идентификаторами в первом столбце — телом запроса text/csv или файлом file в multipart/form-data.
+    CSV читается построчно и обрабатывается порциями по мере чтения.
+
+    Ответ содержит количество уникальных идентификаторов (requested), выданных или отозванных доступов
+    (granted или revoked), пользователей, у которых доступ уже был или которого не было (unchanged),
+    и несуществующих пользователей (unknown).
+    """
+    permission_classes = [permissions.IsAuthenticated, IsOwnerOrReadOnly]
+    parser_classes = [JSONParser, MultiPartParser, UserIdsCSVParser]
+
+    def post(self, request, product_id, format=None):
+        return self.change_access(request, product_id, revoke=False)
+
+    def delete(self, request, product_id, format=None):
+        return self.change_access(request, product_id, revoke=True)
+
+    def change_access(self, request, product_id, revoke):
+        product = get_object_or_404(Product.objects.only('pk', 'owner_id'), pk=product_id)
+        self.check_object_permissions(request, product)
+
+        counts = bulk_change_access(product.pk, self.limit(self.get_user_ids(request)), revoke=revoke)
+        return Response({
+            'requested': counts['requested'],
+            'revoked' if revoke else 'granted': counts['changed'],
+            'unchanged': counts['unchanged'],
+            'unknown': counts['unknown'],
+        })
+
+    def get_user_ids(self, request):
+        """
+        Возвращает итерируемые идентификаторы пользователей из тела запроса.
+        """
+        data = request.data
+        if request.content_type.startswith(UserIdsCSVParser.media_type):
+            return data
+        if 'file' in request.FILES:
+            return read_user_ids_from_file(request.FILES['file'])
+
+        user_ids = data.get('user_ids') if hasattr(data, 'get') else None
+        if not isinstance(user_ids, list):
+            raise ValidationError({'user_ids': 'Ожидается список идентификаторов пользователей или файл CSV.'})
+        if not all(isinstance(user_id, int) and not isinstance(user_id, bool) and user_id > 0 for user_id in user_ids):
+            raise ValidationError({'user_ids': 'Идентификаторы пользователей должны быть положительными целыми числами.'})
+        return user_ids
+
+    @staticmethod
+    def limit(user_ids):
+        for count, user_id in enumerate(user_ids, start=1):
+            if count > settings.ACCESS_BULK_MAX_USERS:
+                raise ValidationError(f'Запрос не может содержать более {settings.ACCESS_BULK_MAX_USERS} пользователей.')
+            yield user_id
+
+
+class ProgressBatchView(APIView):
+    """
+    Представление для пакетной записи прогресса просмотра уроков.
+
+    Принимает массив сигналов плеера вида {"lesson_id": ..., "viewed_duration": ..., "user_id": ...}.
+    Сигналы с одинаковыми парами (пользователь, урок) объединяются по максимальной длительности
+    и записываются одной вставкой с обновлением при конфликте.
+
+    Прогресс принимается только для уроков продуктов, к которым у пользователя сигнала есть доступ.
+
+    Ответ содержит количество полученных (received), объединенных (coalesced),
+    записанных (written) и пропущенных из-за несуществующих уроков или пользователей или отсутствия
+    доступа (skipped) сигналов. При включенной отложенной записи прогресс помещается в буфер, а ответ
+    со статусом 202 содержит количество принятых (accepted), отброшенных из-за переполнения буфера (dropped)
+    и пропущенных (skipped) сигналов.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, format=None):
+        if not isinstance(request.data, list):
+            raise ValidationError('Ожидается массив сигналов прогресса.')
+
+        serializer = ProgressHeartbeatSerializer(data=request.data, many=True, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        heartbeats = [
+            (item.get('user_id', request.user.pk), item['lesson_id'], item['viewed_duration'])
+            for item in serializer.validated_data
+        ]
+
+        # Сигналы других пользователей (доступны сотрудникам) допускаются только для существующих пользователей
+        user_ids = {user_id for user_id, _, _ in heartbeats} - {request.user.pk}
+        if user_ids:
+            known_user_ids = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+            heartbeats = [
+                heartbeat for heartbeat in heartbeats
+                if heartbeat[0] == request.user.pk or heartbeat[0] in known_user_ids
+            ]
+
+        progress, coalesced = coalesce_heartbeats(heartbeats)
+        accessible = filter_accessible_progress(progress)
+        skipped = len(serializer.validated_data) - len(heartbeats) + len(progress) - len(accessible)
+        progress = accessible
+
+        progress_buffer = get_progress_buffer()
+        if progress_buffer is not None:
+            # Отложенная запись: прогресс записывается фоновым потоком, запрос не ждет базу данных
+            accepted = progress_buffer.add_many(progress)
+            return Response({
+                'received': len(serializer.validated_data),
+                'coalesced': coalesced,
+                'accepted': accepted,
+                'dropped': len(progress) - accepted,
+                'skipped': skipped,
+            }, status=status.HTTP_202_ACCEPTED)
+
+        result = write_progress(progress)
+        return Response({
+            'received': len(serializer.validated_data),
+            'coalesced': coalesced,
+            'written': result['written'],
+            'skipped': skipped + result['skipped'],
+        })
+
+
+def metrics_view(request):
+    """
+    Метрики приложения в текстовом формате Prometheus.
+    """
+    return HttpResponse(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
+class TokenView(APIView):
+    """
+    Подписанные токены аутентификации (HQapp.tokens).
+
+    POST с именем пользователя и паролем выдает токен для заголовка "Authorization: Bearer <токен>";
+    DELETE отзывает все токены текущего пользователя.
+    """
+
+    def get_permissions(self):
+        if self.request.method == 'DELETE':
+            return [permissions.IsAuthenticated()]
+        return [permissions.AllowAny()]
+
+    def post(self, request, format=None):
+        serializer = TokenObtainSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        return Response({
+            'token': create_token(serializer.validated_data['user']),
+            'expires_in': settings.TOKEN_AUTH['MAX_AGE'],
+        })
+
+    def delete(self, request, format=None):
+        revoke_tokens(request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@require_safe
+def openapi_schema_view(request):
+    """
+    Статическая схема OpenAPI с ETag и долгим кэшированием (см. HQapp.schema).
+    """
+    content, etag = load_schema()
+    response = get_conditional_response(request, etag=etag) or HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=settings.OPENAPI_SCHEMA['MAX_AGE'])
+    return response
+
+
+class OpenAPIDocsView(TemplateView):
+    """
+    Страница документации API (Swagger UI или ReDoc), загружающая статическую схему OpenAPI.
+    """
+
+    def get(self, request, *args, **kwargs):
+        response = super().get(request, *args, **kwargs)
+        patch_cache_control(response, public=True, max_age=settings.OPENAPI_SCHEMA['MAX_AGE'])
+        return response